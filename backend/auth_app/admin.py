@@ -1,19 +1,121 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth import get_user_model
-from .models import PasskeyCredential
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max, Q
+from django.utils.functional import cached_property
+from webauthn.helpers import base64url_to_bytes
+from .models import PasskeyCredential, credential_digest
 
 User = get_user_model()
 
 
+def estimated_count(queryset):
+    """Return the database's row estimate for the queryset's table, or None."""
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        # -1 until the table is first analyzed
+        return int(row[0]) if row and row[0] >= 0 else None
+    # Elsewhere the highest key: one index probe, high by the rows deleted
+    return queryset.model._default_manager.using(queryset.db).aggregate(
+        highest=Max('pk')
+    )['highest'] or 0
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that never counts a large table in full.
+
+    An unfiltered changelist uses :func:`estimated_count` once it exceeds
+    ``max_count`` rows; anything else is counted up to ``max_count``.
+    """
+
+    max_count = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.has_filters():
+            estimate = estimated_count(queryset)
+            if estimate is not None and estimate > self.max_count:
+                return estimate
+        return queryset[:self.max_count].count()
+
+
+def prefix_condition(field, prefix, vendor):
+    """A case-sensitive prefix match on ``field`` that its index can answer.
+
+    PostgreSQL serves ``LIKE 'prefix%'`` from the ``*_like`` pattern_ops index
+    Django adds to indexed text columns, under any collation.  SQLite's
+    ``LIKE`` ignores case and skips the index, so there the prefix becomes a
+    range, which is exact under SQLite's code point ordering.
+    """
+    if vendor == 'sqlite':
+        return Q(**{f'{field}__gte': prefix, f'{field}__lt': prefix + '\U0010ffff'})
+    return Q(**{f'{field}__startswith': prefix})
+
+
+class LargeTableAdminMixin:
+    """Changelist settings for tables with millions of rows.
+
+    ``search_fields`` only take ``=field`` (exact) and ``^field`` (prefix)
+    entries, and both are matched case-sensitively so the column's index can
+    answer them (see :func:`prefix_condition`).
+    """
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_condition(self, search_term, vendor):
+        condition = Q()
+        for field in self.search_fields:
+            if field.startswith('^'):
+                condition |= prefix_condition(field[1:], search_term, vendor)
+            else:
+                condition |= Q(**{field.lstrip('='): search_term})
+        return condition
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        vendor = connections[queryset.db].vendor
+        return queryset.filter(self.get_search_condition(search_term, vendor)), False
+
+
 @admin.register(User)
-class UserAdmin(BaseUserAdmin):
-    pass
+class UserAdmin(LargeTableAdminMixin, BaseUserAdmin):
+    search_fields = ('^username', '=email')
 
 
 @admin.register(PasskeyCredential)
-class PasskeyCredentialAdmin(admin.ModelAdmin):
-    list_display = ('user', 'credential_id', 'counter', 'created_at')
+class PasskeyCredentialAdmin(LargeTableAdminMixin, admin.ModelAdmin):
+    list_display = ('user', 'name', 'credential_id_b64', 'counter', 'created_at')
+    list_select_related = ('user',)
     list_filter = ('created_at',)
-    search_fields = ('user__username', 'credential_id')
+    search_fields = ('^user__username',)
+    date_hierarchy = 'created_at'
+    # Matches passkey_created_idx, so a date range is one index scan
+    ordering = ('-created_at', '-id')
+    raw_id_fields = ('user',)
+
+    @admin.display(description='credential id')
+    def credential_id_b64(self, obj):
+        return obj.credential_id_b64
 
+    def get_search_condition(self, search_term, vendor):
+        """Also match a full base64url credential ID through its digest."""
+        condition = super().get_search_condition(search_term, vendor)
+        try:
+            credential_id = base64url_to_bytes(search_term)
+        except ValueError:
+            credential_id = None
+        if credential_id:
+            condition |= Q(credential_digest=credential_digest(credential_id))
+        return condition
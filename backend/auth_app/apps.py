@@ -0,0 +1,16 @@
+from django.apps import AppConfig
+
+
+class AuthAppConfig(AppConfig):
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "auth_app"
+
+    def ready(self):
+        from django.conf import settings
+
+        from . import signals  # noqa: F401
+        from . import tokens
+
+        if settings.ACCESS_TOKENS:
+            # Refuse to start with a missing or guessable signing key
+            tokens.signing_key()
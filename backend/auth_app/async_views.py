@@ -0,0 +1,409 @@
+"""Native async implementations of the ceremony endpoints.
+
+These mirror the DRF views in :mod:`auth_app.views` but use Django's async ORM,
+so a ceremony waiting on the database does not hold a thread.  The final
+writes of a ceremony form one transaction, which Django can only run on a
+single thread, so they are made in one ``sync_to_async`` hop (see
+:func:`auth_app.db.arun_with_retry`).  Signature verification is CPU bound and runs on the verification
+executor (see :mod:`auth_app.verification`), off the event loop.
+They are routed in place of the sync views when ``settings.ASYNC_VIEWS`` is
+enabled; see :mod:`auth_app.urls`.
+"""
+
+from django.conf import settings
+from django.contrib.auth import get_user_model, login
+from django.db.models import Q
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework import status
+from webauthn.helpers import base64url_to_bytes
+
+from . import reservations, tokens
+from .ceremonies import (
+    PASSKEY_SESSION_KEY,
+    authentication_options,
+    decode_credential_id,
+    decode_user_handle,
+    registration_options,
+    user_payload,
+    verify_authentication,
+    verify_registration,
+)
+from .challenges import (
+    AUTHENTICATION,
+    REGISTRATION,
+    PendingCeremony,
+    afinish_ceremony,
+    begin_ceremony,
+)
+from .db import arun_with_retry
+from .descriptors import alogin_descriptors
+from .instrumentation import (
+    BUSY,
+    INVALID_CHALLENGE,
+    VERIFICATION_FAILED,
+    phase,
+    set_outcome,
+)
+from .models import PasskeyCredential
+from .renderers import FastJsonResponse, loads
+from .snapshots import add_validators, asession_snapshot, conditional_response
+from .verification import VerifierBusy, get_verifier
+from .writebehind import advance_counter, current_counter
+
+User = get_user_model()
+
+
+def _error(message, status_code=status.HTTP_400_BAD_REQUEST):
+    return FastJsonResponse({"error": message}, status=status_code)
+
+
+def _request_data(request):
+    """Decode a JSON body the way DRF's parser would, or return ``None``."""
+    try:
+        data = loads(request.body or b"{}")
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _busy_response(retry_after, message="Verification queue is full"):
+    set_outcome(BUSY)
+    response = _error(message, status.HTTP_503_SERVICE_UNAVAILABLE)
+    response["Retry-After"] = str(retry_after)
+    return response
+
+
+@csrf_exempt
+@require_POST
+async def register_start(request):
+    """Start passkey registration process."""
+    data = _request_data(request)
+    if data is None:
+        return _error("Invalid JSON body")
+    username = data.get("username")
+    email = data.get("email")
+
+    if not username or not email:
+        return _error("Username and email are required")
+
+    # Check if user already exists (one query for both unique fields)
+    with phase("lookup"):
+        taken = [
+            taken_username
+            async for taken_username in User.objects.filter(
+                Q(username=username) | Q(email=email)
+            ).values_list("username", flat=True)[:2]
+        ]
+    if taken:
+        field = "Username" if username in taken else "Email"
+        return _error(f"{field} already exists")
+
+    with phase("options"):
+        challenge, user_id, options_dict = registration_options(username)
+
+    # Hold the username and email until the challenge expires
+    with phase("reserve"):
+        conflict = await reservations.areserve(username, email, challenge)
+    if conflict:
+        return _error(f"{conflict.capitalize()} is already being registered")
+
+    # Store challenge and user data
+    ceremony = PendingCeremony(username=username, email=email, user_id=user_id)
+    with phase("challenge"):
+        options_dict.update(begin_ceremony(REGISTRATION, challenge, ceremony))
+
+    return FastJsonResponse(options_dict)
+
+
+@csrf_exempt
+@require_POST
+async def register_complete(request):
+    """Complete passkey registration process."""
+    data = _request_data(request)
+    if data is None:
+        return _error("Invalid JSON body")
+    credential_json = data.get("credential")
+    challenge_b64 = data.get("challenge")
+
+    if not credential_json or not challenge_b64:
+        return _error("Credential and challenge are required")
+
+    # Take a verification slot before the challenge is consumed, so a busy
+    # answer leaves the ceremony intact for the client to retry
+    verifier = get_verifier()
+    try:
+        slot = verifier.reserve()
+    except VerifierBusy as e:
+        return _busy_response(e.retry_after, str(e))
+
+    with slot:
+        # Retrieve stored challenge data
+        try:
+            challenge = base64url_to_bytes(challenge_b64)
+            with phase("challenge"):
+                stored_data = await afinish_ceremony(
+                    REGISTRATION, challenge, data.get("challengeToken")
+                )
+
+            if not stored_data:
+                set_outcome(INVALID_CHALLENGE)
+                return _error("Invalid or expired challenge")
+        except Exception:
+            set_outcome(INVALID_CHALLENGE)
+            return _error("Invalid challenge format")
+
+        # Another signup took the username or email; fail before verifying
+        with phase("reserve"):
+            held = await reservations.aholds(
+                stored_data.username, stored_data.email, challenge
+            )
+        if not held:
+            return _error(
+                "Username or email is held by another registration",
+                status.HTTP_409_CONFLICT,
+            )
+
+        try:
+            with phase("verification"):
+                verification = await verifier.arun(
+                    verify_registration, credential_json, challenge, slot=slot
+                )
+
+            def create_and_login():
+                with phase("create"):
+                    # Create user
+                    user = User.objects.create_user(
+                        username=stored_data.username,
+                        email=stored_data.email,
+                        user_handle=stored_data.user_id,
+                    )
+
+                    # Store passkey credential
+                    passkey = PasskeyCredential.objects.create(
+                        user=user,
+                        credential_id=verification.credential_id,
+                        public_key=verification.credential_public_key,
+                        counter=verification.sign_count,
+                    )
+
+                # Log user in
+                with phase("login"):
+                    login(request, user)
+                    request.session[PASSKEY_SESSION_KEY] = passkey.pk
+                return user, passkey
+
+            # The transaction has to run on one thread, so the writes are sync
+            # and happen in a single hop; retried if it loses a write-lock race
+            user, passkey = await arun_with_retry(create_and_login)
+
+            return FastJsonResponse(
+                {
+                    "message": "Registration successful",
+                    "user": user_payload(user),
+                    **tokens.login_token(request, user, passkey),
+                }
+            )
+
+        except VerifierBusy as e:
+            return _busy_response(e.retry_after, str(e))
+        except Exception as e:
+            set_outcome(VERIFICATION_FAILED)
+            return _error(f"Verification failed: {str(e)}")
+        finally:
+            await reservations.arelease(
+                stored_data.username, stored_data.email, challenge
+            )
+
+
+@csrf_exempt
+@require_POST
+async def login_start(request):
+    """Start passkey authentication process."""
+    data = _request_data(request)
+    if data is None:
+        return _error("Invalid JSON body")
+    username = data.get("username")
+
+    if not username and settings.WEBAUTHN_DISCOVERABLE_LOGIN:
+        # Username-less login: the authenticator picks a discoverable
+        # credential and reports its user handle, so no lookup is needed here
+        with phase("options"):
+            challenge, options_dict = authentication_options([])
+        with phase("challenge"):
+            options_dict.update(
+                begin_ceremony(AUTHENTICATION, challenge, PendingCeremony())
+            )
+        return FastJsonResponse(options_dict)
+
+    if not username:
+        return _error("Username is required")
+
+    # Get the user's passkeys (cached; at most one query)
+    with phase("descriptors"):
+        descriptors = await alogin_descriptors(username)
+    if descriptors is None:
+        return _error("User not found", status.HTTP_404_NOT_FOUND)
+
+    user_id, credential_ids = descriptors
+    if not credential_ids:
+        return _error("No passkeys registered for this user")
+
+    with phase("options"):
+        challenge, options_dict = authentication_options(credential_ids)
+
+    # Store challenge with user ID
+    ceremony = PendingCeremony(username=username, user_id=user_id)
+    with phase("challenge"):
+        options_dict.update(begin_ceremony(AUTHENTICATION, challenge, ceremony))
+
+    return FastJsonResponse(options_dict)
+
+
+@csrf_exempt
+@require_POST
+async def login_complete(request):
+    """Complete passkey authentication process."""
+    data = _request_data(request)
+    if data is None:
+        return _error("Invalid JSON body")
+    credential_json = data.get("credential")
+    challenge_b64 = data.get("challenge")
+
+    if not credential_json or not challenge_b64:
+        return _error("Credential and challenge are required")
+
+    # Take a verification slot before the challenge is consumed, so a busy
+    # answer leaves the ceremony intact for the client to retry
+    verifier = get_verifier()
+    try:
+        slot = verifier.reserve()
+    except VerifierBusy as e:
+        return _busy_response(e.retry_after, str(e))
+
+    with slot:
+        try:
+            challenge = base64url_to_bytes(challenge_b64)
+            with phase("challenge"):
+                stored_data = await afinish_ceremony(
+                    AUTHENTICATION, challenge, data.get("challengeToken")
+                )
+
+            if not stored_data:
+                set_outcome(INVALID_CHALLENGE)
+                return _error("Invalid or expired challenge")
+
+            credential_id = decode_credential_id(credential_json)
+            if not credential_id:
+                return _error("Credential ID not found")
+
+            # Scope the lookup to the user who started the login or, for a
+            # username-less login, to the user handle the authenticator returned
+            if stored_data.user_id is not None:
+                owner = {"user_id": stored_data.user_id}
+            else:
+                user_handle = decode_user_handle(credential_json)
+                if not user_handle:
+                    return _error("User handle not found")
+                owner = {"user__user_handle": user_handle}
+
+            # One indexed probe fetches the credential and its user together
+            try:
+                with phase("lookup"):
+                    passkey = await (
+                        PasskeyCredential.objects.select_related("user")
+                        .for_credential_id(credential_id)
+                        .aget(**owner)
+                    )
+            except PasskeyCredential.DoesNotExist:
+                return _error(
+                    "Credential not found for this user", status.HTTP_404_NOT_FOUND
+                )
+            user = passkey.user
+            # Include a counter change that is still buffered (LOGIN_WRITE_BEHIND)
+            passkey.counter = current_counter(passkey)
+
+            with phase("verification"):
+                verification = await verifier.arun(
+                    verify_authentication,
+                    credential_json,
+                    challenge,
+                    bytes(passkey.public_key),
+                    passkey.counter,
+                    slot=slot,
+                )
+
+            verified_counter = passkey.counter
+
+            def advance_and_login():
+                # A retry starts again from the counter that was verified
+                passkey.counter = verified_counter
+                # Update counter
+                with phase("counter"):
+                    if not advance_counter(passkey, verification.new_sign_count):
+                        return False
+
+                # Log user in
+                with phase("login"):
+                    login(request, user)
+                    request.session[PASSKEY_SESSION_KEY] = passkey.pk
+                return True
+
+            # One transaction in a single sync hop, retried on lock contention
+            if not await arun_with_retry(advance_and_login):
+                return _error(
+                    "Sign counter conflict: the credential may be cloned",
+                    status.HTTP_409_CONFLICT,
+                )
+
+            return FastJsonResponse(
+                {
+                    "message": "Login successful",
+                    "user": user_payload(user),
+                    **tokens.login_token(request, user, passkey),
+                }
+            )
+
+        except VerifierBusy as e:
+            return _busy_response(e.retry_after, str(e))
+        except Exception as e:
+            set_outcome(VERIFICATION_FAILED)
+            return _error(f"Verification failed: {str(e)}")
+
+
+@require_GET
+async def user_info(request):
+    """Get current authenticated user info."""
+    snapshot = await asession_snapshot(request)
+    if snapshot is None:
+        return FastJsonResponse(
+            {"detail": "Authentication credentials were not provided."},
+            status=status.HTTP_403_FORBIDDEN,
+        )
+    response = conditional_response(request, snapshot)
+    if response is None:
+        response = add_validators(FastJsonResponse(snapshot.payload), snapshot)
+    return response
+
+
+@require_POST
+async def token_refresh(request):
+    """Issue a new access token for the signed-in session."""
+    snapshot = await asession_snapshot(request)
+    if snapshot is None:
+        return FastJsonResponse(
+            {"detail": "Authentication credentials were not provided."},
+            status=status.HTTP_403_FORBIDDEN,
+        )
+    if not settings.ACCESS_TOKENS:
+        return _error("Access tokens are disabled", status.HTTP_404_NOT_FOUND)
+    credential_id = await request.session.aget(tokens.CREDENTIAL_SESSION_KEY)
+    if credential_id is None:
+        return _error(
+            "Sign in with a passkey again to get an access token",
+            status.HTTP_409_CONFLICT,
+        )
+    return FastJsonResponse(
+        tokens.token_fields(snapshot.pk, snapshot.username, credential_id),
+        headers={"Cache-Control": "no-store"},
+    )
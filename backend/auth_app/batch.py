@@ -0,0 +1,187 @@
+"""Verify many login assertions in one request, for gateways and services.
+
+``POST /api/auth/assertions/verify/`` takes ``{"assertions": [{"credential",
+"challenge", "challengeToken"}, ...]}``: the same fields as ``login_complete``,
+for challenges issued by ``login_start``.  Instead of one request per login
+it costs one ``IN`` query for all credentials (with their users), one
+verification batch spread over the executor's processes and one ``UPDATE``
+for all sign counters.  Nobody is signed in: no session is created and
+``last_login`` is not touched.  Each assertion gets its own result, in order.
+
+The endpoint is for trusted services only.  Callers authenticate with
+``Authorization: Bearer <settings.ASSERTION_BATCH_TOKEN>``; while the setting
+is empty every request is refused.
+"""
+
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
+from rest_framework.permissions import BasePermission
+from webauthn.helpers import base64url_to_bytes
+
+from .ceremonies import (
+    decode_credential_id,
+    decode_user_handle,
+    user_payload,
+    verify_authentication,
+)
+from .challenges import AUTHENTICATION, finish_ceremony
+from .db import run_with_retry
+from .instrumentation import phase
+from .models import PasskeyCredential, credential_digest
+from .writebehind import advance_counters, current_counter
+
+
+class ServiceTokenPermission(BasePermission):
+    """Allow requests bearing ``settings.ASSERTION_BATCH_TOKEN``."""
+
+    def has_permission(self, request, view):
+        token = settings.ASSERTION_BATCH_TOKEN
+        scheme, _, credentials = request.META.get("HTTP_AUTHORIZATION", "").partition(" ")
+        return (
+            bool(token)
+            and scheme.lower() == "bearer"
+            and constant_time_compare(credentials.strip(), token)
+        )
+
+
+class _Assertion:
+    """One item of a batch on its way through verification."""
+
+    def __init__(self, credential_json, challenge, ceremony, credential_id):
+        self.credential_json = credential_json
+        self.challenge = challenge
+        self.ceremony = ceremony
+        self.credential_id = credential_id
+        self.passkey = None
+        self.verification = None
+
+
+def _failure(message):
+    return {"ok": False, "error": message}
+
+
+def _claim(item):
+    """Consume an item's challenge; return an :class:`_Assertion` or a failure."""
+    if not isinstance(item, dict):
+        return _failure("Credential and challenge are required")
+    credential_json = item.get("credential")
+    challenge_b64 = item.get("challenge")
+    if not isinstance(credential_json, dict) or not isinstance(challenge_b64, str):
+        return _failure("Credential and challenge are required")
+    try:
+        challenge = base64url_to_bytes(challenge_b64)
+    except ValueError:
+        return _failure("Invalid or expired challenge")
+    ceremony = finish_ceremony(AUTHENTICATION, challenge, item.get("challengeToken"))
+    if not ceremony:
+        return _failure("Invalid or expired challenge")
+    credential_id = decode_credential_id(credential_json)
+    if not credential_id:
+        return _failure("Credential ID not found")
+    return _Assertion(credential_json, challenge, ceremony, credential_id)
+
+
+def _owns(assertion, passkey):
+    """Whether ``passkey`` belongs to the user the assertion's login is for."""
+    if assertion.ceremony.user_id is not None:
+        return passkey.user_id == assertion.ceremony.user_id
+    user_handle = decode_user_handle(assertion.credential_json)
+    return (
+        user_handle is not None
+        and passkey.user.user_handle is not None
+        and bytes(passkey.user.user_handle) == user_handle
+    )
+
+
+def verify_assertions(items, verifier, slot=None):
+    """Verify a list of assertion items; returns one result dict per item.
+
+    ``slot`` is a reservation from ``verifier.reserve()`` to verify with.
+    """
+    results = [None] * len(items)
+    assertions = {}
+    with phase("challenge"):
+        for index, item in enumerate(items):
+            claimed = _claim(item)
+            if isinstance(claimed, _Assertion):
+                assertions[index] = claimed
+            else:
+                results[index] = claimed
+
+    # One indexed IN query fetches every credential and its user
+    with phase("lookup"):
+        passkeys = {
+            passkey.credential_digest: passkey
+            for passkey in PasskeyCredential.objects.select_related("user").filter(
+                credential_digest__in={
+                    credential_digest(assertion.credential_id)
+                    for assertion in assertions.values()
+                }
+            )
+        }
+    for index, assertion in list(assertions.items()):
+        passkey = passkeys.get(credential_digest(assertion.credential_id))
+        if passkey is None or not _owns(assertion, passkey):
+            results[index] = _failure("Credential not found for this user")
+            del assertions[index]
+        else:
+            assertion.passkey = passkey
+    for passkey in passkeys.values():
+        # Include a counter change that is still buffered (LOGIN_WRITE_BEHIND)
+        passkey.counter = current_counter(passkey)
+
+    with phase("verification"):
+        outcomes = verifier.run_many(
+            verify_authentication,
+            [
+                (
+                    assertion.credential_json,
+                    assertion.challenge,
+                    bytes(assertion.passkey.public_key),
+                    assertion.passkey.counter,
+                )
+                for assertion in assertions.values()
+            ],
+            slot=slot,
+        )
+    changes = {}
+    for (index, assertion), outcome in zip(list(assertions.items()), outcomes):
+        if isinstance(outcome, Exception):
+            results[index] = _failure(f"Verification failed: {outcome}")
+            del assertions[index]
+        elif assertion.passkey in changes and assertion.passkey.counter not in (
+            changes[assertion.passkey], outcome.new_sign_count
+        ):
+            # Two logins of one credential in the batch that both move its counter
+            results[index] = _failure("Sign counter conflict: the credential may be cloned")
+            del assertions[index]
+        else:
+            assertion.verification = outcome
+            # One login may leave the counter where it was while another advances it
+            changes[assertion.passkey] = max(
+                changes.get(assertion.passkey, outcome.new_sign_count),
+                outcome.new_sign_count,
+            )
+
+    verified_counters = {passkey: passkey.counter for passkey in changes}
+
+    def store_counters():
+        # A retry starts again from the counters that were verified
+        for passkey, counter in verified_counters.items():
+            passkey.counter = counter
+        return advance_counters(changes)
+
+    with phase("counter"):
+        moved = run_with_retry(store_counters) if changes else []
+
+    for index, assertion in assertions.items():
+        if assertion.passkey in moved:
+            results[index] = _failure("Sign counter conflict: the credential may be cloned")
+        else:
+            results[index] = {
+                "ok": True,
+                "user": user_payload(assertion.passkey.user),
+                "passkey": assertion.passkey.pk,
+                "userVerified": assertion.verification.user_verified,
+            }
+    return results
@@ -0,0 +1,224 @@
+"""WebAuthn ceremony steps shared by the sync and async views.
+
+Nothing in here touches the database or the request, so the same helpers can
+be called from DRF views, async views, or a worker pool.  The parts of the
+ceremony options that only depend on settings are built once; each start
+request only adds its challenge, user and credential IDs.
+"""
+
+import functools
+import secrets
+
+from django.conf import settings
+from webauthn import (
+    generate_registration_options,
+    verify_registration_response,
+    generate_authentication_options,
+    verify_authentication_response,
+)
+from webauthn.helpers import (
+    bytes_to_base64url,
+    base64url_to_bytes,
+    generate_challenge,
+    parse_registration_credential_json,
+    parse_authentication_credential_json,
+)
+from webauthn.helpers.structs import (
+    AttestationConveyancePreference,
+    AuthenticatorSelectionCriteria,
+    ResidentKeyRequirement,
+    UserVerificationRequirement,
+)
+
+from .instrumentation import phase
+from .mds import attestation_roots
+
+EXPECTED_ORIGIN = "http://localhost:3000"
+
+
+@functools.lru_cache(maxsize=None)
+def _registration_fragments():
+    """Return the ``(rp, rest)`` registration options that only depend on settings.
+
+    Computed once (see :func:`reset_static_options`) and shared by every
+    response, so callers must not mutate them.
+    """
+    authenticator_selection = None
+    if settings.WEBAUTHN_DISCOVERABLE_LOGIN:
+        # Ask for a client-side discoverable credential so the user can
+        # later sign in without typing a username
+        authenticator_selection = AuthenticatorSelectionCriteria(
+            resident_key=ResidentKeyRequirement.PREFERRED,
+        )
+
+    # Placeholder user: only the settings-derived fields are kept
+    options = generate_registration_options(
+        rp_id=settings.RP_ID,
+        rp_name=settings.RP_NAME,
+        user_id=b"\0",
+        user_name="-",
+        timeout=settings.WEBAUTHN_TIMEOUT,
+        authenticator_selection=authenticator_selection,
+        # Attestation has to be asked for, or browsers send "none"
+        attestation=AttestationConveyancePreference.DIRECT
+        if settings.WEBAUTHN_REQUIRE_ATTESTATION
+        else AttestationConveyancePreference.NONE,
+    )
+
+    rp = {
+        "id": options.rp.id,
+        "name": options.rp.name,
+    }
+    rest = {
+        "pubKeyCredParams": [
+            {"alg": alg.alg.value, "type": alg.type}
+            for alg in options.pub_key_cred_params
+        ],
+        "authenticatorSelection": {
+            "authenticatorAttachment": options.authenticator_selection.authenticator_attachment.value
+            if options.authenticator_selection
+            and options.authenticator_selection.authenticator_attachment
+            else None,
+            "userVerification": options.authenticator_selection.user_verification.value
+            if options.authenticator_selection
+            else UserVerificationRequirement.PREFERRED.value,
+            "requireResidentKey": options.authenticator_selection.require_resident_key
+            if options.authenticator_selection
+            else False,
+        },
+        "timeout": options.timeout,
+        "attestation": options.attestation.value,
+    }
+    if options.authenticator_selection and options.authenticator_selection.resident_key:
+        rest["authenticatorSelection"]["residentKey"] = (
+            options.authenticator_selection.resident_key.value
+        )
+    return rp, rest
+
+
+@functools.lru_cache(maxsize=None)
+def _authentication_fragment():
+    """Return the authentication options that only depend on settings."""
+    options = generate_authentication_options(
+        rp_id=settings.RP_ID,
+        user_verification=UserVerificationRequirement.PREFERRED,
+        timeout=settings.WEBAUTHN_TIMEOUT,
+    )
+    return {
+        "timeout": options.timeout,
+        "userVerification": options.user_verification.value,
+        "rpId": options.rp_id,
+    }
+
+
+def reset_static_options():
+    """Recompute the cached option fragments, e.g. after a settings change."""
+    _registration_fragments.cache_clear()
+    _authentication_fragment.cache_clear()
+
+
+def registration_options(username):
+    """Return ``(challenge, user_id, options_dict)`` for a new registration."""
+    # Create user (but don't save yet - will save after passkey verification)
+    user_id = secrets.token_bytes(16)
+    challenge = generate_challenge()
+
+    rp, rest = _registration_fragments()
+    options_dict = {
+        "challenge": bytes_to_base64url(challenge),
+        "rp": rp,
+        "user": {
+            "id": bytes_to_base64url(user_id),
+            "name": username,
+            "displayName": username,
+        },
+        **rest,
+    }
+    return challenge, user_id, options_dict
+
+
+def authentication_options(credential_ids):
+    """Return ``(challenge, options_dict)`` for raw ``credential_ids``."""
+    challenge = generate_challenge()
+    options_dict = {
+        "challenge": bytes_to_base64url(challenge),
+        "allowCredentials": [
+            {
+                "id": bytes_to_base64url(bytes(credential_id)),
+                "type": "public-key",
+            }
+            for credential_id in credential_ids
+        ],
+        **_authentication_fragment(),
+    }
+    return challenge, options_dict
+
+
+def verify_registration(credential_json, challenge):
+    """Parse and verify an attestation response."""
+    with phase("parse"):
+        credential = parse_registration_credential_json(credential_json)
+    with phase("metadata"):
+        root_certs = attestation_roots(credential.response.attestation_object)
+    with phase("verify"):
+        return verify_registration_response(
+            credential=credential,
+            expected_challenge=challenge,
+            expected_rp_id=settings.RP_ID,
+            expected_origin=EXPECTED_ORIGIN,
+            pem_root_certs_bytes_by_fmt=root_certs,
+        )
+
+
+def verify_authentication(credential_json, challenge, public_key, sign_count):
+    """Parse and verify an assertion response against a stored public key."""
+    with phase("parse"):
+        credential = parse_authentication_credential_json(credential_json)
+    with phase("verify"):
+        return verify_authentication_response(
+            credential=credential,
+            expected_challenge=challenge,
+            expected_rp_id=settings.RP_ID,
+            expected_origin=EXPECTED_ORIGIN,
+            credential_public_key=public_key,
+            credential_current_sign_count=sign_count,
+        )
+
+
+def decode_credential_id(credential_json):
+    """Return the raw credential ID from a response, or ``None``.
+
+    ``rawId`` and ``id`` are both base64url encodings of the same bytes, so
+    decoding either gives the one canonical form stored in the database.
+    """
+    encoded = credential_json.get("rawId") or credential_json.get("id")
+    if not isinstance(encoded, str):
+        return None
+    try:
+        return base64url_to_bytes(encoded) or None
+    except ValueError:
+        return None
+
+
+def decode_user_handle(credential_json):
+    """Return the raw user handle from an assertion response, or ``None``."""
+    response = credential_json.get("response")
+    encoded = response.get("userHandle") if isinstance(response, dict) else None
+    if not isinstance(encoded, str):
+        return None
+    try:
+        return base64url_to_bytes(encoded) or None
+    except ValueError:
+        return None
+
+
+# Session key holding the primary key of the passkey the user signed in with
+PASSKEY_SESSION_KEY = "passkey_id"
+
+
+def user_payload(user):
+    return {
+        "id": user.id,
+        "username": user.username,
+        "email": user.email,
+    }
@@ -0,0 +1,237 @@
+"""Storage for WebAuthn challenges that are waiting for a ``*_complete`` call.
+
+Two modes are supported, selected by ``settings.CHALLENGE_MODE``:
+
+* ``"memory"`` keeps pending ceremonies in a per-process :class:`ChallengeStore`,
+  so the complete step must reach the worker that ran the start step.
+* ``"token"`` encrypts the pending ceremony into a ``challengeToken`` that the
+  client echoes back, so any worker can complete it.  A replay cache in the
+  Django cache framework keeps each challenge single-use.
+"""
+
+import base64
+import functools
+import hmac
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional, Union
+
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.crypto import salted_hmac
+from webauthn.helpers import base64url_to_bytes, bytes_to_base64url
+
+REGISTRATION = "registration"
+AUTHENTICATION = "authentication"
+
+
+class PendingCeremony(NamedTuple):
+    """Data remembered between the start and complete steps of a ceremony."""
+
+    username: Optional[str] = None
+    email: Optional[str] = None
+    user_id: Union[bytes, int, None] = None
+
+
+class ChallengeStore:
+    """Thread-safe challenge map with a per-entry TTL and a hard size cap.
+
+    Every entry gets the same TTL, so insertion order is also expiry order:
+    expired entries are swept from the head on each write, and at most every
+    ``sweep_interval`` seconds (one TTL by default) on reads, so a worker that
+    only completes ceremonies still drops them.  Once the cap is reached the
+    oldest pending ceremony is evicted.
+    """
+
+    def __init__(self, ttl, max_entries, sweep_interval=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.sweep_interval = ttl if sweep_interval is None else sweep_interval
+        self._entries = OrderedDict()  # challenge -> (expires_at, PendingCeremony)
+        self._lock = threading.Lock()
+        self._next_sweep = time.monotonic() + self.sweep_interval
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def put(self, challenge, ceremony):
+        """Remember ``ceremony`` until ``challenge`` is used or expires."""
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            self._entries[challenge] = (now + self.ttl, ceremony)
+            self._entries.move_to_end(challenge)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, challenge):
+        """Remove and return the ceremony for ``challenge``, or ``None``."""
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now)
+            entry = self._entries.pop(challenge, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, ceremony = entry
+            if expires_at <= now:
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.hits += 1
+            return ceremony
+
+    def sweep(self):
+        """Drop every expired entry and return how many were removed."""
+        with self._lock:
+            return self._sweep(time.monotonic())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+            }
+
+    def _sweep(self, now):
+        self._next_sweep = now + self.sweep_interval
+        removed = 0
+        entries = self._entries
+        while entries:
+            challenge, (expires_at, _) = next(iter(entries.items()))
+            if expires_at > now:
+                break
+            del entries[challenge]
+            removed += 1
+        self.expirations += removed
+        return removed
+
+
+challenge_store = ChallengeStore(
+    ttl=settings.WEBAUTHN_TIMEOUT / 1000,
+    max_entries=settings.CHALLENGE_STORE_MAX_ENTRIES,
+)
+
+
+def begin_ceremony(kind, challenge, ceremony):
+    """Remember a pending ceremony and return extra fields for the start response."""
+    if settings.CHALLENGE_MODE == "token":
+        return {"challengeToken": seal_ceremony(kind, challenge, ceremony)}
+    challenge_store.put((kind, challenge), ceremony)
+    return {}
+
+
+def finish_ceremony(kind, challenge, token=None):
+    """Consume the pending ceremony for ``challenge``, or return ``None``."""
+    if settings.CHALLENGE_MODE == "token":
+        ceremony = open_ceremony(kind, challenge, token)
+        if ceremony is None or not _claim_challenge(challenge):
+            return None
+        return ceremony
+    return challenge_store.pop((kind, challenge))
+
+
+async def afinish_ceremony(kind, challenge, token=None):
+    """Async variant of :func:`finish_ceremony`."""
+    if settings.CHALLENGE_MODE == "token":
+        ceremony = open_ceremony(kind, challenge, token)
+        if ceremony is None or not await _aclaim_challenge(challenge):
+            return None
+        return ceremony
+    return challenge_store.pop((kind, challenge))
+
+
+def seal_ceremony(kind, challenge, ceremony):
+    """Encrypt and authenticate a pending ceremony into an opaque token."""
+    payload = {
+        "k": kind,
+        "c": bytes_to_base64url(challenge),
+    }
+    if ceremony.username is not None:
+        payload["u"] = ceremony.username
+    if ceremony.email is not None:
+        payload["e"] = ceremony.email
+    if isinstance(ceremony.user_id, bytes):
+        payload["h"] = bytes_to_base64url(ceremony.user_id)
+    elif ceremony.user_id is not None:
+        payload["i"] = ceremony.user_id
+    data = json.dumps(payload, separators=(",", ":")).encode()
+    return _fernet().encrypt(data).decode()
+
+
+def open_ceremony(kind, challenge, token):
+    """Return the ceremony sealed in ``token`` if it is valid for ``challenge``."""
+    if not token:
+        return None
+    try:
+        data = _fernet().decrypt(token.encode(), ttl=_challenge_ttl())
+        payload = json.loads(data)
+    except (InvalidToken, ValueError, AttributeError):
+        return None
+    if payload.get("k") != kind or not hmac.compare_digest(
+        payload.get("c", ""), bytes_to_base64url(challenge)
+    ):
+        return None
+    if "h" in payload:
+        user_id = base64url_to_bytes(payload["h"])
+    else:
+        user_id = payload.get("i")
+    return PendingCeremony(
+        username=payload.get("u"), email=payload.get("e"), user_id=user_id
+    )
+
+
+def _claim_challenge(challenge):
+    """Mark a token challenge as used; ``False`` if it was already claimed."""
+    cache = caches[settings.CHALLENGE_REPLAY_CACHE]
+    # Tokens are rejected once they expire, so the marker only needs to
+    # outlive them by a little to cover clock skew between workers.
+    return cache.add(_replay_key(challenge), 1, timeout=_challenge_ttl() + 5)
+
+
+async def _aclaim_challenge(challenge):
+    cache = caches[settings.CHALLENGE_REPLAY_CACHE]
+    return await cache.aadd(_replay_key(challenge), 1, timeout=_challenge_ttl() + 5)
+
+
+def _replay_key(challenge):
+    return f"webauthn:challenge:{bytes_to_base64url(challenge)}"
+
+
+def _challenge_ttl():
+    return int(settings.WEBAUTHN_TIMEOUT / 1000)
+
+
+def _fernet():
+    return _fernet_for_secrets(
+        settings.SECRET_KEY, tuple(settings.SECRET_KEY_FALLBACKS)
+    )
+
+
+@functools.lru_cache(maxsize=4)
+def _fernet_for_secrets(secret, fallbacks):
+    keys = []
+    for key_secret in (secret, *fallbacks):
+        digest = salted_hmac(
+            "auth_app.challenges", "challenge-token", secret=key_secret,
+            algorithm="sha256",
+        ).digest()
+        keys.append(Fernet(base64.urlsafe_b64encode(digest)))
+    return MultiFernet(keys)
@@ -0,0 +1,82 @@
+"""Retry short write transactions that lose a database lock race.
+
+SQLite allows one writer at a time.  ``busy_timeout`` makes a blocked writer
+wait, but a transaction can still fail with ``database is locked`` once the
+wait runs out under a burst of logins.  PostgreSQL instead aborts one side of
+a deadlock or serialization conflict.  :func:`run_with_retry` runs a write
+path in its own transaction and retries it with jittered exponential backoff
+(``settings.DB_LOCK_RETRIES`` times, starting at
+``settings.DB_LOCK_RETRY_BACKOFF`` seconds) when that happens.
+
+A retry is only possible when the transaction is the outermost one; inside
+an enclosing ``atomic()`` block (e.g. ``ATOMIC_REQUESTS``) the error is
+raised unchanged.
+"""
+
+import asyncio
+import random
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+
+_LOCK_MESSAGES = ("database is locked", "database table is locked")
+# PostgreSQL serialization_failure, deadlock_detected, lock_not_available
+_LOCK_SQLSTATES = {"40001", "40P01", "55P03"}
+
+
+class _LockContention(Exception):
+    """A retryable lock error raised by the wrapped transaction."""
+
+
+def is_lock_contention(exc):
+    if not isinstance(exc, OperationalError):
+        return False
+    # Django keeps the driver's exception as the cause
+    if getattr(exc.__cause__, "sqlstate", None) in _LOCK_SQLSTATES:
+        return True
+    return any(message in str(exc) for message in _LOCK_MESSAGES)
+
+
+def _attempt(func, args, using):
+    outermost = not connections[using].in_atomic_block
+    try:
+        with transaction.atomic(using=using):
+            return func(*args)
+    except OperationalError as e:
+        if outermost and is_lock_contention(e):
+            raise _LockContention from e
+        raise
+
+
+def _delay(attempt):
+    backoff = settings.DB_LOCK_RETRY_BACKOFF * 2 ** attempt
+    return backoff * random.uniform(0.5, 1.5)
+
+
+def run_with_retry(func, *args, using=DEFAULT_DB_ALIAS):
+    """Call ``func(*args)`` in a transaction, retrying on lock contention."""
+    for attempt in range(settings.DB_LOCK_RETRIES + 1):
+        try:
+            return _attempt(func, args, using)
+        except _LockContention as e:
+            if attempt == settings.DB_LOCK_RETRIES:
+                raise e.__cause__
+            time.sleep(_delay(attempt))
+
+
+async def arun_with_retry(func, *args, using=DEFAULT_DB_ALIAS):
+    """Async variant of :func:`run_with_retry`; ``func`` itself is sync.
+
+    The whole transaction runs in one ``sync_to_async`` call, and the backoff
+    waits on the event loop rather than in the database thread.
+    """
+    attempt_async = sync_to_async(_attempt)
+    for attempt in range(settings.DB_LOCK_RETRIES + 1):
+        try:
+            return await attempt_async(func, args, using)
+        except _LockContention as e:
+            if attempt == settings.DB_LOCK_RETRIES:
+                raise e.__cause__
+            await asyncio.sleep(_delay(attempt))
@@ -0,0 +1,73 @@
+"""Cached credential descriptors for ``login_start``.
+
+``login_start`` only needs a user's primary key and the raw IDs of their
+passkeys.  Both are kept in the cache named by
+``settings.CREDENTIAL_DESCRIPTOR_CACHE`` under the username, so a warm start
+request does no database work and a cold one does a single query.
+
+Entries are dropped when a passkey is created or deleted and when the user
+is saved or deleted (see :mod:`auth_app.signals`).  With a per-process cache
+such as the default LocMemCache those signals only reach the worker that
+made the change; other workers catch up within
+``settings.CREDENTIAL_DESCRIPTOR_TTL`` seconds, so point the alias at a
+shared cache when running several workers.
+"""
+
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+
+
+def login_descriptors(username):
+    """Return ``(user_id, [credential_id, ...])`` for ``username``, or ``None``."""
+    cache = _cache()
+    key = _key(username)
+    entry = cache.get(key)
+    if entry is None:
+        entry = _entry(list(_rows(username)))
+        if entry is not None:
+            cache.set(key, entry, settings.CREDENTIAL_DESCRIPTOR_TTL)
+    return entry
+
+
+async def alogin_descriptors(username):
+    """Async variant of :func:`login_descriptors`."""
+    cache = _cache()
+    key = _key(username)
+    entry = await cache.aget(key)
+    if entry is None:
+        entry = _entry([row async for row in _rows(username)])
+        if entry is not None:
+            await cache.aset(key, entry, settings.CREDENTIAL_DESCRIPTOR_TTL)
+    return entry
+
+
+def invalidate(username):
+    _cache().delete(_key(username))
+
+
+def _rows(username):
+    # LEFT JOIN, so a user without passkeys still yields one (id, None) row
+    # and an unknown username yields none.
+    User = get_user_model()
+    return User.objects.filter(username=username).values_list(
+        "id", "passkeys__credential_id"
+    )
+
+
+def _entry(rows):
+    if not rows:
+        return None
+    credential_ids = [bytes(credential_id) for _, credential_id in rows if credential_id]
+    return rows[0][0], credential_ids
+
+
+def _cache():
+    return caches[settings.CREDENTIAL_DESCRIPTOR_CACHE]
+
+
+def _key(username):
+    # Usernames may be long or hold spaces, which memcached keys may not
+    return f"webauthn:allow:{hashlib.sha256(username.encode()).hexdigest()}"
@@ -0,0 +1,318 @@
+"""Per-phase request timing, ``Server-Timing`` headers and Prometheus metrics.
+
+With ``settings.REQUEST_INSTRUMENTATION`` enabled, :class:`ServerTimingMiddleware`
+starts a :class:`RequestTimings` for every request.  Code on the request path
+marks its phases with :func:`phase` and its outcome with :func:`set_outcome`;
+both are no-ops when no request is being instrumented, so the helpers can be
+called unconditionally.  SQL queries are counted per request and per phase
+by an execute wrapper that :mod:`auth_app.signals` installs on every database
+connection; outside an instrumented request it only passes the query on.
+
+When the request finishes, its phases are sent as a ``Server-Timing`` header
+(unless ``settings.SERVER_TIMING_HEADER`` is off) and folded into the
+histograms served by :func:`metrics_view` in the Prometheus text format,
+together with the challenge store, verifier, rate limiter, login
+write-behind and metadata index counters.
+
+Phases may nest: ``verification`` covers the executor round trip and, when
+verification runs in-process, contains the ``parse`` and ``verify`` phases.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+SUCCESS = "success"
+INVALID_CHALLENGE = "invalid_challenge"
+VERIFICATION_FAILED = "verification_failed"
+BUSY = "busy"
+RATE_LIMITED = "rate_limited"
+
+# Seconds; roughly Prometheus' defaults with more resolution below 10 ms
+DURATION_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21)
+
+_current = ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    """Phases, query count and outcome of the request being handled."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = []
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.outcome = None
+
+
+@contextmanager
+def phase(name):
+    """Time the enclosed block as phase ``name`` of the current request."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    queries = timings.queries
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.phases.append(
+            (name, time.perf_counter() - started, timings.queries - queries)
+        )
+
+
+def set_outcome(outcome):
+    """Label the current request's outcome, e.g. :data:`INVALID_CHALLENGE`."""
+    timings = _current.get()
+    if timings is not None:
+        timings.outcome = outcome
+
+
+def _count_query(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.queries += 1
+        timings.query_seconds += time.perf_counter() - started
+
+
+def install_query_counter(connection, **kwargs):
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+class Histogram:
+    """Thread-safe cumulative histogram keyed by a tuple of label values."""
+
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0, 0.0]
+            counts = series[0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [
+                (labels, list(counts), count, total)
+                for labels, (counts, count, total) in sorted(self._series.items())
+            ]
+        for labels, counts, count, total in series:
+            label_text = ",".join(
+                f'{name}="{value}"' for name, value in zip(self.label_names, labels)
+            )
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {bucket_count}')
+            lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {count}')
+            lines.append(f"{self.name}_count{{{label_text}}} {count}")
+            lines.append(f"{self.name}_sum{{{label_text}}} {total}")
+        return lines
+
+
+request_duration = Histogram(
+    "pasky_request_duration_seconds",
+    "Time spent handling a request.",
+    ("endpoint", "outcome"),
+    DURATION_BUCKETS,
+)
+phase_duration = Histogram(
+    "pasky_request_phase_duration_seconds",
+    "Time spent in one phase of a request.",
+    ("endpoint", "phase"),
+    DURATION_BUCKETS,
+)
+request_queries = Histogram(
+    "pasky_request_queries",
+    "SQL queries run while handling a request.",
+    ("endpoint",),
+    QUERY_BUCKETS,
+)
+HISTOGRAMS = (request_duration, phase_duration, request_queries)
+
+
+class ServerTimingMiddleware:
+    """Instrument each request; enabled by ``settings.REQUEST_INSTRUMENTATION``."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_INSTRUMENTATION:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, timings)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, timings)
+
+    def process_template_response(self, request, response):
+        # DRF responses render after the view returns; time that too
+        timings = _current.get()
+        if timings is not None:
+            started = time.perf_counter()
+            queries = timings.queries
+
+            def rendered(response):
+                timings.phases.append(
+                    ("render", time.perf_counter() - started, timings.queries - queries)
+                )
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    def _finish(self, request, response, timings):
+        elapsed = time.perf_counter() - timings.started
+        match = getattr(request, "resolver_match", None)
+        endpoint = match.url_name if match and match.url_name else "unmatched"
+        outcome = timings.outcome or _outcome_for_status(response.status_code)
+
+        request_duration.observe((endpoint, outcome), elapsed)
+        request_queries.observe((endpoint,), timings.queries)
+        for name, seconds, _ in timings.phases:
+            phase_duration.observe((endpoint, name), seconds)
+
+        if settings.SERVER_TIMING_HEADER:
+            response["Server-Timing"] = _server_timing(timings, elapsed)
+        return response
+
+
+def _outcome_for_status(status_code):
+    if status_code < 400:
+        return SUCCESS
+    if status_code < 500:
+        return "client_error"
+    return "server_error"
+
+
+def _server_timing(timings, elapsed):
+    entries = [
+        f'{name};dur={seconds * 1000:.2f};desc="{queries} queries"'
+        for name, seconds, queries in timings.phases
+    ]
+    entries.append(
+        f'db;dur={timings.query_seconds * 1000:.2f};desc="{timings.queries} queries"'
+    )
+    entries.append(f"total;dur={elapsed * 1000:.2f}")
+    return ", ".join(entries)
+
+
+# Component stats exported as gauges, except these monotonic counters
+_COUNTER_STATS = {
+    "hits", "misses", "expirations", "evictions", "completed", "rejected",
+    "timeouts", "allowed", "skipped", "flushes", "flushed", "errors", "reloads",
+}
+
+
+def _stats_lines(prefix, stats):
+    lines = []
+    for key, value in stats.items():
+        if value is None:
+            continue
+        if key in _COUNTER_STATS:
+            name = f"{prefix}_{key}_total"
+            lines.append(f"# TYPE {name} counter")
+        else:
+            name = f"{prefix}_{key}"
+            lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {float(value)}")
+    return lines
+
+
+def render_metrics():
+    """Return every metric in the Prometheus text exposition format."""
+    from .challenges import challenge_store
+    from .mds import metadata_stats
+    from .ratelimit import rate_limiter
+    from .verification import get_verifier
+    from .writebehind import login_writes
+
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.expose())
+    lines.extend(_stats_lines("pasky_challenge_store", challenge_store.stats()))
+    lines.extend(_stats_lines("pasky_verifier", get_verifier().stats()))
+    lines.extend(_stats_lines("pasky_rate_limiter", rate_limiter.stats()))
+    lines.extend(_stats_lines("pasky_login_write_behind", login_writes.stats()))
+    lines.extend(_stats_lines("pasky_metadata_index", metadata_stats()))
+    return "\n".join(lines) + "\n"
+
+
+def _may_read_metrics(request):
+    """Whether ``request`` bears ``settings.METRICS_TOKEN`` or comes from staff."""
+    token = settings.METRICS_TOKEN
+    scheme, _, credentials = request.META.get("HTTP_AUTHORIZATION", "").partition(" ")
+    if (
+        token
+        and scheme.lower() == "bearer"
+        and constant_time_compare(credentials.strip(), token)
+    ):
+        return True
+    user = getattr(request, "user", None)
+    return user is not None and user.is_active and user.is_staff
+
+
+def metrics_view(request):
+    """Serve :func:`render_metrics`; 404 unless instrumentation is enabled.
+
+    The counters describe the service's internals, so only a scraper with
+    ``settings.METRICS_TOKEN`` or a staff user may read them.
+    """
+    if not settings.REQUEST_INSTRUMENTATION:
+        raise Http404
+    if not _may_read_metrics(request):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -0,0 +1,286 @@
+"""Concurrent load driver for the passkey ceremonies.
+
+Each virtual user registers a passkey with a :class:`VirtualAuthenticator`,
+fetches ``user/``, then signs in ``logins`` times.  Virtual users are spread
+over ``concurrency`` threads, and every request is timed per endpoint.
+
+Two targets are supported:
+
+* :class:`ClientTarget` drives the views in-process through Django's test
+  client, against whatever database is configured, and also counts the SQL
+  queries each request runs.
+* :class:`HTTPTarget` talks to a running server over HTTP (``requests`` is
+  needed, see ``requirements-dev.txt``).  Query counts are not available.
+
+Run it with ``python manage.py loadtest``.
+"""
+
+import itertools
+import json
+import math
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection, connections
+from django.test import Client
+
+from .testing import VirtualAuthenticator
+
+ENDPOINTS = (
+    "register_start",
+    "register_complete",
+    "login_start",
+    "login_complete",
+    "user_info",
+)
+
+
+class CeremonyError(Exception):
+    """Raised when a step of a virtual user's scenario gets a non-2xx answer."""
+
+
+class ClientTarget:
+    """Send requests through Django's test client and count queries."""
+
+    counts_queries = True
+
+    # Each virtual user gets its own address, as with real clients, so
+    # per-address rate limits apply to it alone
+    _addresses = itertools.count(1)
+
+    def __init__(self, prefix="/api/auth/"):
+        self.prefix = prefix
+        n = next(self._addresses)
+        self.client = Client(
+            HTTP_HOST="localhost",
+            REMOTE_ADDR=f"10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}",
+            raise_request_exception=False,
+        )
+
+    def _send(self, send):
+        queries = []
+
+        def count(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count):
+            response = send()
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        return response.status_code, body, len(queries)
+
+    def post(self, path, data):
+        return self._send(
+            lambda: self.client.post(
+                self.prefix + path, data=json.dumps(data), content_type="application/json"
+            )
+        )
+
+    def get(self, path):
+        return self._send(lambda: self.client.get(self.prefix + path))
+
+    def close(self):
+        pass
+
+
+class HTTPTarget:
+    """Send requests to a running server, keeping cookies and the CSRF token."""
+
+    counts_queries = False
+
+    def __init__(self, base_url):
+        import requests
+
+        self.base_url = base_url.rstrip("/") + "/"
+        self.session = requests.Session()
+        self.session.get(self.base_url + "csrf-token/")
+
+    def _headers(self):
+        # Django rotates the token on login, so always send the current one
+        token = self.session.cookies.get("csrftoken")
+        return {"X-CSRFToken": token} if token else {}
+
+    def _result(self, response):
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        return response.status_code, body, None
+
+    def post(self, path, data):
+        return self._result(
+            self.session.post(self.base_url + path, json=data, headers=self._headers())
+        )
+
+    def get(self, path):
+        return self._result(self.session.get(self.base_url + path, headers=self._headers()))
+
+    def close(self):
+        self.session.close()
+
+
+class Recorder:
+    """Thread-safe per-endpoint latency, status and query samples."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {endpoint: [] for endpoint in ENDPOINTS}
+        self.errors = {endpoint: 0 for endpoint in ENDPOINTS}
+        self.queries = {endpoint: [] for endpoint in ENDPOINTS}
+        self.statuses = {endpoint: {} for endpoint in ENDPOINTS}
+        self.failed_users = 0
+
+    def record(self, endpoint, elapsed, status, queries):
+        with self._lock:
+            self.samples[endpoint].append(elapsed)
+            statuses = self.statuses[endpoint]
+            statuses[status] = statuses.get(status, 0) + 1
+            if not 200 <= status < 300:
+                self.errors[endpoint] += 1
+            if queries is not None:
+                self.queries[endpoint].append(queries)
+
+    def user_failed(self):
+        with self._lock:
+            self.failed_users += 1
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of already sorted ``samples``."""
+    if not samples:
+        return None
+    rank = max(math.ceil(fraction * len(samples)), 1)
+    return samples[rank - 1]
+
+
+def run_user(target, recorder, username, logins):
+    """Run one virtual user's register, user info and login scenario."""
+    authenticator = VirtualAuthenticator()
+
+    def call(endpoint, send):
+        started = time.perf_counter()
+        status, body, queries = send()
+        recorder.record(endpoint, time.perf_counter() - started, status, queries)
+        if not 200 <= status < 300:
+            raise CeremonyError(f"{endpoint} returned {status}: {body}")
+        return body
+
+    def finish(options, credential):
+        payload = {"credential": credential, "challenge": options["challenge"]}
+        if "challengeToken" in options:
+            payload["challengeToken"] = options["challengeToken"]
+        return payload
+
+    options = call(
+        "register_start",
+        lambda: target.post(
+            "register/start/", {"username": username, "email": f"{username}@example.com"}
+        ),
+    )
+    credential = authenticator.create(options)
+    call(
+        "register_complete",
+        lambda: target.post("register/complete/", finish(options, credential)),
+    )
+    call("user_info", lambda: target.get("user/"))
+
+    for _ in range(logins):
+        options = call(
+            "login_start", lambda: target.post("login/start/", {"username": username})
+        )
+        assertion = authenticator.get(options)
+        call(
+            "login_complete",
+            lambda: target.post("login/complete/", finish(options, assertion)),
+        )
+
+
+def run(target_factory, users=50, concurrency=4, logins=3, username_prefix=None):
+    """Run ``users`` virtual users over ``concurrency`` threads.
+
+    ``target_factory`` is called once per virtual user so each gets its own
+    cookies.  Returns the summary built by :func:`summarize`.
+    """
+    username_prefix = username_prefix or f"loadtest-{uuid.uuid4().hex[:8]}-"
+    recorder = Recorder()
+
+    def virtual_user(index):
+        target = target_factory()
+        try:
+            run_user(target, recorder, f"{username_prefix}{index}", logins)
+        except CeremonyError:
+            recorder.user_failed()
+        finally:
+            target.close()
+
+    def worker(indexes):
+        try:
+            for index in indexes:
+                virtual_user(index)
+        finally:
+            # Worker threads own their database connections
+            connections.close_all()
+
+    started = time.perf_counter()
+    if concurrency <= 1:
+        for index in range(users):
+            virtual_user(index)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = [
+                pool.submit(worker, range(start, users, concurrency))
+                for start in range(concurrency)
+            ]
+            for future in futures:
+                future.result()
+    elapsed = time.perf_counter() - started
+
+    summary = summarize(recorder, elapsed)
+    summary.update(
+        users=users,
+        concurrency=concurrency,
+        logins_per_user=logins,
+        username_prefix=username_prefix,
+    )
+    return summary
+
+
+def summarize(recorder, elapsed):
+    """Turn recorded samples into a JSON-serializable summary."""
+    endpoints = {}
+    total = 0
+    for endpoint in ENDPOINTS:
+        samples = sorted(recorder.samples[endpoint])
+        if not samples:
+            continue
+        total += len(samples)
+        queries = recorder.queries[endpoint]
+        endpoints[endpoint] = {
+            "requests": len(samples),
+            "errors": recorder.errors[endpoint],
+            "statuses": {
+                str(status): count
+                for status, count in sorted(recorder.statuses[endpoint].items())
+            },
+            "requests_per_second": len(samples) / elapsed,
+            "latency_ms": {
+                "mean": sum(samples) / len(samples) * 1000,
+                "p50": percentile(samples, 0.50) * 1000,
+                "p95": percentile(samples, 0.95) * 1000,
+                "p99": percentile(samples, 0.99) * 1000,
+                "max": samples[-1] * 1000,
+            },
+            "queries_per_request": sum(queries) / len(queries) if queries else None,
+        }
+    return {
+        "elapsed_seconds": elapsed,
+        "requests": total,
+        "requests_per_second": total / elapsed if elapsed else 0.0,
+        "failed_users": recorder.failed_users,
+        "endpoints": endpoints,
+    }
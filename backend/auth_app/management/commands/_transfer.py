@@ -0,0 +1,133 @@
+"""Helpers shared by the ``export_passkeys`` and ``import_passkeys`` commands.
+
+Records are JSON lines, one user per line with their passkeys nested::
+
+    {"username": ..., "email": ..., "passkeys": [{"credential_id": ...}, ...]}
+
+Binary columns are unpadded base64url, datetimes ISO 8601.
+"""
+
+import json
+import os
+import time
+
+from django.utils.dateparse import parse_datetime
+from webauthn.helpers import base64url_to_bytes, bytes_to_base64url
+
+USER_FIELDS = (
+    "username",
+    "email",
+    "password",
+    "first_name",
+    "last_name",
+    "is_active",
+    "is_staff",
+    "is_superuser",
+)
+
+
+def user_to_record(user):
+    record = {field: getattr(user, field) for field in USER_FIELDS}
+    record["user_handle"] = _encode_bytes(user.user_handle)
+    record["date_joined"] = _encode_datetime(user.date_joined)
+    record["last_login"] = _encode_datetime(user.last_login)
+    record["passkeys"] = [
+        {
+            "credential_id": _encode_bytes(passkey.credential_id),
+            "public_key": _encode_bytes(passkey.public_key),
+            "name": passkey.name,
+            "counter": passkey.counter,
+            "created_at": _encode_datetime(passkey.created_at),
+        }
+        for passkey in user.passkeys.all()
+    ]
+    return json.dumps(record, separators=(",", ":"))
+
+
+def user_fields_from_record(record):
+    fields = {field: record[field] for field in USER_FIELDS if field in record}
+    fields["user_handle"] = _decode_bytes(record.get("user_handle"))
+    for field in ("date_joined", "last_login"):
+        if record.get(field):
+            fields[field] = parse_datetime(record[field])
+    return fields
+
+
+def passkey_fields_from_record(record):
+    return {
+        "credential_id": base64url_to_bytes(record["credential_id"]),
+        "public_key": base64url_to_bytes(record["public_key"]),
+        "name": record.get("name", ""),
+        "counter": record.get("counter", 0),
+        "created_at": parse_datetime(record["created_at"])
+        if record.get("created_at")
+        else None,
+    }
+
+
+class Checkpoint:
+    """Resume position persisted to a JSON file after each committed batch."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def save(self, **position):
+        if not self.path:
+            return
+        # Write-then-rename so a crash never leaves a truncated checkpoint
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(position, f)
+        os.replace(tmp_path, self.path)
+
+
+class Progress:
+    """Throughput reporting for long-running transfers."""
+
+    def __init__(self, stream, noun, every):
+        self.stream = stream
+        self.noun = noun
+        self.every = every
+        self.users = 0
+        self.passkeys = 0
+        self.skipped = 0
+        self._started = time.monotonic()
+        self._next_report = every
+
+    def add(self, users, passkeys, skipped=0):
+        self.users += users
+        self.passkeys += passkeys
+        self.skipped += skipped
+        if self.every and self.users >= self._next_report:
+            self.report()
+            self._next_report = self.users + self.every
+
+    def report(self, final=False):
+        elapsed = max(time.monotonic() - self._started, 1e-9)
+        message = (
+            f"{self.noun} {self.users} users, {self.passkeys} passkeys "
+            f"({self.users / elapsed:.0f} users/s, {self.passkeys / elapsed:.0f} passkeys/s)"
+        )
+        if self.skipped:
+            message += f", skipped {self.skipped}"
+        if final:
+            message += f" in {elapsed:.1f}s"
+        self.stream.write(message)
+
+
+def _encode_bytes(value):
+    return bytes_to_base64url(bytes(value)) if value is not None else None
+
+
+def _decode_bytes(value):
+    return base64url_to_bytes(value) if value else None
+
+
+def _encode_datetime(value):
+    return value.isoformat() if value is not None else None
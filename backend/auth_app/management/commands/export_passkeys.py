@@ -0,0 +1,88 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Prefetch
+
+from auth_app.models import PasskeyCredential
+
+from ._transfer import Checkpoint, Progress, user_to_record
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Stream users and their passkeys out as JSON lines."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--output", "-o", default="-",
+            help="File to write to (default: stdout).",
+        )
+        parser.add_argument(
+            "--chunk-size", type=int, default=2000,
+            help="Users fetched (with their passkeys) per database round trip.",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            help="File recording progress; if it exists the export resumes "
+                 "from it and continues the same --output file.",
+        )
+        parser.add_argument(
+            "--progress-every", type=int, default=10000,
+            help="Report throughput every N users (0 disables).",
+        )
+
+    def handle(self, *args, **options):
+        if options["checkpoint"] and options["output"] == "-":
+            raise CommandError("--checkpoint requires --output")
+
+        checkpoint = Checkpoint(options["checkpoint"])
+        position = checkpoint.load()
+        chunk_size = options["chunk_size"]
+        progress = Progress(self.stderr, "exported", options["progress_every"])
+
+        users = (
+            User.objects.filter(pk__gt=position.get("last_id", 0))
+            .order_by("pk")
+            .prefetch_related(
+                Prefetch(
+                    "passkeys",
+                    queryset=PasskeyCredential.objects.order_by("pk").only(
+                        "user_id", "credential_id", "public_key", "name", "counter",
+                        "created_at",
+                    ),
+                )
+            )
+        )
+
+        if options["output"] == "-":
+            self._export(users, chunk_size, self.stdout, checkpoint, progress)
+        else:
+            mode = "r+" if position else "w"
+            with open(options["output"], mode) as output:
+                # Drop anything written after the last checkpoint
+                output.seek(position.get("offset", 0))
+                output.truncate()
+                self._export(users, chunk_size, output, checkpoint, progress)
+
+        progress.report(final=True)
+
+    def _export(self, users, chunk_size, output, checkpoint, progress):
+        exported = passkeys = 0
+        last_id = None
+        for user in users.iterator(chunk_size=chunk_size):
+            output.write(user_to_record(user) + "\n")
+            exported += 1
+            passkeys += len(user.passkeys.all())
+            last_id = user.pk
+            if exported == chunk_size:
+                self._commit(output, checkpoint, last_id)
+                progress.add(exported, passkeys)
+                exported = passkeys = 0
+        if last_id is not None:
+            self._commit(output, checkpoint, last_id)
+        progress.add(exported, passkeys)
+
+    def _commit(self, output, checkpoint, last_id):
+        output.flush()
+        if checkpoint.path:
+            checkpoint.save(last_id=last_id, offset=output.tell())
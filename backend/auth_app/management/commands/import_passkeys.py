@@ -0,0 +1,133 @@
+import json
+import sys
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from auth_app.models import PasskeyCredential, credential_digest
+
+from ._transfer import (
+    Checkpoint,
+    Progress,
+    passkey_fields_from_record,
+    user_fields_from_record,
+)
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Stream users and their passkeys in from JSON lines written by export_passkeys."
+
+    def add_arguments(self, parser):
+        parser.add_argument("input", help="File to read ('-' for stdin).")
+        parser.add_argument(
+            "--batch-size", type=int, default=1000,
+            help="Users inserted per transaction.",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            help="File recording the last committed line; if it exists the "
+                 "import resumes after that line.",
+        )
+        parser.add_argument(
+            "--progress-every", type=int, default=10000,
+            help="Report throughput every N users (0 disables).",
+        )
+
+    def handle(self, *args, **options):
+        checkpoint = Checkpoint(options["checkpoint"])
+        resume_after = checkpoint.load().get("line", 0)
+        batch_size = options["batch_size"]
+        progress = Progress(self.stderr, "imported", options["progress_every"])
+
+        if options["input"] == "-":
+            self._import(sys.stdin, resume_after, batch_size, checkpoint, progress)
+        else:
+            with open(options["input"]) as source:
+                self._import(source, resume_after, batch_size, checkpoint, progress)
+
+        progress.report(final=True)
+
+    def _import(self, source, resume_after, batch_size, checkpoint, progress):
+        batch = []
+        line_number = resume_after
+        for line_number, line in enumerate(source, 1):
+            if line_number <= resume_after or not line.strip():
+                continue
+            batch.append(json.loads(line))
+            if len(batch) >= batch_size:
+                self._commit(batch, checkpoint, line_number, progress)
+                batch = []
+        if batch:
+            self._commit(batch, checkpoint, line_number, progress)
+
+    def _commit(self, records, checkpoint, line_number, progress):
+        with transaction.atomic():
+            users, passkeys, skipped = self._insert(records)
+        checkpoint.save(line=line_number)
+        progress.add(users, passkeys, skipped)
+
+    def _insert(self, records):
+        """Insert one batch; records whose username or email exists are skipped."""
+        usernames = [record["username"] for record in records]
+        emails = [record["email"] for record in records if record.get("email")]
+        taken = set()
+        for username, email in User.objects.filter(
+            Q(username__in=usernames) | Q(email__in=emails)
+        ).values_list("username", "email"):
+            taken.update((("username", username), ("email", email)))
+
+        fresh = []
+        for record in records:
+            if ("username", record["username"]) in taken or (
+                record.get("email") and ("email", record["email"]) in taken
+            ):
+                continue
+            # Also guards against duplicates within the batch itself
+            taken.update((("username", record["username"]), ("email", record.get("email"))))
+            fresh.append(record)
+
+        users = []
+        for record in fresh:
+            fields = user_fields_from_record(record)
+            fields.setdefault("password", make_password(None))
+            users.append(User(**fields))
+        users = User.objects.bulk_create(users)
+
+        # bulk_create() bypasses save(), so the digest is filled in here
+        candidates = []
+        for user, record in zip(users, fresh):
+            for passkey_record in record.get("passkeys", ()):
+                fields = passkey_fields_from_record(passkey_record)
+                created_at = fields.pop("created_at")
+                digest = credential_digest(fields["credential_id"])
+                candidates.append(
+                    (PasskeyCredential(user=user, credential_digest=digest, **fields), created_at)
+                )
+        existing = set(
+            bytes(digest)
+            for digest in PasskeyCredential.objects.filter(
+                credential_digest__in=[passkey.credential_digest for passkey, _ in candidates]
+            ).values_list("credential_digest", flat=True)
+        )
+        passkeys = []
+        for passkey, created_at in candidates:
+            if passkey.credential_digest in existing:
+                continue
+            existing.add(passkey.credential_digest)
+            passkeys.append((passkey, created_at))
+        PasskeyCredential.objects.bulk_create([passkey for passkey, _ in passkeys])
+
+        # auto_now_add stamps the insert time; put the exported value back
+        restored = []
+        for passkey, created_at in passkeys:
+            if created_at is not None:
+                passkey.created_at = created_at
+                restored.append(passkey)
+        PasskeyCredential.objects.bulk_update(restored, ["created_at"])
+
+        return len(users), len(passkeys), len(records) - len(fresh)
@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from auth_app.mds import parse_blob, verify_blob, write_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Compile a downloaded FIDO Metadata Service (MDS3) blob into the index "
+        "used to verify registration attestations. Running workers pick up the "
+        "new index within MDS_RELOAD_INTERVAL seconds."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("blob", help="MDS3 blob (JWT) or its decoded JSON payload.")
+        parser.add_argument(
+            "--output", "-o",
+            help="Index file to write (default: settings.MDS_INDEX_PATH).",
+        )
+        parser.add_argument(
+            "--root-cert",
+            help="PEM root certificate the blob's signing chain must lead to "
+                 "(the FIDO Alliance MDS root); without it the blob is trusted as is.",
+        )
+
+    def handle(self, *args, **options):
+        output = options["output"] or settings.MDS_INDEX_PATH
+        if not output:
+            raise CommandError("Pass --output or set MDS_INDEX_PATH")
+
+        with open(options["blob"], "rb") as f:
+            blob = f.read()
+
+        if options["root_cert"]:
+            with open(options["root_cert"], "rb") as f:
+                root_cert = f.read()
+            try:
+                verify_blob(blob, root_cert)
+            except Exception as e:
+                raise CommandError(f"Blob signature check failed: {e}")
+        else:
+            self.stderr.write("No --root-cert given: the blob signature is not checked")
+
+        try:
+            payload = parse_blob(blob)
+        except ValueError as e:
+            raise CommandError(f"Not an MDS3 blob: {e}")
+
+        count = write_index(payload, output)
+        self.stdout.write(
+            f"Indexed {count} authenticators to {output} "
+            f"(blob {payload.get('no', '?')}, next update {payload.get('nextUpdate', '?')})"
+        )
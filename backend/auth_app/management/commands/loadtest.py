@@ -0,0 +1,132 @@
+import json
+from functools import partial
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from auth_app import loadtest
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive full register and login ceremonies with virtual authenticators "
+        "and report throughput, latency percentiles and queries per endpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--url",
+            help="Base URL of a running server's auth API, e.g. "
+                 "http://localhost:8000/api/auth/. Without it the views are "
+                 "driven in-process through the test client.",
+        )
+        parser.add_argument("--users", type=int, default=50, help="Virtual users to run.")
+        parser.add_argument(
+            "--concurrency", type=int, default=4,
+            help="Threads running virtual users at the same time.",
+        )
+        parser.add_argument(
+            "--logins", type=int, default=3, help="Logins per virtual user after registering.",
+        )
+        parser.add_argument("--output", "-o", help="Write the results as JSON to this file.")
+        parser.add_argument(
+            "--baseline",
+            help="Results file from an earlier run to compare against.",
+        )
+        parser.add_argument(
+            "--keep-users", action="store_true",
+            help="Keep the users created by the run instead of deleting them.",
+        )
+
+    def handle(self, *args, **options):
+        if options["users"] < 1:
+            raise CommandError("--users must be at least 1")
+
+        if options["url"]:
+            try:
+                import requests  # noqa: F401
+            except ImportError:
+                raise CommandError("--url needs the requests package (requirements-dev.txt)")
+            target_factory = partial(loadtest.HTTPTarget, options["url"])
+            target = options["url"]
+        else:
+            target_factory = loadtest.ClientTarget
+            target = "in-process"
+
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                baseline = json.load(f)
+
+        started_at = timezone.now()
+        results = loadtest.run(
+            target_factory,
+            users=options["users"],
+            concurrency=options["concurrency"],
+            logins=options["logins"],
+        )
+        results.update(
+            target=target,
+            started_at=started_at.isoformat(),
+            config={
+                "database": connection.vendor,
+                "async_views": settings.ASYNC_VIEWS,
+                "challenge_mode": settings.CHALLENGE_MODE,
+                "verification_executor": settings.VERIFICATION_EXECUTOR,
+                "verification_workers": settings.VERIFICATION_WORKERS,
+            },
+        )
+
+        if not options["keep_users"]:
+            # Only reaches the server's users when it shares this database
+            User.objects.filter(username__startswith=results["username_prefix"]).delete()
+
+        self._report(results, baseline)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def _report(self, results, baseline):
+        self.stdout.write(
+            f"{results['requests']} requests in {results['elapsed_seconds']:.2f}s "
+            f"({results['requests_per_second']:.1f} req/s) against {results['target']}, "
+            f"{results['failed_users']} of {results['users']} virtual users failed"
+        )
+        self.stdout.write(
+            f"{'endpoint':<18} {'reqs':>6} {'err':>5} {'req/s':>8} "
+            f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8}"
+        )
+        for endpoint, stats in results["endpoints"].items():
+            latency = stats["latency_ms"]
+            queries = stats["queries_per_request"]
+            self.stdout.write(
+                f"{endpoint:<18} {stats['requests']:>6} {stats['errors']:>5} "
+                f"{stats['requests_per_second']:>8.1f} {latency['p50']:>8.2f} "
+                f"{latency['p95']:>8.2f} {latency['p99']:>8.2f} "
+                f"{'-' if queries is None else f'{queries:.1f}':>8}"
+            )
+
+        if baseline is None:
+            return
+        self.stdout.write("Change against baseline (req/s, p95):")
+        for endpoint, stats in results["endpoints"].items():
+            before = baseline.get("endpoints", {}).get(endpoint)
+            if not before:
+                continue
+            self.stdout.write(
+                f"{endpoint:<18} "
+                f"{_change(before['requests_per_second'], stats['requests_per_second']):>8} "
+                f"{_change(before['latency_ms']['p95'], stats['latency_ms']['p95']):>8}"
+            )
+
+
+def _change(before, after):
+    if not before:
+        return "-"
+    return f"{(after - before) / before:+.0%}"
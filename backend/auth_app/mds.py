@@ -0,0 +1,295 @@
+"""Offline FIDO Metadata Service (MDS3) index for registration attestation.
+
+``manage.py load_mds`` reads a locally downloaded MDS blob (optionally
+checking its signature) and compiles the parts attestation verification needs
+into a small binary file at ``settings.MDS_INDEX_PATH``: one row per AAGUID,
+sorted, each pointing at the authenticator's description, latest status and
+attestation root certificates.  Icons, extensions and everything else in the
+blob are dropped.
+
+:func:`get_metadata_index` memory-maps that file, so all worker processes
+share one copy through the page cache, and finds an AAGUID by binary search
+without parsing the rest.  Every ``settings.MDS_RELOAD_INTERVAL`` seconds it
+checks whether the file was replaced and, if so, maps the new one; the
+compiler writes to a temporary file and renames it, so readers never see a
+partial index.
+
+:func:`attestation_roots` turns a registration's attestation object into the
+``pem_root_certs_bytes_by_fmt`` argument of ``verify_registration_response``.
+Authenticators whose latest status reports a compromise are refused.  With
+``settings.WEBAUTHN_REQUIRE_ATTESTATION`` registrations must also come from an
+authenticator in the index and carry an attestation certificate chain.
+"""
+
+import base64
+import json
+import mmap
+import os
+import ssl
+import struct
+import tempfile
+import threading
+import time
+import uuid
+
+from cryptography import x509
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec, padding
+from cryptography.hazmat.primitives.asymmetric.utils import encode_dss_signature
+from django.conf import settings
+from webauthn.helpers import base64url_to_bytes, parse_attestation_object
+from webauthn.helpers.validate_certificate_chain import validate_certificate_chain
+
+MAGIC = b"PASKYMDS"
+VERSION = 1
+# magic, version, entry count
+_HEADER = struct.Struct(">8sII")
+# AAGUID, record offset, record length; rows are sorted by AAGUID
+_ROW = struct.Struct(">16sII")
+
+# Latest statuses (MDS3 AuthenticatorStatus) that refuse an authenticator
+COMPROMISED_STATUSES = frozenset({
+    "REVOKED",
+    "USER_VERIFICATION_BYPASS",
+    "ATTESTATION_KEY_COMPROMISE",
+    "USER_KEY_REMOTE_COMPROMISE",
+    "USER_KEY_PHYSICAL_COMPROMISE",
+})
+
+
+class AttestationRejected(Exception):
+    """The authenticator is not trusted for registration."""
+
+
+def parse_blob(data):
+    """Return the payload of an MDS3 blob (a JWT, or its JSON payload)."""
+    data = data.strip()
+    if data.startswith(b"{"):
+        return json.loads(data)
+    return json.loads(base64url_to_bytes(data.split(b".")[1].decode()))
+
+
+def verify_blob(data, pem_root_cert):
+    """Check an MDS3 JWT's certificate chain and signature against ``pem_root_cert``.
+
+    Raises ``ValueError`` (or ``InvalidCertificateChain``) if it does not verify.
+    """
+    header_b64, payload_b64, signature_b64 = data.strip().split(b".")
+    header = json.loads(base64url_to_bytes(header_b64.decode()))
+    x5c = [base64.b64decode(certificate) for certificate in header.get("x5c", ())]
+    if not x5c:
+        raise ValueError("The blob header has no certificate chain")
+    validate_certificate_chain(x5c=x5c, pem_root_certs_bytes=[pem_root_cert])
+
+    public_key = x509.load_der_x509_certificate(x5c[0]).public_key()
+    signature = base64url_to_bytes(signature_b64.decode())
+    signed = header_b64 + b"." + payload_b64
+    alg = header.get("alg")
+    if alg not in ("RS256", "ES256"):
+        raise ValueError(f"Unsupported blob signature algorithm {alg}")
+    try:
+        if alg == "RS256":
+            public_key.verify(signature, signed, padding.PKCS1v15(), hashes.SHA256())
+        else:
+            # JWS carries the raw r || s pair
+            r, s = int.from_bytes(signature[:32], "big"), int.from_bytes(signature[32:], "big")
+            public_key.verify(
+                encode_dss_signature(r, s), signed, ec.ECDSA(hashes.SHA256())
+            )
+    except InvalidSignature as e:
+        raise ValueError("The blob signature does not verify") from e
+
+
+def compile_index(payload):
+    """Return the binary index of an MDS3 payload and its entry count."""
+    records = {}
+    for entry in payload.get("entries", ()):
+        if not entry.get("aaguid"):
+            # U2F and other entries keyed by key identifiers
+            continue
+        statement = entry.get("metadataStatement") or {}
+        reports = entry.get("statusReports") or ()
+        record = json.dumps(
+            {
+                "description": statement.get("description", ""),
+                "status": reports[-1].get("status", "") if reports else "",
+                "roots": statement.get("attestationRootCertificates", []),
+            },
+            separators=(",", ":"),
+        ).encode()
+        records[uuid.UUID(entry["aaguid"]).bytes] = record
+
+    table_size = _HEADER.size + _ROW.size * len(records)
+    rows, data, offset = [], [], table_size
+    for aaguid in sorted(records):
+        record = records[aaguid]
+        rows.append(_ROW.pack(aaguid, offset, len(record)))
+        data.append(record)
+        offset += len(record)
+    return _HEADER.pack(MAGIC, VERSION, len(records)) + b"".join(rows + data), len(records)
+
+
+def write_index(payload, path):
+    """Compile ``payload`` to ``path`` atomically; returns the entry count."""
+    index, count = compile_index(payload)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temporary = tempfile.mkstemp(dir=directory, prefix=".mds-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(index)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+    return count
+
+
+class MetadataEntry:
+    """What the index holds about one authenticator model."""
+
+    def __init__(self, aaguid, description, status, root_certificates):
+        self.aaguid = aaguid
+        self.description = description
+        self.status = status
+        # PEM, as verify_registration_response expects
+        self.root_certificates = root_certificates
+
+    @property
+    def compromised(self):
+        return self.status in COMPROMISED_STATUSES
+
+
+class MetadataIndex:
+    """Read-only, memory-mapped view of a compiled index file."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self._count = _HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a compiled MDS index")
+        # Decoded entries; bounded by the number of authenticators
+        self._entries = {}
+
+    def __len__(self):
+        return self._count
+
+    def get(self, aaguid):
+        """Return the :class:`MetadataEntry` for a 16-byte ``aaguid``, or ``None``."""
+        entry = self._entries.get(aaguid)
+        if entry is None:
+            entry = self._find(aaguid)
+            # Only indexed AAGUIDs are kept, so clients cannot grow the dict
+            if entry is not None:
+                self._entries[aaguid] = entry
+        return entry
+
+    def _find(self, aaguid):
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            row, offset, length = _ROW.unpack_from(
+                self._map, _HEADER.size + middle * _ROW.size
+            )
+            if row < aaguid:
+                low = middle + 1
+            elif row > aaguid:
+                high = middle
+            else:
+                record = json.loads(self._map[offset:offset + length])
+                return MetadataEntry(
+                    aaguid,
+                    record["description"],
+                    record["status"],
+                    [
+                        ssl.DER_cert_to_PEM_cert(base64.b64decode(root)).encode()
+                        for root in record["roots"]
+                    ],
+                )
+        return None
+
+
+class _IndexLoader:
+    """Holds the current index and swaps in a replaced file."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = None
+        self._path = None
+        self._signature = None
+        self._checked = 0.0
+        self.reloads = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self):
+        path = settings.MDS_INDEX_PATH
+        if not path:
+            return None
+        now = time.monotonic()
+        if path == self._path and now - self._checked < settings.MDS_RELOAD_INTERVAL:
+            return self._index
+        with self._lock:
+            self._checked = now
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                # Keep serving the last index until a new file appears
+                return self._index if path == self._path else None
+            signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if path != self._path or signature != self._signature:
+                # The old map is released once no lookup uses it any more
+                self._index = MetadataIndex(path)
+                self._path, self._signature = path, signature
+                self.reloads += 1
+        return self._index
+
+    def stats(self):
+        return {
+            "entries": len(self._index) if self._index is not None else 0,
+            "reloads": self.reloads,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+_loader = _IndexLoader()
+
+
+def get_metadata_index():
+    """Return the current :class:`MetadataIndex`, or ``None`` if none is configured."""
+    return _loader.get()
+
+
+def metadata_stats():
+    return _loader.stats()
+
+
+def attestation_roots(attestation_object):
+    """Return ``pem_root_certs_bytes_by_fmt`` for a raw attestation object.
+
+    ``None`` leaves verification to the library's defaults.  Raises
+    :class:`AttestationRejected` if the authenticator may not register.
+    """
+    required = settings.WEBAUTHN_REQUIRE_ATTESTATION
+    index = get_metadata_index()
+    if index is None:
+        if required:
+            raise AttestationRejected("No authenticator metadata is loaded")
+        return None
+
+    attestation = parse_attestation_object(attestation_object)
+    credential_data = attestation.auth_data.attested_credential_data
+    entry = index.get(credential_data.aaguid) if credential_data else None
+    if entry is None:
+        _loader.misses += 1
+        if required:
+            raise AttestationRejected("Authenticator is not in the metadata")
+        return None
+    _loader.hits += 1
+    if entry.compromised:
+        raise AttestationRejected(f"Authenticator {entry.description} is {entry.status}")
+    if required and not attestation.att_stmt.x5c:
+        raise AttestationRejected("Authenticator did not provide an attestation certificate")
+    return {attestation.fmt: entry.root_certificates}
@@ -0,0 +1,37 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='passkeycredential',
+            name='raw_credential_id',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name='passkeycredential',
+            name='raw_public_key',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name='passkeycredential',
+            name='credential_digest',
+            field=models.BinaryField(max_length=32, null=True, unique=True),
+        ),
+        # Nullable so the text columns can be dropped and restored on rollback
+        migrations.AlterField(
+            model_name='passkeycredential',
+            name='credential_id',
+            field=models.TextField(null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='passkeycredential',
+            name='public_key',
+            field=models.TextField(null=True),
+        ),
+    ]
@@ -0,0 +1,75 @@
+"""Convert base64url text credentials to raw bytes in small batches.
+
+Runs outside a migration-wide transaction: each batch commits on its own, so
+the table is only locked briefly and an interrupted run picks up where it
+stopped (rows that already have a digest are skipped).
+"""
+
+import base64
+import hashlib
+
+from django.db import migrations, transaction
+
+BATCH_SIZE = 1000
+
+
+def _b64decode(value):
+    return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+
+
+def _b64encode(value):
+    return base64.urlsafe_b64encode(bytes(value)).rstrip(b"=").decode("ascii")
+
+
+def _batches(queryset):
+    """Yield rows in pk order; each batch is updated inside its own transaction."""
+    last_pk = 0
+    while True:
+        with transaction.atomic(using=queryset.db):
+            batch = list(queryset.filter(pk__gt=last_pk).order_by("pk")[:BATCH_SIZE])
+            if not batch:
+                return
+            yield batch
+        last_pk = batch[-1].pk
+
+
+def text_to_binary(apps, schema_editor):
+    PasskeyCredential = apps.get_model("auth_app", "PasskeyCredential")
+    pending = PasskeyCredential.objects.using(schema_editor.connection.alias).filter(
+        credential_digest__isnull=True
+    )
+    for batch in _batches(pending):
+        for passkey in batch:
+            passkey.raw_credential_id = _b64decode(passkey.credential_id)
+            passkey.raw_public_key = _b64decode(passkey.public_key)
+            passkey.credential_digest = hashlib.sha256(passkey.raw_credential_id).digest()
+        PasskeyCredential.objects.using(pending.db).bulk_update(
+            batch, ["raw_credential_id", "raw_public_key", "credential_digest"]
+        )
+
+
+def binary_to_text(apps, schema_editor):
+    PasskeyCredential = apps.get_model("auth_app", "PasskeyCredential")
+    pending = PasskeyCredential.objects.using(schema_editor.connection.alias).filter(
+        credential_id__isnull=True
+    )
+    for batch in _batches(pending):
+        for passkey in batch:
+            passkey.credential_id = _b64encode(passkey.raw_credential_id)
+            passkey.public_key = _b64encode(passkey.raw_public_key)
+        PasskeyCredential.objects.using(pending.db).bulk_update(
+            batch, ["credential_id", "public_key"]
+        )
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('auth_app', '0002_passkeycredential_binary_columns'),
+    ]
+
+    operations = [
+        migrations.RunPython(text_to_binary, binary_to_text),
+    ]
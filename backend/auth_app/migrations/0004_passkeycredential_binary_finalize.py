@@ -0,0 +1,44 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_app', '0003_convert_passkey_credentials'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='passkeycredential',
+            name='credential_id',
+        ),
+        migrations.RemoveField(
+            model_name='passkeycredential',
+            name='public_key',
+        ),
+        migrations.RenameField(
+            model_name='passkeycredential',
+            old_name='raw_credential_id',
+            new_name='credential_id',
+        ),
+        migrations.RenameField(
+            model_name='passkeycredential',
+            old_name='raw_public_key',
+            new_name='public_key',
+        ),
+        migrations.AlterField(
+            model_name='passkeycredential',
+            name='credential_id',
+            field=models.BinaryField(),
+        ),
+        migrations.AlterField(
+            model_name='passkeycredential',
+            name='public_key',
+            field=models.BinaryField(),
+        ),
+        migrations.AlterField(
+            model_name='passkeycredential',
+            name='credential_digest',
+            field=models.BinaryField(max_length=32, unique=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-17 02:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_app', '0004_passkeycredential_binary_finalize'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='user_handle',
+            field=models.BinaryField(max_length=64, null=True, unique=True),
+        ),
+    ]
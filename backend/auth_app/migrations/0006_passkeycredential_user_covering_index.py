@@ -0,0 +1,25 @@
+# Generated by Django 5.2 on 2026-10-17 02:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_app', '0005_user_user_handle'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='passkeycredential',
+            index=models.Index(fields=['user'], include=('credential_id',), name='passkey_user_credential_idx'),
+        ),
+        # Drop the plain foreign key index only once the covering one exists
+        migrations.AlterField(
+            model_name='passkeycredential',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='passkeys', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2 on 2026-10-17 02:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_app', '0006_passkeycredential_user_covering_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='passkeycredential',
+            name='name',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='passkeycredential',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='passkey_user_created_idx'),
+        ),
+    ]
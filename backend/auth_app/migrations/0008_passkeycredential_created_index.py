@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-17 02:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_app', '0007_passkeycredential_name_user_created_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='passkeycredential',
+            index=models.Index(fields=['created_at', 'id'], name='passkey_created_idx'),
+        ),
+    ]
@@ -1,29 +1,146 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.deletion import Collector
 from django.contrib.auth.models import AbstractUser
-import base64
-import json
+from webauthn.helpers import bytes_to_base64url
+import hashlib
 
 
 class User(AbstractUser):
     """Extended User model for passkey authentication."""
 
     email = models.EmailField(unique=True, blank=False, null=False)
+    # WebAuthn user handle, returned by discoverable credentials at login
+    user_handle = models.BinaryField(max_length=64, unique=True, null=True)
 
     def __str__(self):
         return self.username
 
 
+def credential_digest(credential_id):
+    """Return the fixed-width lookup key for a raw credential ID."""
+    return hashlib.sha256(credential_id).digest()
+
+
+class PasskeyCredentialQuerySet(models.QuerySet):
+    def for_credential_id(self, credential_id):
+        """Filter by raw credential ID using the indexed digest column."""
+        return self.filter(credential_digest=credential_digest(credential_id))
+
+    def advance_counter(self, passkey, new_counter):
+        """Store ``new_counter`` unless another login moved the counter first.
+
+        Only the counter column is written, and only while it still holds the
+        value the assertion was verified against.  Returns ``False`` when no
+        row matched, i.e. a concurrent (or cloned) login got there first.
+        """
+        updated = self.filter(pk=passkey.pk, counter=passkey.counter).update(
+            counter=new_counter
+        )
+        if updated:
+            passkey.counter = new_counter
+        return bool(updated)
+
+    def advance_counters(self, changes):
+        """Apply :meth:`advance_counter` to many credentials in one UPDATE.
+
+        ``changes`` maps passkeys to their new counters.  Returns the passkeys
+        whose counter another login moved first; those rows are left alone.
+        """
+        if not changes:
+            return []
+        condition = models.Q()
+        for passkey in changes:
+            condition |= models.Q(pk=passkey.pk, counter=passkey.counter)
+        with transaction.atomic(using=self.db):
+            updated = self.filter(condition).update(
+                counter=models.Case(
+                    *(
+                        models.When(pk=passkey.pk, then=models.Value(new_counter))
+                        for passkey, new_counter in changes.items()
+                    ),
+                    default=models.F("counter"),
+                    output_field=self.model._meta.get_field("counter"),
+                )
+            )
+            if updated == len(changes):
+                for passkey, new_counter in changes.items():
+                    passkey.counter = new_counter
+                return []
+            # Rare: undo and find the rows that did not match one by one
+            transaction.set_rollback(True, using=self.db)
+        return [
+            passkey for passkey, new_counter in changes.items()
+            if not self.advance_counter(passkey, new_counter)
+        ]
+
+    def delete_with_owner(self):
+        """Delete the matching credentials in one statement, like ``delete()``.
+
+        The rows are loaded with their user, so the ``post_delete`` receivers
+        need no query per credential.  Returns the number deleted.
+        """
+        passkeys = list(
+            self.select_related("user").only("credential_digest", "user__username")
+        )
+        if not passkeys:
+            return 0
+        collector = Collector(using=self.db, origin=self)
+        collector.collect(passkeys)
+        return collector.delete()[0]
+
+    async def aadvance_counter(self, passkey, new_counter):
+        updated = await self.filter(pk=passkey.pk, counter=passkey.counter).aupdate(
+            counter=new_counter
+        )
+        if updated:
+            passkey.counter = new_counter
+        return bool(updated)
+
+
 class PasskeyCredential(models.Model):
     """Store WebAuthn passkey credentials."""
 
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="passkeys")
-    credential_id = models.TextField(unique=True)  # Base64 encoded credential ID
-    public_key = models.TextField()  # Base64 encoded public key
+    # Indexed by passkey_user_credential_idx below
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="passkeys", db_index=False
+    )
+    credential_id = models.BinaryField()  # Raw credential ID
+    # SHA-256 of credential_id; the unique index used for every lookup
+    credential_digest = models.BinaryField(max_length=32, unique=True)
+    public_key = models.BinaryField()  # COSE encoded public key
+    # Label chosen by the user in the passkey management API
+    name = models.CharField(max_length=64, blank=True, default="")
     counter = models.BigIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = PasskeyCredentialQuerySet.as_manager()
+
     class Meta:
         db_table = "passkey_credentials"
+        indexes = [
+            # Covers login_start's user -> credential IDs lookup, so PostgreSQL
+            # answers it from the index alone; elsewhere a plain user index
+            models.Index(
+                fields=["user"],
+                include=["credential_id"],
+                name="passkey_user_credential_idx",
+            ),
+            # Keyset pagination of a user's passkeys on (created_at, id)
+            models.Index(
+                fields=["user", "created_at", "id"],
+                name="passkey_user_created_idx",
+            ),
+            # Date filters and ordering of the admin changelist
+            models.Index(fields=["created_at", "id"], name="passkey_created_idx"),
+        ]
 
     def __str__(self):
-        return f"{self.user.username} - {self.credential_id[:20]}..."
+        return f"{self.user.username} - {self.credential_id_b64[:20]}..."
+
+    @property
+    def credential_id_b64(self):
+        return bytes_to_base64url(bytes(self.credential_id))
+
+    def save(self, *args, **kwargs):
+        self.credential_digest = credential_digest(bytes(self.credential_id))
+        super().save(*args, **kwargs)
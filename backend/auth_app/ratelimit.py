@@ -0,0 +1,177 @@
+"""Per-process token-bucket rate limiting for the auth endpoints.
+
+:class:`RateLimitMiddleware` checks ``settings.RATE_LIMITS`` before a view
+runs, so a rejected request costs no session, database or signature work.
+Limits are set per endpoint (URL name) and per key:
+
+* ``"ip"``: the client address (see ``settings.RATE_LIMIT_TRUSTED_PROXIES``),
+* ``"username"``: the ``username`` field of the JSON body,
+* ``"challenge"``: the ``challenge`` field of the JSON body.
+
+A rate such as ``"10/minute"`` allows bursts of 10 requests and refills at
+10 per minute.  The address is checked first; the body is only parsed when a
+username or challenge limit applies.  Rejections get ``429`` with
+``Retry-After``.
+
+Buckets live in one LRU map of at most ``settings.RATE_LIMIT_MAX_KEYS``
+entries per process, so memory stays bounded however many clients show up.
+An evicted key starts again with a full bucket.
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from rest_framework import status
+
+from .instrumentation import RATE_LIMITED, set_outcome
+from .renderers import FastJsonResponse, loads
+
+# Body keys are truncated so junk input cannot bloat the map
+_MAX_KEY_LENGTH = 128
+
+_PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_rate(rate):
+    """Return ``(capacity, tokens_per_second)`` for a rate like ``"10/minute"``."""
+    requests, period = rate.split("/")
+    requests = int(requests)
+    return requests, requests / _PERIODS[period[0]]
+
+
+class TokenBucketLimiter:
+    """Thread-safe, size-bounded map of key to token bucket."""
+
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def hit(self, key, capacity, refill_rate):
+        """Take a token for ``key``; return 0, or seconds until one is available."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                tokens = capacity
+            else:
+                tokens, updated = bucket
+                tokens = min(capacity, tokens + (now - updated) * refill_rate)
+                self._buckets.move_to_end(key)
+
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                self.allowed += 1
+                wait = 0
+            else:
+                self._buckets[key] = (tokens, now)
+                self.rejected += 1
+                wait = (1 - tokens) / refill_rate
+
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+                self.evictions += 1
+        return wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def stats(self):
+        return {
+            "size": len(self._buckets),
+            "max_keys": self.max_keys,
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+            "evictions": self.evictions,
+        }
+
+
+rate_limiter = TokenBucketLimiter(max_keys=settings.RATE_LIMIT_MAX_KEYS)
+
+
+def client_ip(request):
+    """Return the client address, trusting ``RATE_LIMIT_TRUSTED_PROXIES`` hops."""
+    proxies = settings.RATE_LIMIT_TRUSTED_PROXIES
+    forwarded = request.META.get("HTTP_X_FORWARDED_FOR")
+    if proxies and forwarded:
+        addresses = [address.strip() for address in forwarded.split(",")]
+        return addresses[-min(proxies, len(addresses))]
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def _body_field(request, field):
+    if request.content_type != "application/json":
+        return None
+    try:
+        data = loads(request.body or b"{}")
+    except Exception:
+        # Malformed or oversized bodies are the view's to reject
+        return None
+    value = data.get(field) if isinstance(data, dict) else None
+    return value[:_MAX_KEY_LENGTH] if isinstance(value, str) and value else None
+
+
+def check(request, endpoint):
+    """Return seconds to wait if ``request`` exceeds a limit, else 0."""
+    limits = settings.RATE_LIMITS.get(endpoint)
+    if not limits:
+        return 0
+    # Cheapest key first: a flood from one address never reaches the body
+    for kind in sorted(limits, key=lambda kind: kind != "ip"):
+        value = client_ip(request) if kind == "ip" else _body_field(request, kind)
+        if value is None:
+            continue
+        wait = rate_limiter.hit(f"{endpoint}:{kind}:{value}", *parse_rate(limits[kind]))
+        if wait:
+            return wait
+    return 0
+
+
+class RateLimitMiddleware:
+    """Reject over-limit requests; enabled by ``settings.RATE_LIMITING``."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.RATE_LIMITING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        # process_view does the work
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        return await self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        if match is None or not match.url_name:
+            return None
+        wait = check(request, match.url_name)
+        if not wait:
+            return None
+        set_outcome(RATE_LIMITED)
+        response = FastJsonResponse(
+            {"error": "Too many requests"}, status=status.HTTP_429_TOO_MANY_REQUESTS
+        )
+        response["Retry-After"] = str(math.ceil(wait))
+        return response
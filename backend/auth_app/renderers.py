@@ -0,0 +1,85 @@
+"""JSON encoding for the auth endpoints, using orjson when it is installed.
+
+:class:`FastJSONRenderer` and :class:`FastJSONParser` are drop-in DRF
+replacements for ``JSONRenderer`` and ``JSONParser``; :func:`dumps`,
+:func:`loads` and :class:`FastJsonResponse` do the same for the async views.
+orjson is listed in requirements.txt; where it cannot be installed
+everything falls back to the standard library, with the same output apart
+from whitespace.
+"""
+
+import json
+
+from django.http import HttpResponse
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - exercised when orjson is missing
+    orjson = None
+
+_fallback_encoder = JSONEncoder()
+
+
+def _default(obj):
+    # Types orjson leaves to us (Decimal, lazy strings, dates, ...)
+    return _fallback_encoder.default(obj)
+
+
+def dumps(data):
+    """Serialize ``data`` to compact UTF-8 JSON bytes."""
+    if orjson is not None:
+        try:
+            # Dates go through DRF's encoder too, to keep its formatting
+            return orjson.dumps(
+                data, default=_default, option=orjson.OPT_PASSTHROUGH_DATETIME
+            )
+        except TypeError:
+            # e.g. non-string dict keys, which orjson rejects by default
+            pass
+    return json.dumps(
+        data, cls=JSONEncoder, ensure_ascii=False, separators=(",", ":")
+    ).encode()
+
+
+def loads(data):
+    """Parse JSON from ``bytes`` or ``str``; raises ``ValueError`` on bad input."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """``JSONRenderer`` that encodes with orjson when possible."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        # Indented output (e.g. ``Accept: application/json; indent=4``) is
+        # left to the stdlib renderer
+        if orjson is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps(data)
+
+
+class FastJSONParser(JSONParser):
+    """``JSONParser`` that decodes with orjson when it is installed."""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except ValueError as exc:
+            raise ParseError(f"JSON parse error - {exc}")
+
+
+class FastJsonResponse(HttpResponse):
+    """``JsonResponse`` counterpart encoded with :func:`dumps`."""
+
+    def __init__(self, data, **kwargs):
+        kwargs.setdefault("content_type", "application/json")
+        super().__init__(content=dumps(data), **kwargs)
@@ -0,0 +1,83 @@
+"""Short-lived reservations of the username and email of a pending signup.
+
+``register_start`` reserves both values for as long as its challenge lives,
+so two concurrent signups for the same name cannot both reach attestation
+verification only for one to fail on the unique constraint.  A reservation
+is owned by one challenge; the applicant who holds it (same username and
+email) may restart the ceremony, which moves the reservation to the new
+challenge.  Reservations live in the cache named by
+``settings.RESERVATION_CACHE``, which must be shared between workers for
+the guarantee to hold across them; without it registration still works and
+the database's unique constraints decide a race.
+"""
+
+import hashlib
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from webauthn.helpers import bytes_to_base64url
+
+USERNAME = "username"
+EMAIL = "email"
+
+
+def reserve(username, email, challenge):
+    """Reserve both values for ``challenge``.
+
+    Returns ``None`` on success, or the name of the field (``"username"`` or
+    ``"email"``) that another pending registration already holds.
+    """
+    cache = _cache()
+    owner = (username, email, bytes_to_base64url(challenge))
+    reserved = []
+    for field, value in ((USERNAME, username), (EMAIL, email)):
+        key = _key(field, value)
+        if not cache.add(key, owner, _ttl()):
+            current = cache.get(key)
+            if current is not None and current[:2] != owner[:2]:
+                cache.delete_many(reserved)
+                return field
+            cache.set(key, owner, _ttl())
+        reserved.append(key)
+    return None
+
+
+def holds(username, email, challenge):
+    """Return whether no other challenge holds either reservation.
+
+    A missing reservation (expired, evicted, or kept in another worker's
+    cache) does not count against ``challenge``; the unique constraints
+    still reject a duplicate signup then.
+    """
+    owner = (username, email, bytes_to_base64url(challenge))
+    keys = [_key(USERNAME, username), _key(EMAIL, email)]
+    current = _cache().get_many(keys)
+    return all(current.get(key) in (None, owner) for key in keys)
+
+
+def release(username, email, challenge):
+    """Drop the reservations if ``challenge`` still owns them."""
+    owner = (username, email, bytes_to_base64url(challenge))
+    cache = _cache()
+    keys = [_key(USERNAME, username), _key(EMAIL, email)]
+    current = cache.get_many(keys)
+    cache.delete_many([key for key in keys if current.get(key) == owner])
+
+
+areserve = sync_to_async(reserve)
+aholds = sync_to_async(holds)
+arelease = sync_to_async(release)
+
+
+def _cache():
+    return caches[settings.RESERVATION_CACHE]
+
+
+def _key(field, value):
+    # Hashed: raw values may be long or hold spaces, which memcached rejects
+    return f"webauthn:reserve:{field}:{hashlib.sha256(value.encode()).hexdigest()}"
+
+
+def _ttl():
+    return int(settings.WEBAUTHN_TIMEOUT / 1000)
@@ -1,10 +1,22 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
+from webauthn.helpers import bytes_to_base64url
 from .models import PasskeyCredential
 
 User = get_user_model()
 
 
+class Base64URLField(serializers.Field):
+    """Read-only representation of a binary column as unpadded base64url."""
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return bytes_to_base64url(bytes(value))
+
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -13,8 +25,15 @@ class UserSerializer(serializers.ModelSerializer):
 
 
 class PasskeyCredentialSerializer(serializers.ModelSerializer):
+    credential_id = Base64URLField()
+    # Whether this is the passkey of the requesting session; needs the
+    # ``current_passkey_id`` context value
+    current = serializers.SerializerMethodField()
+
     class Meta:
         model = PasskeyCredential
-        fields = ('id', 'credential_id', 'created_at')
+        fields = ('id', 'credential_id', 'name', 'created_at', 'current')
         read_only_fields = ('id', 'created_at')
 
+    def get_current(self, obj):
+        return obj.pk == self.context.get('current_passkey_id')
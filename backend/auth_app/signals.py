@@ -0,0 +1,77 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.core.signals import setting_changed
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import ceremonies, descriptors, snapshots
+from .instrumentation import install_query_counter
+from .models import PasskeyCredential
+from .writebehind import record_last_login
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=PasskeyCredential)
+@receiver(post_delete, sender=PasskeyCredential)
+def invalidate_credential_descriptors(sender, instance, created=True, **kwargs):
+    """Refresh the owner's allowCredentials when a passkey is added or removed."""
+    if not created:
+        return
+    if PasskeyCredential.user.is_cached(instance):
+        username = instance.user.username
+    else:
+        username = (
+            User.objects.filter(pk=instance.user_id)
+            .values_list("username", flat=True)
+            .first()
+        )
+    if username is not None:
+        descriptors.invalidate(username)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_descriptors(sender, instance, update_fields=None, **kwargs):
+    """Drop a user's cached descriptors unless only e.g. last_login changed."""
+    if update_fields is not None and "username" not in update_fields:
+        return
+    descriptors.invalidate(instance.username)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_snapshot(sender, instance, update_fields=None, **kwargs):
+    """Drop the user_info snapshot unless only e.g. last_login changed."""
+    if update_fields is not None and not snapshots.SNAPSHOT_FIELDS & set(update_fields):
+        return
+    snapshots.invalidate(instance.pk)
+
+
+@receiver(user_logged_out)
+def invalidate_logged_out_snapshot(sender, user, **kwargs):
+    if user is not None:
+        snapshots.invalidate(user.pk)
+
+
+@receiver(setting_changed)
+def reset_static_options(setting, **kwargs):
+    """Rebuild the cached ceremony option fragments when their inputs change."""
+    if setting in {
+        "RP_ID",
+        "RP_NAME",
+        "WEBAUTHN_TIMEOUT",
+        "WEBAUTHN_DISCOVERABLE_LOGIN",
+        "WEBAUTHN_REQUIRE_ATTESTATION",
+    }:
+        ceremonies.reset_static_options()
+
+
+# Counts queries for ServerTimingMiddleware; a pass-through when it is off
+connection_created.connect(install_query_counter, dispatch_uid="auth_app.query_counter")
+
+# last_login is written by record_last_login, which buffers it when
+# LOGIN_WRITE_BEHIND is on and otherwise defers to update_last_login
+user_logged_in.disconnect(dispatch_uid="update_last_login")
+user_logged_in.connect(record_last_login, dispatch_uid="auth_app.record_last_login")
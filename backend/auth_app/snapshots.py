@@ -0,0 +1,162 @@
+"""Cached snapshots of signed-in users for ``user_info``.
+
+``user_info`` only returns a user's id, username and email, but the regular
+authentication path loads the whole ``User`` row on every request.  Instead,
+:func:`session_snapshot` keeps those fields plus the user's session auth hash
+in the cache named by ``settings.USER_SNAPSHOT_CACHE``.  A request whose
+session carries a matching hash is authenticated from the snapshot alone;
+anything else (no snapshot, a changed password, a rotated secret key) goes
+through Django's ``get_user()`` and refreshes the snapshot.
+
+Snapshots are dropped when the user is saved, deleted or logged out (see
+:mod:`auth_app.signals`) and expire after ``settings.USER_SNAPSHOT_TTL``
+seconds.  Each carries an ETag and a Last-Modified time, so
+:func:`conditional_response` can answer a revalidation with ``304`` before
+any database work.  With a cache-backed ``SESSION_MODE`` such a request runs
+no query at all; with ``"db"`` sessions it runs the session lookup only.
+"""
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.contrib.auth import (
+    BACKEND_SESSION_KEY,
+    HASH_SESSION_KEY,
+    SESSION_KEY,
+    aget_user,
+    get_user,
+    get_user_model,
+)
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.crypto import constant_time_compare
+from django.utils.http import http_date
+from rest_framework.authentication import SessionAuthentication
+
+from .ceremonies import user_payload
+from .renderers import dumps
+
+# Fields whose change alters a snapshot (password: the session auth hash)
+SNAPSHOT_FIELDS = frozenset({"username", "email", "password", "is_active"})
+
+
+class UserSnapshot:
+    """Read-only stand-in for the signed-in ``User``."""
+
+    is_active = True
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, entry):
+        self.payload = entry["user"]
+        self.pk = self.id = self.payload["id"]
+        self.username = self.payload["username"]
+        self.email = self.payload["email"]
+        self.etag = entry["etag"]
+        self.modified = entry["modified"]
+
+    def __str__(self):
+        return self.username
+
+
+def _cache():
+    return caches[settings.USER_SNAPSHOT_CACHE]
+
+
+def _key(user_pk):
+    return f"auth_app:user-snapshot:{user_pk}"
+
+
+def _entry(user):
+    payload = user_payload(user)
+    return {
+        "user": payload,
+        "hash": user.get_session_auth_hash(),
+        "etag": f'"{hashlib.sha256(dumps(payload)).hexdigest()[:20]}"',
+        "modified": int(time.time()),
+    }
+
+
+def _user_pk(user_id, backend):
+    if user_id is None or backend not in settings.AUTHENTICATION_BACKENDS:
+        return None
+    try:
+        return get_user_model()._meta.pk.to_python(user_id)
+    except ValidationError:
+        return None
+
+
+def _matches(entry, session_hash):
+    return (
+        entry is not None
+        and session_hash is not None
+        and constant_time_compare(session_hash, entry["hash"])
+    )
+
+
+def session_snapshot(request):
+    """Return a :class:`UserSnapshot` of the request's user, or ``None``."""
+    session = request.session
+    user_pk = _user_pk(session.get(SESSION_KEY), session.get(BACKEND_SESSION_KEY))
+    if user_pk is None:
+        return None
+    entry = _cache().get(_key(user_pk))
+    if not _matches(entry, session.get(HASH_SESSION_KEY)):
+        # Django's own checks, which also flush a stale session
+        user = get_user(request)
+        if not user.is_authenticated:
+            return None
+        entry = _entry(user)
+        _cache().set(_key(user.pk), entry, settings.USER_SNAPSHOT_TTL)
+    return UserSnapshot(entry)
+
+
+async def asession_snapshot(request):
+    """Async variant of :func:`session_snapshot`."""
+    session = request.session
+    user_pk = _user_pk(
+        await session.aget(SESSION_KEY), await session.aget(BACKEND_SESSION_KEY)
+    )
+    if user_pk is None:
+        return None
+    entry = await _cache().aget(_key(user_pk))
+    if not _matches(entry, await session.aget(HASH_SESSION_KEY)):
+        user = await aget_user(request)
+        if not user.is_authenticated:
+            return None
+        entry = _entry(user)
+        await _cache().aset(_key(user.pk), entry, settings.USER_SNAPSHOT_TTL)
+    return UserSnapshot(entry)
+
+
+def invalidate(user_pk):
+    _cache().delete(_key(user_pk))
+
+
+def conditional_response(request, snapshot):
+    """Return ``304`` if the client holds the current snapshot, else ``None``."""
+    response = get_conditional_response(
+        request, etag=snapshot.etag, last_modified=snapshot.modified
+    )
+    return add_validators(response, snapshot) if response is not None else None
+
+
+def add_validators(response, snapshot):
+    """Set ETag, Last-Modified and a revalidate-every-time cache policy."""
+    response["ETag"] = snapshot.etag
+    response["Last-Modified"] = http_date(snapshot.modified)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+class SnapshotSessionAuthentication(SessionAuthentication):
+    """``SessionAuthentication`` that yields a :class:`UserSnapshot`."""
+
+    def authenticate(self, request):
+        snapshot = session_snapshot(request._request)
+        if snapshot is None:
+            return None
+        self.enforce_csrf(request)
+        return (snapshot, None)
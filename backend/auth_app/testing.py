@@ -0,0 +1,213 @@
+"""A software WebAuthn authenticator for tests and load runs.
+
+:class:`VirtualAuthenticator` plays the browser and authenticator side of a
+ceremony: it turns the options returned by ``register/start/`` and
+``login/start/`` into the JSON credentials ``register/complete/`` and
+``login/complete/`` expect, with real ES256 keys and signatures, so the
+complete endpoints can be exercised without mocking verification.
+
+Attestation is ``"none"`` unless the authenticator is given an
+:class:`AttestationCA`, in which case it sends a ``"packed"`` attestation with
+a certificate issued by that CA and its ``aaguid``.
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import struct
+import threading
+import uuid
+
+import cbor2
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from django.conf import settings
+from webauthn.helpers import base64url_to_bytes, bytes_to_base64url
+
+from .ceremonies import EXPECTED_ORIGIN
+
+# authenticatorData flags
+_USER_PRESENT = 0x01
+_USER_VERIFIED = 0x04
+_ATTESTED_CREDENTIAL_DATA = 0x40
+
+
+class VirtualCredential:
+    """One key pair held by a :class:`VirtualAuthenticator`."""
+
+    def __init__(self, credential_id, private_key, user_handle):
+        self.credential_id = credential_id
+        self.private_key = private_key
+        self.user_handle = user_handle
+        self.sign_count = 0
+
+    def cose_public_key(self):
+        numbers = self.private_key.public_key().public_numbers()
+        return cbor2.dumps({
+            1: 2,    # kty: EC2
+            3: -7,   # alg: ES256
+            -1: 1,   # crv: P-256
+            -2: numbers.x.to_bytes(32, "big"),
+            -3: numbers.y.to_bytes(32, "big"),
+        })
+
+
+def _certificate(subject, public_key, issuer, issuer_key, ca):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return (
+        x509.CertificateBuilder()
+        .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, subject)]))
+        .issuer_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, issuer)]))
+        .public_key(public_key)
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=365))
+        .add_extension(x509.BasicConstraints(ca=ca, path_length=None), critical=True)
+        .sign(issuer_key, hashes.SHA256())
+    )
+
+
+class AttestationCA:
+    """Root certificate issuing attestation certificates for virtual authenticators."""
+
+    def __init__(self, name="Virtual Attestation Root"):
+        self.name = name
+        self.private_key = ec.generate_private_key(ec.SECP256R1())
+        self.certificate = _certificate(
+            name, self.private_key.public_key(), name, self.private_key, ca=True
+        )
+
+    @property
+    def pem(self):
+        return self.certificate.public_bytes(serialization.Encoding.PEM)
+
+    @property
+    def der(self):
+        return self.certificate.public_bytes(serialization.Encoding.DER)
+
+    def issue(self, subject="Virtual Authenticator"):
+        """Return ``(private_key, der_certificate)`` of a new attestation key."""
+        private_key = ec.generate_private_key(ec.SECP256R1())
+        certificate = _certificate(
+            subject, private_key.public_key(), self.name, self.private_key, ca=False
+        )
+        return private_key, certificate.public_bytes(serialization.Encoding.DER)
+
+
+class VirtualAuthenticator:
+    """Create and use ES256 passkeys from server-issued options."""
+
+    def __init__(self, rp_id=None, origin=EXPECTED_ORIGIN, aaguid=None, attestation_ca=None):
+        self.rp_id = rp_id or settings.RP_ID
+        self.origin = origin
+        self.aaguid = uuid.UUID(aaguid).bytes if aaguid else bytes(16)
+        self.attestation = attestation_ca.issue() if attestation_ca else None
+        self.credentials = {}
+        self._lock = threading.Lock()
+
+    def create(self, options):
+        """Return a registration credential for ``register/start/`` options."""
+        credential = VirtualCredential(
+            credential_id=os.urandom(16),
+            private_key=ec.generate_private_key(ec.SECP256R1()),
+            user_handle=base64url_to_bytes(options["user"]["id"]),
+        )
+        with self._lock:
+            self.credentials[credential.credential_id] = credential
+
+        credential_id = credential.credential_id
+        authenticator_data = (
+            self._rp_id_hash()
+            + bytes([_USER_PRESENT | _USER_VERIFIED | _ATTESTED_CREDENTIAL_DATA])
+            + struct.pack(">I", credential.sign_count)
+            + self.aaguid
+            + struct.pack(">H", len(credential_id))
+            + credential_id
+            + credential.cose_public_key()
+        )
+        client_data = self._client_data("webauthn.create", options["challenge"])
+        if self.attestation is None:
+            fmt, statement = "none", {}
+        else:
+            private_key, certificate = self.attestation
+            signature = private_key.sign(
+                authenticator_data + hashlib.sha256(client_data).digest(),
+                ec.ECDSA(hashes.SHA256()),
+            )
+            fmt, statement = "packed", {"alg": -7, "sig": signature, "x5c": [certificate]}
+        attestation_object = cbor2.dumps({
+            "fmt": fmt,
+            "attStmt": statement,
+            "authData": authenticator_data,
+        })
+        return {
+            "id": bytes_to_base64url(credential_id),
+            "rawId": bytes_to_base64url(credential_id),
+            "type": "public-key",
+            "response": {
+                "clientDataJSON": bytes_to_base64url(client_data),
+                "attestationObject": bytes_to_base64url(attestation_object),
+            },
+        }
+
+    def get(self, options, credential_id=None):
+        """Return an assertion for ``login/start/`` options.
+
+        Uses ``credential_id`` if given, otherwise the first stored credential
+        allowed by the options (any credential when ``allowCredentials`` is
+        empty, as in a discoverable login).
+        """
+        with self._lock:
+            if credential_id is None:
+                allowed = {
+                    base64url_to_bytes(descriptor["id"])
+                    for descriptor in options.get("allowCredentials") or ()
+                }
+                credential_id = next(
+                    (
+                        candidate for candidate in self.credentials
+                        if not allowed or candidate in allowed
+                    ),
+                    None,
+                )
+                if credential_id is None:
+                    raise ValueError("No stored credential is allowed by the options")
+            credential = self.credentials[credential_id]
+            credential.sign_count += 1
+            sign_count = credential.sign_count
+
+        authenticator_data = (
+            self._rp_id_hash()
+            + bytes([_USER_PRESENT | _USER_VERIFIED])
+            + struct.pack(">I", sign_count)
+        )
+        client_data = self._client_data("webauthn.get", options["challenge"])
+        signature = credential.private_key.sign(
+            authenticator_data + hashlib.sha256(client_data).digest(),
+            ec.ECDSA(hashes.SHA256()),
+        )
+        return {
+            "id": bytes_to_base64url(credential_id),
+            "rawId": bytes_to_base64url(credential_id),
+            "type": "public-key",
+            "response": {
+                "clientDataJSON": bytes_to_base64url(client_data),
+                "authenticatorData": bytes_to_base64url(authenticator_data),
+                "signature": bytes_to_base64url(signature),
+                "userHandle": bytes_to_base64url(credential.user_handle),
+            },
+        }
+
+    def _rp_id_hash(self):
+        return hashlib.sha256(self.rp_id.encode()).digest()
+
+    def _client_data(self, ceremony_type, challenge):
+        return json.dumps({
+            "type": ceremony_type,
+            "challenge": challenge,
+            "origin": self.origin,
+            "crossOrigin": False,
+        }).encode()
@@ -1,16 +1,65 @@
-from django.test import TestCase, Client
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+from django.core.cache import CacheKeyWarning, cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import OperationalError, connection, transaction
+from django.db.models import Q
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path
 from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.core.management import CommandError, call_command
 from rest_framework import status
 import json
+from unittest import mock
+import asyncio
+import base64
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import warnings
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone
+
+from . import admin as auth_admin, async_views, descriptors, instrumentation, renderers, reservations, snapshots, tokens
+from .ceremonies import authentication_options, registration_options, verify_authentication
+from .db import arun_with_retry, run_with_retry
+from .challenges import (
+    AUTHENTICATION,
+    REGISTRATION,
+    ChallengeStore,
+    PendingCeremony,
+    begin_ceremony,
+    finish_ceremony,
+)
+from .mds import get_metadata_index, write_index
+from .models import PasskeyCredential
+from .ratelimit import TokenBucketLimiter, rate_limiter
+from .testing import AttestationCA, VirtualAuthenticator
+from .token_verifier import InvalidToken, TokenVerifier, UnknownKey
+from .urls import ceremony_urlpatterns
+from .verification import VerificationExecutor, VerifierBusy
+from .writebehind import login_writes
 
 User = get_user_model()
 
+# Routes the ceremony endpoints to the async views for AsyncAuthAPITestCase
+urlpatterns = [
+    path('api/', include(ceremony_urlpatterns(async_views))),
+]
+
 
 class AuthAPITestCase(TestCase):
     """Test cases for authentication API endpoints."""
 
     def setUp(self):
         """Set up test client."""
+        cache.clear()
         self.client = Client()
         self.base_url = '/api/auth/'
 
@@ -158,3 +207,2211 @@ class AuthAPITestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIn('message', response.json())
 
+
+
+class ChallengeStoreTestCase(SimpleTestCase):
+    """Test cases for the pending challenge store."""
+
+    def test_pop_is_single_use(self):
+        """Test that a stored challenge can only be consumed once."""
+        store = ChallengeStore(ttl=60, max_entries=10)
+        ceremony = PendingCeremony(username='testuser', user_id=1)
+        store.put(b'challenge', ceremony)
+
+        self.assertEqual(store.pop(b'challenge'), ceremony)
+        self.assertIsNone(store.pop(b'challenge'))
+        self.assertEqual(store.stats()['hits'], 1)
+        self.assertEqual(store.stats()['misses'], 1)
+
+    def test_expired_challenge_is_rejected(self):
+        """Test that challenges past their TTL are not returned."""
+        store = ChallengeStore(ttl=0, max_entries=10)
+        store.put(b'challenge', PendingCeremony(username='testuser'))
+
+        self.assertIsNone(store.pop(b'challenge'))
+        self.assertEqual(store.stats()['expirations'], 1)
+
+    def test_expired_entries_are_swept_on_write(self):
+        """Test that writes drop expired entries instead of accumulating them."""
+        store = ChallengeStore(ttl=0, max_entries=10)
+        for i in range(5):
+            store.put(bytes([i]), PendingCeremony(username='testuser'))
+
+        self.assertEqual(len(store), 1)
+        self.assertEqual(store.stats()['expirations'], 4)
+
+    def test_expired_entries_are_swept_on_read(self):
+        """Test that reads sweep expired entries once per sweep interval."""
+        store = ChallengeStore(ttl=60, max_entries=10, sweep_interval=300)
+        for i in range(3):
+            store.put(bytes([i]), PendingCeremony(username='testuser'))
+        now = time.monotonic()
+
+        with mock.patch('auth_app.challenges.time.monotonic', return_value=now + 120):
+            store.pop(b'other')
+        self.assertEqual(len(store), 3)
+        with mock.patch('auth_app.challenges.time.monotonic', return_value=now + 400):
+            store.pop(b'other')
+        self.assertEqual(len(store), 0)
+        self.assertEqual(store.stats()['expirations'], 3)
+
+    def test_oldest_entry_is_evicted_at_capacity(self):
+        """Test that the store never grows beyond max_entries."""
+        store = ChallengeStore(ttl=60, max_entries=2)
+        for i in range(3):
+            store.put(bytes([i]), PendingCeremony(username=f'user{i}'))
+
+        self.assertEqual(len(store), 2)
+        self.assertIsNone(store.pop(bytes([0])))
+        self.assertEqual(store.pop(bytes([2])).username, 'user2')
+        self.assertEqual(store.stats()['evictions'], 1)
+
+
+@override_settings(CHALLENGE_MODE='token')
+class ChallengeTokenTestCase(SimpleTestCase):
+    """Test cases for stateless challenge tokens."""
+
+    def setUp(self):
+        cache.clear()
+        self.ceremony = PendingCeremony(
+            username='testuser', email='test@example.com', user_id=b'\x01' * 16
+        )
+
+    def test_token_round_trip(self):
+        """Test that a sealed ceremony is recovered by the complete step."""
+        token = begin_ceremony(REGISTRATION, b'challenge', self.ceremony)['challengeToken']
+        self.assertNotIn('testuser', token)
+        self.assertEqual(
+            finish_ceremony(REGISTRATION, b'challenge', token), self.ceremony
+        )
+
+    def test_token_is_single_use(self):
+        """Test that a token cannot be replayed."""
+        token = begin_ceremony(REGISTRATION, b'challenge', self.ceremony)['challengeToken']
+        self.assertIsNotNone(finish_ceremony(REGISTRATION, b'challenge', token))
+        self.assertIsNone(finish_ceremony(REGISTRATION, b'challenge', token))
+
+    def test_token_is_bound_to_challenge_and_kind(self):
+        """Test that a token only completes the ceremony it was issued for."""
+        token = begin_ceremony(REGISTRATION, b'challenge', self.ceremony)['challengeToken']
+        self.assertIsNone(finish_ceremony(REGISTRATION, b'other', token))
+        self.assertIsNone(finish_ceremony(AUTHENTICATION, b'challenge', token))
+
+    def test_tampered_token_is_rejected(self):
+        """Test that modified or missing tokens are rejected."""
+        token = begin_ceremony(REGISTRATION, b'challenge', self.ceremony)['challengeToken']
+        tampered = token[:-2] + ('A' if token[-2] != 'A' else 'B') + token[-1]
+        self.assertIsNone(finish_ceremony(REGISTRATION, b'challenge', tampered))
+        self.assertIsNone(finish_ceremony(REGISTRATION, b'challenge', None))
+
+
+@override_settings(ROOT_URLCONF='auth_app.tests')
+class AsyncAuthAPITestCase(TestCase):
+    """Test cases for the async ceremony endpoints."""
+
+    base_url = '/api/auth/'
+
+    def setUp(self):
+        cache.clear()
+
+    async def test_register_start_success(self):
+        """Test successful registration start."""
+        response = await self.async_client.post(
+            f'{self.base_url}register/start/',
+            data={'username': 'testuser', 'email': 'test@example.com'},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertIn('challenge', data)
+        self.assertEqual(data['rp']['id'], 'localhost')
+        self.assertEqual(data['user']['name'], 'testuser')
+
+    async def test_register_start_duplicate_username(self):
+        """Test registration start with duplicate username."""
+        await User.objects.acreate_user(
+            username='existinguser',
+            email='existing@example.com'
+        )
+
+        response = await self.async_client.post(
+            f'{self.base_url}register/start/',
+            data={'username': 'existinguser', 'email': 'new@example.com'},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('error', response.json())
+
+    async def test_register_start_rejects_get(self):
+        """Test that ceremony endpoints only accept POST."""
+        response = await self.async_client.get(f'{self.base_url}register/start/')
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    async def test_login_start_user_not_found(self):
+        """Test login start with non-existent user."""
+        response = await self.async_client.post(
+            f'{self.base_url}login/start/',
+            data={'username': 'nonexistent'},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_login_complete_invalid_challenge(self):
+        """Test login complete with an unknown challenge."""
+        response = await self.async_client.post(
+            f'{self.base_url}login/complete/',
+            data={'credential': {'id': 'abc'}, 'challenge': 'Y2hhbGxlbmdl'},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json()['error'], 'Invalid or expired challenge')
+
+    async def test_user_info(self):
+        """Test user info with and without a session."""
+        response = await self.async_client.get(f'{self.base_url}user/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        user = await User.objects.acreate_user(
+            username='testuser',
+            email='test@example.com'
+        )
+        await self.async_client.aforce_login(user)
+        response = await self.async_client.get(f'{self.base_url}user/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['username'], 'testuser')
+
+
+class VerificationExecutorTestCase(SimpleTestCase):
+    """Test cases for the bounded verification executor."""
+
+    def test_inline_run(self):
+        """Test that inline executors call the function directly."""
+        executor = VerificationExecutor(workers=0, max_pending=2)
+        self.assertEqual(executor.run(pow, 2, 10), 1024)
+        self.assertEqual(executor.stats()['completed'], 1)
+        self.assertEqual(executor.stats()['pending'], 0)
+
+    def test_process_pool_run(self):
+        """Test that pooled executors return results from a worker process."""
+        executor = VerificationExecutor(workers=1, max_pending=2, timeout=30)
+        self.addCleanup(executor.shutdown)
+        self.assertEqual(executor.run(pow, 2, 10), 1024)
+
+    def test_run_many(self):
+        """Test that a batch returns results and exceptions in call order."""
+        executor = VerificationExecutor(workers=0, max_pending=2)
+        results = executor.run_many(pow, [(2, 10), (2, 'x'), (3, 2)])
+        self.assertEqual(results[0], 1024)
+        self.assertIsInstance(results[1], TypeError)
+        self.assertEqual(results[2], 9)
+        # A batch takes at most the whole queue
+        self.assertEqual(executor.stats()['completed'], 2)
+        self.assertEqual(executor.stats()['pending'], 0)
+
+    def test_process_pool_run_many(self):
+        """Test that pooled batches return results from worker processes."""
+        executor = VerificationExecutor(workers=2, max_pending=4, timeout=30)
+        self.addCleanup(executor.shutdown)
+        self.assertEqual(executor.run_many(pow, [(2, 10), (3, 2)]), [1024, 9])
+
+    def test_saturated_executor_rejects(self):
+        """Test that a full queue raises VerifierBusy with a retry hint."""
+        executor = VerificationExecutor(workers=0, max_pending=1, retry_after=3)
+        executor.pending = 1
+        with self.assertRaises(VerifierBusy) as ctx:
+            executor.run(pow, 2, 10)
+        self.assertEqual(ctx.exception.retry_after, 3)
+        self.assertEqual(executor.stats()['rejected'], 1)
+
+    def test_inline_queue_is_unbounded_by_default(self):
+        """Test that only pooled executors cap the queue by default."""
+        self.assertIsNone(VerificationExecutor(workers=0).max_pending)
+        self.assertEqual(VerificationExecutor(workers=2).max_pending, 8)
+        executor = VerificationExecutor(workers=0)
+        slots = [executor.reserve() for _ in range(50)]
+        self.assertFalse(executor.saturated)
+        for slot in slots:
+            slot.release()
+        self.assertEqual(executor.stats()['pending'], 0)
+
+    def test_slot_is_held_until_work_finishes(self):
+        """Test that a slot handed to unfinished work is released when it finishes."""
+        executor = VerificationExecutor(workers=0, max_pending=2)
+        future = Future()
+        with executor.reserve(2) as slot:
+            slot.hold_until(future)
+        self.assertEqual(executor.stats()['pending'], 2)
+        future.set_result(None)
+        self.assertEqual(executor.stats()['pending'], 0)
+        # Releasing again does not free slots twice
+        slot.release()
+        self.assertEqual(executor.stats()['pending'], 0)
+
+    async def test_timed_out_call_keeps_its_slot(self):
+        """Test that a verification that timed out holds its slot until it returns."""
+        executor = VerificationExecutor(workers=0, max_pending=1, timeout=0.05)
+        finished = threading.Event()
+        with self.assertRaises(VerifierBusy):
+            await executor.arun(finished.wait, 5)
+        self.assertEqual(executor.stats()['timeouts'], 1)
+        self.assertTrue(executor.saturated)
+
+        finished.set()
+        for _ in range(100):
+            if not executor.saturated:
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual(executor.stats()['pending'], 0)
+
+    def test_complete_endpoints_shed_load(self):
+        """Test that complete endpoints answer 503 when the queue is full."""
+        executor = VerificationExecutor(workers=0, max_pending=1, retry_after=2)
+        executor.pending = 1
+        client = Client()
+        with mock.patch('auth_app.views.get_verifier', return_value=executor):
+            for endpoint in ('register/complete/', 'login/complete/'):
+                response = client.post(
+                    f'/api/auth/{endpoint}',
+                    data=json.dumps({'credential': {'id': 'abc'}, 'challenge': 'abc'}),
+                    content_type='application/json'
+                )
+                self.assertEqual(
+                    response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE
+                )
+                self.assertEqual(response['Retry-After'], '2')
+
+
+class PasskeyCredentialModelTestCase(TestCase):
+    """Test cases for binary credential storage."""
+
+    def test_lookup_by_raw_credential_id(self):
+        """Test that credentials are found through their digest."""
+        user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com'
+        )
+        passkey = PasskeyCredential.objects.create(
+            user=user, credential_id=b'\x00\xffcred', public_key=b'key'
+        )
+
+        self.assertEqual(len(passkey.credential_digest), 32)
+        found = PasskeyCredential.objects.for_credential_id(b'\x00\xffcred').get()
+        self.assertEqual(found.pk, passkey.pk)
+        self.assertEqual(bytes(found.public_key), b'key')
+        self.assertEqual(found.credential_id_b64, 'AP9jcmVk')
+        self.assertFalse(
+            PasskeyCredential.objects.for_credential_id(b'other').exists()
+        )
+
+
+class LoginCompleteTestCase(TestCase):
+    """Test cases for the credential lookup and counter update in login complete."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.base_url = '/api/auth/'
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com'
+        )
+        self.passkey = PasskeyCredential.objects.create(
+            user=self.user, credential_id=b'cred', public_key=b'key', counter=5
+        )
+
+    def _login_complete(self):
+        options = self.client.post(
+            f'{self.base_url}login/start/',
+            data=json.dumps({'username': 'testuser'}),
+            content_type='application/json'
+        ).json()
+        return self.client.post(
+            f'{self.base_url}login/complete/',
+            data=json.dumps({
+                'credential': {'id': 'Y3JlZA', 'rawId': 'Y3JlZA'},
+                'challenge': options['challenge'],
+            }),
+            content_type='application/json'
+        )
+
+    def test_counter_is_advanced(self):
+        """Test that a verified login stores the new sign counter."""
+        verification = mock.Mock(new_sign_count=6)
+        with mock.patch('auth_app.views.verify_authentication', return_value=verification):
+            response = self._login_complete()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['user']['username'], 'testuser')
+        self.passkey.refresh_from_db()
+        self.assertEqual(self.passkey.counter, 6)
+
+    def test_busy_verifier_keeps_the_challenge(self):
+        """Test that a 503 leaves the login ceremony usable for a retry."""
+        executor = VerificationExecutor(workers=0, max_pending=1)
+        options = self.client.post(
+            f'{self.base_url}login/start/',
+            data=json.dumps({'username': 'testuser'}),
+            content_type='application/json'
+        ).json()
+        complete = {
+            'credential': {'id': 'Y3JlZA', 'rawId': 'Y3JlZA'},
+            'challenge': options['challenge'],
+        }
+        verification = mock.Mock(new_sign_count=6)
+        with mock.patch('auth_app.views.get_verifier', return_value=executor):
+            with executor.reserve():
+                response = self.client.post(
+                    f'{self.base_url}login/complete/',
+                    data=json.dumps(complete),
+                    content_type='application/json'
+                )
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+            with mock.patch('auth_app.views.verify_authentication', return_value=verification):
+                response = self.client.post(
+                    f'{self.base_url}login/complete/',
+                    data=json.dumps(complete),
+                    content_type='application/json'
+                )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(executor.stats()['pending'], 0)
+
+    def test_unchanged_counter_is_not_written(self):
+        """Test that a login reporting the same counter skips the passkey update."""
+        verification = mock.Mock(new_sign_count=5)
+        with mock.patch('auth_app.views.verify_authentication', return_value=verification):
+            with CaptureQueriesContext(connection) as queries:
+                response = self._login_complete()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(
+            [query for query in queries if query['sql'].startswith('UPDATE "passkey_credentials"')]
+        )
+
+    def test_concurrent_counter_update_conflicts(self):
+        """Test that a login losing the counter race is rejected."""
+        def verify_while_another_login_wins(*args):
+            PasskeyCredential.objects.filter(pk=self.passkey.pk).update(counter=6)
+            return mock.Mock(new_sign_count=6)
+
+        with mock.patch(
+            'auth_app.views.verify_authentication',
+            side_effect=verify_while_another_login_wins,
+        ):
+            response = self._login_complete()
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_credential_of_another_user_is_not_found(self):
+        """Test that the lookup is scoped to the user who started the login."""
+        other = User.objects.create_user(
+            username='otheruser',
+            email='other@example.com'
+        )
+        self.passkey.user = other
+        self.passkey.save()
+        PasskeyCredential.objects.create(
+            user=self.user, credential_id=b'mine', public_key=b'key'
+        )
+
+        response = self._login_complete()
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class LoginStartDescriptorCacheTestCase(TestCase):
+    """Test cases for the cached allowCredentials list."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com'
+        )
+        PasskeyCredential.objects.create(
+            user=self.user, credential_id=b'first', public_key=b'key'
+        )
+
+    def _allowed_ids(self):
+        response = self.client.post(
+            '/api/auth/login/start/',
+            data=json.dumps({'username': 'testuser'}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(cred['id'] for cred in response.json()['allowCredentials'])
+
+    def test_warm_login_start_skips_database(self):
+        """Test that a cached login start runs no queries."""
+        with self.assertNumQueries(1):
+            self.assertEqual(self._allowed_ids(), ['Zmlyc3Q'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self._allowed_ids(), ['Zmlyc3Q'])
+
+    def test_new_and_deleted_passkeys_invalidate(self):
+        """Test that adding or removing a passkey refreshes the list."""
+        self._allowed_ids()
+        second = PasskeyCredential.objects.create(
+            user=self.user, credential_id=b'second', public_key=b'key'
+        )
+        self.assertEqual(self._allowed_ids(), ['Zmlyc3Q', 'c2Vjb25k'])
+
+        PasskeyCredential.objects.get(pk=second.pk).delete()
+        self.assertEqual(self._allowed_ids(), ['Zmlyc3Q'])
+
+    def test_cache_key_is_safe_for_any_username(self):
+        """Test that usernames with spaces or of any length make valid cache keys."""
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', CacheKeyWarning)
+            self.assertIsNone(descriptors.login_descriptors('no such user ' * 30))
+
+
+@override_settings(WEBAUTHN_DISCOVERABLE_LOGIN=True)
+class DiscoverableLoginTestCase(TestCase):
+    """Test cases for username-less login with discoverable credentials."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.base_url = '/api/auth/'
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            user_handle=b'handle',
+        )
+        PasskeyCredential.objects.create(
+            user=self.user, credential_id=b'cred', public_key=b'key'
+        )
+
+    def _post(self, endpoint, data):
+        return self.client.post(
+            f'{self.base_url}{endpoint}',
+            data=json.dumps(data),
+            content_type='application/json'
+        )
+
+    def test_registration_requests_discoverable_credential(self):
+        """Test that registration asks for a resident key."""
+        response = self._post(
+            'register/start/', {'username': 'newuser', 'email': 'new@example.com'}
+        )
+        self.assertEqual(
+            response.json()['authenticatorSelection']['residentKey'], 'preferred'
+        )
+
+    def test_login_start_without_username_skips_database(self):
+        """Test that username-less login start returns no allowCredentials."""
+        with self.assertNumQueries(0):
+            response = self._post('login/start/', {})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['allowCredentials'], [])
+
+    def test_login_complete_resolves_user_from_handle(self):
+        """Test that the user handle identifies the user at login complete."""
+        options = self._post('login/start/', {}).json()
+        credential = {
+            'id': 'Y3JlZA',
+            'rawId': 'Y3JlZA',
+            'response': {'userHandle': 'aGFuZGxl'},
+        }
+        verification = mock.Mock(new_sign_count=0)
+        with mock.patch('auth_app.views.verify_authentication', return_value=verification):
+            response = self._post(
+                'login/complete/',
+                {'credential': credential, 'challenge': options['challenge']},
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['user']['username'], 'testuser')
+
+    def test_login_complete_requires_matching_handle(self):
+        """Test that a credential is not accepted under another user handle."""
+        options = self._post('login/start/', {}).json()
+        credential = {
+            'id': 'Y3JlZA',
+            'rawId': 'Y3JlZA',
+            'response': {'userHandle': 'b3RoZXI'},
+        }
+        response = self._post(
+            'login/complete/',
+            {'credential': credential, 'challenge': options['challenge']},
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class RegistrationReservationTestCase(TestCase):
+    """Test cases for username and email reservations during registration."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.base_url = '/api/auth/'
+
+    def _register_start(self, username, email):
+        return self.client.post(
+            f'{self.base_url}register/start/',
+            data=json.dumps({'username': username, 'email': email}),
+            content_type='application/json'
+        )
+
+    def test_uniqueness_is_checked_in_one_query(self):
+        """Test that username and email are checked together."""
+        User.objects.create_user(username='existinguser', email='existing@example.com')
+        with self.assertNumQueries(1):
+            response = self._register_start('newuser', 'existing@example.com')
+        self.assertEqual(response.json()['error'], 'Email already exists')
+
+    def test_concurrent_signup_for_same_username_is_rejected(self):
+        """Test that a pending registration holds its username."""
+        self.assertEqual(
+            self._register_start('testuser', 'first@example.com').status_code,
+            status.HTTP_200_OK,
+        )
+        response = self._register_start('testuser', 'second@example.com')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json()['error'], 'Username is already being registered')
+
+        # The failed attempt must not keep its email reserved
+        self.assertEqual(
+            self._register_start('otheruser', 'second@example.com').status_code,
+            status.HTTP_200_OK,
+        )
+
+    def test_same_applicant_can_restart(self):
+        """Test that restarting a registration moves the reservation."""
+        first = self._register_start('testuser', 'test@example.com').json()
+        second = self._register_start('testuser', 'test@example.com').json()
+
+        verify = mock.Mock()
+        with mock.patch('auth_app.views.verify_registration', verify):
+            response = self.client.post(
+                f'{self.base_url}register/complete/',
+                data=json.dumps({'credential': {'id': 'abc'}, 'challenge': first['challenge']}),
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        verify.assert_not_called()
+
+        verification = mock.Mock(
+            credential_id=b'cred', credential_public_key=b'key', sign_count=0
+        )
+        with mock.patch('auth_app.views.verify_registration', return_value=verification):
+            response = self.client.post(
+                f'{self.base_url}register/complete/',
+                data=json.dumps({'credential': {'id': 'abc'}, 'challenge': second['challenge']}),
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(User.objects.filter(username='testuser').exists())
+
+    @override_settings(CHALLENGE_MODE='token')
+    def test_missing_reservation_does_not_block(self):
+        """Test that a complete landing where the reservation is unknown still registers."""
+        options = self._register_start('testuser', 'test@example.com').json()
+        # Another worker with its own cache
+        cache.clear()
+
+        verification = mock.Mock(
+            credential_id=b'cred', credential_public_key=b'key', sign_count=0
+        )
+        with mock.patch('auth_app.views.verify_registration', return_value=verification):
+            response = self.client.post(
+                f'{self.base_url}register/complete/',
+                data=json.dumps({
+                    'credential': {'id': 'abc'},
+                    'challenge': options['challenge'],
+                    'challengeToken': options['challengeToken'],
+                }),
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_cache_keys_are_safe_for_any_value(self):
+        """Test that values with spaces or of any length make valid cache keys."""
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', CacheKeyWarning)
+            self.assertIsNone(
+                reservations.reserve('test user ' * 30, 'test@example.com', b'challenge')
+            )
+            self.assertTrue(
+                reservations.holds('test user ' * 30, 'test@example.com', b'challenge')
+            )
+
+
+class PasskeyTransferCommandTestCase(TestCase):
+    """Test cases for the export_passkeys and import_passkeys commands."""
+
+    def setUp(self):
+        cache.clear()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.created_at = datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+        for i in range(5):
+            user = User.objects.create_user(
+                username=f'user{i}',
+                email=f'user{i}@example.com',
+                user_handle=bytes([i]) * 16,
+            )
+            passkey = PasskeyCredential.objects.create(
+                user=user,
+                credential_id=b'\x00cred%d' % i,
+                public_key=b'key%d' % i,
+                name=f'Key {i}',
+                counter=i,
+            )
+            PasskeyCredential.objects.filter(pk=passkey.pk).update(created_at=self.created_at)
+
+    def _path(self, name):
+        return os.path.join(self.tmpdir.name, name)
+
+    def _call(self, *args, **options):
+        call_command(*args, stdout=io.StringIO(), stderr=io.StringIO(), **options)
+
+    def test_round_trip(self):
+        """Test that an export can be imported into an empty database."""
+        export_path = self._path('export.jsonl')
+        self._call('export_passkeys', output=export_path, chunk_size=2)
+        with open(export_path) as f:
+            self.assertEqual(len(f.readlines()), 5)
+
+        User.objects.all().delete()
+        self._call('import_passkeys', export_path, batch_size=2)
+
+        self.assertEqual(User.objects.count(), 5)
+        user = User.objects.get(username='user3')
+        self.assertEqual(user.email, 'user3@example.com')
+        self.assertEqual(bytes(user.user_handle), b'\x03' * 16)
+        self.assertFalse(user.has_usable_password())
+        passkey = PasskeyCredential.objects.for_credential_id(b'\x00cred3').get()
+        self.assertEqual(passkey.user, user)
+        self.assertEqual(bytes(passkey.public_key), b'key3')
+        self.assertEqual(passkey.name, 'Key 3')
+        self.assertEqual(passkey.counter, 3)
+        self.assertEqual(passkey.created_at, self.created_at)
+
+    def test_import_skips_existing(self):
+        """Test that users and credentials already present are left alone."""
+        export_path = self._path('export.jsonl')
+        self._call('export_passkeys', output=export_path)
+        User.objects.filter(username__in=['user0', 'user1']).delete()
+
+        self._call('import_passkeys', export_path)
+
+        self.assertEqual(User.objects.count(), 5)
+        self.assertEqual(PasskeyCredential.objects.count(), 5)
+
+    def test_export_resumes_from_checkpoint(self):
+        """Test that a resumed export continues the same file without duplicates."""
+        export_path = self._path('export.jsonl')
+        checkpoint_path = self._path('export.checkpoint')
+        last = User.objects.get(username='user2')
+        with open(export_path, 'w') as f:
+            f.write('{"username": "partial"')
+        with open(checkpoint_path, 'w') as f:
+            json.dump({'last_id': last.pk, 'offset': 0}, f)
+
+        self._call('export_passkeys', output=export_path, checkpoint=checkpoint_path)
+
+        with open(export_path) as f:
+            usernames = [json.loads(line)['username'] for line in f]
+        self.assertEqual(usernames, ['user3', 'user4'])
+
+    def test_import_resumes_from_checkpoint(self):
+        """Test that lines before the checkpoint are not imported again."""
+        export_path = self._path('export.jsonl')
+        checkpoint_path = self._path('import.checkpoint')
+        self._call('export_passkeys', output=export_path)
+        User.objects.all().delete()
+        with open(checkpoint_path, 'w') as f:
+            json.dump({'line': 3}, f)
+
+        self._call('import_passkeys', export_path, checkpoint=checkpoint_path)
+
+        self.assertEqual(
+            sorted(User.objects.values_list('username', flat=True)),
+            ['user3', 'user4'],
+        )
+        with open(checkpoint_path) as f:
+            self.assertEqual(json.load(f), {'line': 5})
+
+
+class CeremonyTestCase(TestCase):
+    """Test cases for complete ceremonies signed by a virtual authenticator."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.base_url = '/api/auth/'
+        self.authenticator = VirtualAuthenticator()
+
+    def _post(self, endpoint, data):
+        return self.client.post(
+            f'{self.base_url}{endpoint}',
+            data=json.dumps(data),
+            content_type='application/json'
+        )
+
+    def _register(self, username='testuser'):
+        options = self._post(
+            'register/start/', {'username': username, 'email': f'{username}@example.com'}
+        ).json()
+        return self._post('register/complete/', {
+            'credential': self.authenticator.create(options),
+            'challenge': options['challenge'],
+        })
+
+    def test_register_and_login(self):
+        """Test that a real attestation and assertion are accepted."""
+        response = self._register()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        passkey = PasskeyCredential.objects.get(user__username='testuser')
+
+        self.client = Client()
+        options = self._post('login/start/', {'username': 'testuser'}).json()
+        assertion = self.authenticator.get(options)
+        response = self._post('login/complete/', {
+            'credential': assertion, 'challenge': options['challenge']
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['user']['username'], 'testuser')
+        passkey.refresh_from_db()
+        self.assertEqual(passkey.counter, 1)
+        self.assertEqual(self.client.session['passkey_id'], passkey.pk)
+
+        # The challenge is single-use
+        response = self._post('login/complete/', {
+            'credential': assertion, 'challenge': options['challenge']
+        })
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_login_with_wrong_key_fails(self):
+        """Test that an assertion signed by another key is rejected."""
+        self._register()
+        options = self._post('login/start/', {'username': 'testuser'}).json()
+        assertion = self.authenticator.get(options)
+        other = VirtualAuthenticator()
+        other.create({'user': {'id': 'AA'}, 'challenge': 'AA'})
+        forged = other.get(options, credential_id=next(iter(other.credentials)))
+        assertion['response']['signature'] = forged['response']['signature']
+
+        response = self._post('login/complete/', {
+            'credential': assertion, 'challenge': options['challenge']
+        })
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(ROOT_URLCONF='auth_app.tests')
+class AsyncCeremonyTestCase(TestCase):
+    """Test cases for complete ceremonies against the async views."""
+
+    base_url = '/api/auth/'
+
+    def setUp(self):
+        cache.clear()
+
+    async def test_register_and_login(self):
+        """Test that a real attestation and assertion are accepted."""
+        authenticator = VirtualAuthenticator()
+        options = (await self.async_client.post(
+            f'{self.base_url}register/start/',
+            data={'username': 'testuser', 'email': 'test@example.com'},
+            content_type='application/json'
+        )).json()
+        response = await self.async_client.post(
+            f'{self.base_url}register/complete/',
+            data={'credential': authenticator.create(options), 'challenge': options['challenge']},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        options = (await self.async_client.post(
+            f'{self.base_url}login/start/',
+            data={'username': 'testuser'},
+            content_type='application/json'
+        )).json()
+        response = await self.async_client.post(
+            f'{self.base_url}login/complete/',
+            data={'credential': authenticator.get(options), 'challenge': options['challenge']},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class LoadTestCommandTestCase(TestCase):
+    """Test cases for the loadtest command."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_in_process_run(self):
+        """Test that a small in-process run succeeds and reports every endpoint."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output = os.path.join(tmpdir, 'results.json')
+            call_command(
+                'loadtest', users=2, concurrency=1, logins=2, output=output,
+                stdout=io.StringIO(),
+            )
+            with open(output) as f:
+                results = json.load(f)
+
+        self.assertEqual(results['failed_users'], 0)
+        self.assertEqual(results['requests'], 2 * (3 + 2 * 2))
+        login = results['endpoints']['login_complete']
+        self.assertEqual(login['requests'], 4)
+        self.assertEqual(login['errors'], 0)
+        self.assertGreater(login['queries_per_request'], 0)
+        self.assertLessEqual(login['latency_ms']['p50'], login['latency_ms']['p99'])
+        # Users created by the run are cleaned up
+        self.assertFalse(User.objects.filter(username__startswith='loadtest-').exists())
+
+
+@override_settings(REQUEST_INSTRUMENTATION=True, METRICS_TOKEN='scrape-secret')
+class InstrumentationTestCase(TestCase):
+    """Test cases for Server-Timing headers and the metrics endpoint."""
+
+    def setUp(self):
+        cache.clear()
+        for histogram in instrumentation.HISTOGRAMS:
+            histogram.clear()
+        self.client = Client()
+        self.base_url = '/api/auth/'
+        self.authenticator = VirtualAuthenticator()
+
+    def _post(self, endpoint, data):
+        return self.client.post(
+            f'{self.base_url}{endpoint}',
+            data=json.dumps(data),
+            content_type='application/json'
+        )
+
+    def _metrics(self, token='scrape-secret'):
+        return self.client.get('/metrics', HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def _login(self):
+        options = self._post(
+            'register/start/', {'username': 'testuser', 'email': 'test@example.com'}
+        ).json()
+        self._post('register/complete/', {
+            'credential': self.authenticator.create(options),
+            'challenge': options['challenge'],
+        })
+        options = self._post('login/start/', {'username': 'testuser'}).json()
+        return self._post('login/complete/', {
+            'credential': self.authenticator.get(options),
+            'challenge': options['challenge'],
+        })
+
+    def test_server_timing_phases(self):
+        """Test that login complete reports each phase and its queries."""
+        response = self._login()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        entries = [entry.split(';')[0] for entry in response['Server-Timing'].split(', ')]
+        for name in ('challenge', 'lookup', 'verification', 'parse', 'verify',
+                     'counter', 'login', 'render', 'db', 'total'):
+            self.assertIn(name, entries)
+        self.assertIn('lookup;dur=', response['Server-Timing'])
+        self.assertRegex(response['Server-Timing'], r'lookup;dur=[\d.]+;desc="1 queries"')
+
+    def test_metrics_by_endpoint_and_outcome(self):
+        """Test that requests are aggregated by endpoint and outcome."""
+        self._login()
+        self._post('login/complete/', {'credential': {'id': 'abc'}, 'challenge': 'AAAA'})
+
+        response = self._metrics()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        body = response.content.decode()
+        self.assertIn(
+            'pasky_request_duration_seconds_count{endpoint="login_complete",outcome="success"} 1',
+            body,
+        )
+        self.assertIn(
+            'pasky_request_duration_seconds_count'
+            '{endpoint="login_complete",outcome="invalid_challenge"} 1',
+            body,
+        )
+        self.assertIn(
+            'pasky_request_phase_duration_seconds_count{endpoint="login_complete",phase="verify"} 1',
+            body,
+        )
+        self.assertIn('pasky_challenge_store_size', body)
+        self.assertIn('pasky_verifier_completed_total', body)
+
+    @override_settings(SERVER_TIMING_HEADER=False)
+    def test_header_can_be_disabled(self):
+        """Test that metrics are kept without sending Server-Timing."""
+        response = self._login()
+        self.assertNotIn('Server-Timing', response)
+        self.assertIn('login_complete', self._metrics().content.decode())
+
+    @override_settings(REQUEST_INSTRUMENTATION=False)
+    def test_disabled_by_default(self):
+        """Test that nothing is instrumented or served when disabled."""
+        response = self._login()
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(self._metrics().status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_metrics_require_token_or_staff(self):
+        """Test that only the scraper token or a staff user may read the metrics."""
+        self.assertEqual(self._metrics(token='wrong').status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_403_FORBIDDEN)
+        with override_settings(METRICS_TOKEN=''):
+            self.assertEqual(self._metrics(token='').status_code, status.HTTP_403_FORBIDDEN)
+
+        self._login()
+        self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_403_FORBIDDEN)
+        User.objects.filter(username='testuser').update(is_staff=True)
+        self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_200_OK)
+
+
+@override_settings(ROOT_URLCONF='auth_app.tests', REQUEST_INSTRUMENTATION=True)
+class AsyncInstrumentationTestCase(TestCase):
+    """Test cases for instrumentation of the async views."""
+
+    base_url = '/api/auth/'
+
+    def setUp(self):
+        cache.clear()
+
+    async def test_server_timing_phases(self):
+        """Test that async login complete reports its phases and queries."""
+        authenticator = VirtualAuthenticator()
+        options = (await self.async_client.post(
+            f'{self.base_url}register/start/',
+            data={'username': 'testuser', 'email': 'test@example.com'},
+            content_type='application/json'
+        )).json()
+        await self.async_client.post(
+            f'{self.base_url}register/complete/',
+            data={'credential': authenticator.create(options), 'challenge': options['challenge']},
+            content_type='application/json'
+        )
+        options = (await self.async_client.post(
+            f'{self.base_url}login/start/',
+            data={'username': 'testuser'},
+            content_type='application/json'
+        )).json()
+        response = await self.async_client.post(
+            f'{self.base_url}login/complete/',
+            data={'credential': authenticator.get(options), 'challenge': options['challenge']},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertRegex(response['Server-Timing'], r'lookup;dur=[\d.]+;desc="1 queries"')
+        self.assertIn('verification;dur=', response['Server-Timing'])
+
+
+SESSION_ENGINES = (
+    'django.contrib.sessions.backends.db',
+    'django.contrib.sessions.backends.cached_db',
+    'django.contrib.sessions.backends.cache',
+    'django.contrib.sessions.backends.signed_cookies',
+)
+
+
+class SessionModeTestCase(TestCase):
+    """Test cases for the auth endpoints under each supported session engine."""
+
+    base_url = '/api/auth/'
+
+    def setUp(self):
+        cache.clear()
+
+    def _post(self, client, endpoint, data):
+        return client.post(
+            f'{self.base_url}{endpoint}',
+            data=json.dumps(data),
+            content_type='application/json'
+        )
+
+    def _ceremonies(self, username):
+        authenticator = VirtualAuthenticator()
+        client = Client()
+        options = self._post(client, 'register/start/', {
+            'username': username, 'email': f'{username}@example.com'
+        }).json()
+        response = self._post(client, 'register/complete/', {
+            'credential': authenticator.create(options), 'challenge': options['challenge']
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(client.get(f'{self.base_url}user/').status_code, status.HTTP_200_OK)
+
+        client = Client()
+        options = self._post(client, 'login/start/', {'username': username}).json()
+        response = self._post(client, 'login/complete/', {
+            'credential': authenticator.get(options), 'challenge': options['challenge']
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            client.get(f'{self.base_url}user/').json()['username'], username
+        )
+
+        response = client.post(f'{self.base_url}logout/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            client.get(f'{self.base_url}user/').status_code, status.HTTP_403_FORBIDDEN
+        )
+
+    def test_login_flow_per_engine(self):
+        """Test register, login, user info and logout with every engine."""
+        for index, engine in enumerate(SESSION_ENGINES):
+            with self.subTest(engine=engine), self.settings(SESSION_ENGINE=engine):
+                self._ceremonies(f'user{index}')
+
+    def test_cache_sessions_skip_the_database(self):
+        """Test that cache and cookie sessions never write session rows."""
+        for index, engine in enumerate(SESSION_ENGINES[2:]):
+            with self.subTest(engine=engine), self.settings(SESSION_ENGINE=engine):
+                self._ceremonies(f'user{index}')
+                self.assertFalse(Session.objects.exists())
+
+
+class PurgeSessionsCommandTestCase(TestCase):
+    """Test cases for the purge_sessions command."""
+
+    def _session(self, key, expires_in):
+        Session.objects.create(
+            session_key=key,
+            session_data='',
+            expire_date=datetime.now(timezone.utc) + expires_in,
+        )
+
+    def test_deletes_expired_sessions_in_batches(self):
+        """Test that only expired sessions are deleted, in several batches."""
+        for i in range(5):
+            self._session(f'expired{i}', timedelta(days=-1))
+        self._session('active', timedelta(days=1))
+
+        out = io.StringIO()
+        call_command('purge_sessions', batch_size=2, stdout=out)
+
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['active'])
+        self.assertIn('Deleted 5 expired sessions in 3 batches', out.getvalue())
+
+    def test_max_batches(self):
+        """Test that a run can be capped and resumed by the next one."""
+        for i in range(5):
+            self._session(f'expired{i}', timedelta(days=-1))
+
+        call_command('purge_sessions', batch_size=2, max_batches=1, stdout=io.StringIO())
+        self.assertEqual(Session.objects.count(), 3)
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cache')
+    def test_cache_engine_has_nothing_to_purge(self):
+        """Test that non-database engines are left alone."""
+        self._session('expired', timedelta(days=-1))
+        out = io.StringIO()
+        call_command('purge_sessions', stdout=out)
+        self.assertIn('keeps no session rows', out.getvalue())
+        self.assertEqual(Session.objects.count(), 1)
+
+
+@override_settings(DB_LOCK_RETRIES=2, DB_LOCK_RETRY_BACKOFF=0)
+class LockRetryTestCase(TransactionTestCase):
+    """Test cases for retrying write transactions on lock contention."""
+
+    def _flaky(self, failures, message='database is locked'):
+        calls = []
+
+        def write():
+            calls.append(1)
+            User.objects.create_user(username=f'user{len(calls)}')
+            if len(calls) <= failures:
+                raise OperationalError(message)
+            return len(calls)
+
+        return write, calls
+
+    def test_retries_until_success(self):
+        """Test that a locked transaction is rolled back and run again."""
+        write, calls = self._flaky(failures=2)
+        self.assertEqual(run_with_retry(write), 3)
+        # Only the successful attempt's writes are kept
+        self.assertEqual(list(User.objects.values_list('username', flat=True)), ['user3'])
+
+    def test_gives_up_after_retries(self):
+        """Test that the lock error is raised once the retries are used up."""
+        write, calls = self._flaky(failures=3)
+        with self.assertRaisesMessage(OperationalError, 'database is locked'):
+            run_with_retry(write)
+        self.assertEqual(len(calls), 3)
+        self.assertFalse(User.objects.exists())
+
+    def test_postgresql_conflicts_are_retried(self):
+        """Test that deadlocks and serialization failures count as contention."""
+        calls = []
+
+        def write():
+            calls.append(1)
+            if len(calls) == 1:
+                cause = Exception('deadlock detected')
+                cause.sqlstate = '40P01'
+                raise OperationalError('deadlock detected') from cause
+            return 'done'
+
+        self.assertEqual(run_with_retry(write), 'done')
+        self.assertEqual(len(calls), 2)
+
+    def test_other_errors_are_not_retried(self):
+        """Test that unrelated database errors propagate immediately."""
+        write, calls = self._flaky(failures=1, message='disk I/O error')
+        with self.assertRaises(OperationalError):
+            run_with_retry(write)
+        self.assertEqual(len(calls), 1)
+
+    def test_not_retried_inside_outer_transaction(self):
+        """Test that a nested transaction cannot be retried on its own."""
+        write, calls = self._flaky(failures=1)
+        with self.assertRaises(OperationalError):
+            with transaction.atomic():
+                run_with_retry(write)
+        self.assertEqual(len(calls), 1)
+
+    async def test_async_retries_until_success(self):
+        """Test that the async variant retries the same way."""
+        write, calls = self._flaky(failures=1)
+        self.assertEqual(await arun_with_retry(write), 2)
+
+
+class StaticOptionsTestCase(SimpleTestCase):
+    """Test cases for the precomputed parts of the ceremony options."""
+
+    def test_only_per_request_fields_change(self):
+        """Test that two start requests differ only in challenge and user."""
+        first_challenge, first_user_id, first = registration_options('alice')
+        second_challenge, second_user_id, second = registration_options('bob')
+
+        self.assertNotEqual(first_challenge, second_challenge)
+        self.assertNotEqual(first_user_id, second_user_id)
+        self.assertEqual(second['user']['name'], 'bob')
+        for key in ('rp', 'pubKeyCredParams', 'authenticatorSelection', 'timeout', 'attestation'):
+            self.assertIs(first[key], second[key])
+
+        _, options = authentication_options([b'cred'])
+        self.assertEqual(options['allowCredentials'], [{'id': 'Y3JlZA', 'type': 'public-key'}])
+        self.assertEqual(options['rpId'], 'localhost')
+
+    def test_settings_changes_rebuild_fragments(self):
+        """Test that the fragments follow RP and timeout settings."""
+        with self.settings(RP_NAME='Other App', WEBAUTHN_TIMEOUT=30000):
+            _, _, options = registration_options('alice')
+            self.assertEqual(options['rp']['name'], 'Other App')
+            self.assertEqual(options['timeout'], 30000)
+            self.assertEqual(authentication_options([])[1]['timeout'], 30000)
+        _, _, options = registration_options('alice')
+        self.assertEqual(options['rp']['name'], 'Pasky Auth App')
+
+
+class FastJSONTestCase(TestCase):
+    """Test cases for the orjson-backed renderer and parser."""
+
+    data = {
+        'user': {'username': 'zoë', 'id': 1},
+        'when': datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc),
+        'items': [1, 2.5, None, True],
+    }
+
+    def test_render_matches_stdlib(self):
+        """Test that both encoders produce the same JSON document."""
+        from rest_framework.renderers import JSONRenderer
+
+        expected = json.loads(JSONRenderer().render(self.data))
+        self.assertEqual(json.loads(renderers.FastJSONRenderer().render(self.data)), expected)
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertEqual(json.loads(renderers.FastJSONRenderer().render(self.data)), expected)
+            self.assertEqual(renderers.loads(b'{"a": [1]}'), {'a': [1]})
+
+    def test_indent_uses_stdlib(self):
+        """Test that an indented response is still honoured."""
+        rendered = renderers.FastJSONRenderer().render(
+            {'a': 1}, 'application/json; indent=2'
+        )
+        self.assertEqual(rendered, b'{\n  "a": 1\n}')
+
+    def test_endpoint_rejects_malformed_json(self):
+        """Test that the parser answers 400 for a malformed body."""
+        cache.clear()
+        response = self.client.post(
+            '/api/auth/register/start/', data=b'{"username":', content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('JSON parse error', response.json()['detail'])
+
+
+@override_settings(
+    RATE_LIMITING=True,
+    RATE_LIMITS={
+        'register_start': {'ip': '5/minute', 'username': '2/minute'},
+        'login_complete': {'ip': '10/minute', 'challenge': '2/minute'},
+    },
+)
+class RateLimitTestCase(TestCase):
+    """Test cases for the token-bucket rate limiter."""
+
+    base_url = '/api/auth/'
+
+    def setUp(self):
+        cache.clear()
+        rate_limiter.clear()
+
+    def _post(self, endpoint, data, **extra):
+        return self.client.post(
+            f'{self.base_url}{endpoint}',
+            data=json.dumps(data),
+            content_type='application/json',
+            **extra
+        )
+
+    def test_bucket_refills(self):
+        """Test that a bucket allows a burst, then refills over time."""
+        limiter = TokenBucketLimiter(max_keys=10)
+        with mock.patch('auth_app.ratelimit.time.monotonic', return_value=100.0):
+            self.assertEqual(limiter.hit('k', 2, 1.0), 0)
+            self.assertEqual(limiter.hit('k', 2, 1.0), 0)
+            self.assertAlmostEqual(limiter.hit('k', 2, 1.0), 1.0)
+        with mock.patch('auth_app.ratelimit.time.monotonic', return_value=101.5):
+            self.assertEqual(limiter.hit('k', 2, 1.0), 0)
+        self.assertEqual(limiter.stats()['rejected'], 1)
+
+    def test_bucket_map_is_bounded(self):
+        """Test that the least recently used buckets are evicted."""
+        limiter = TokenBucketLimiter(max_keys=2)
+        for key in ('a', 'b', 'a', 'c'):
+            limiter.hit(key, 5, 1.0)
+        self.assertEqual(len(limiter), 2)
+        self.assertEqual(list(limiter._buckets), ['a', 'c'])
+        self.assertEqual(limiter.stats()['evictions'], 1)
+
+    def test_username_limit(self):
+        """Test that register start is limited per username with Retry-After."""
+        for _ in range(2):
+            response = self._post('register/start/', {'username': 'alice', 'email': 'a@example.com'})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self._post('register/start/', {'username': 'alice', 'email': 'a@example.com'})
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        self.assertEqual(response.json(), {'error': 'Too many requests'})
+
+        response = self._post('register/start/', {'username': 'bob', 'email': 'b@example.com'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_ip_limit_runs_before_database(self):
+        """Test that an address over its limit is rejected without queries."""
+        for index in range(5):
+            self._post('register/start/', {'username': f'user{index}', 'email': f'user{index}@example.com'})
+        with self.assertNumQueries(0):
+            response = self._post('register/start/', {'username': 'other', 'email': 'other@example.com'})
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+        response = self._post(
+            'register/start/', {'username': 'other', 'email': 'other@example.com'}, REMOTE_ADDR='10.0.0.2'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_challenge_limit(self):
+        """Test that junk credentials against one challenge are cut off."""
+        data = {'credential': {'id': 'abc'}, 'challenge': 'AAAA'}
+        for _ in range(2):
+            response = self._post('login/complete/', data)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self._post('login/complete/', data)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    @override_settings(RATE_LIMIT_TRUSTED_PROXIES=1)
+    def test_trusted_proxy_address(self):
+        """Test that the address added by a trusted proxy is the key."""
+        for index in range(5):
+            self._post(
+                'register/start/', {'username': f'user{index}', 'email': f'user{index}@example.com'},
+                HTTP_X_FORWARDED_FOR='1.2.3.4, 10.0.0.9',
+            )
+        response = self._post(
+            'register/start/', {'username': 'other', 'email': 'other@example.com'},
+            HTTP_X_FORWARDED_FOR='1.2.3.4, 10.0.0.10',
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self._post(
+            'register/start/', {'username': 'other2', 'email': 'other2@example.com'},
+            HTTP_X_FORWARDED_FOR='10.0.0.9',
+        )
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    @override_settings(ROOT_URLCONF='auth_app.tests')
+    async def test_async_views(self):
+        """Test that the async views are limited the same way."""
+        data = {'credential': {'id': 'abc'}, 'challenge': 'AAAA'}
+        statuses = []
+        for _ in range(3):
+            response = await self.async_client.post(
+                f'{self.base_url}login/complete/', data=data, content_type='application/json'
+            )
+            statuses.append(response.status_code)
+        self.assertEqual(statuses[-1], status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', response)
+
+    @override_settings(ROOT_URLCONF='auth_app.tests', REQUEST_INSTRUMENTATION=True)
+    async def test_async_views_with_instrumentation(self):
+        """Test that the async middleware chain works with instrumentation in front."""
+        data = {'credential': {'id': 'abc'}, 'challenge': 'AAAA'}
+        statuses = []
+        for _ in range(3):
+            response = await self.async_client.post(
+                f'{self.base_url}login/complete/', data=data, content_type='application/json'
+            )
+            statuses.append(response.status_code)
+            self.assertIn('Server-Timing', response)
+        self.assertEqual(statuses, [
+            status.HTTP_400_BAD_REQUEST,
+            status.HTTP_400_BAD_REQUEST,
+            status.HTTP_429_TOO_MANY_REQUESTS,
+        ])
+
+
+@override_settings(LOGIN_WRITE_BEHIND=True, WRITE_BEHIND_FLUSH_INTERVAL=0)
+class LoginWriteBehindTestCase(LoginCompleteTestCase):
+    """Test cases for buffered sign counter and last_login writes."""
+
+    def setUp(self):
+        super().setUp()
+        login_writes.clear()
+        self.addCleanup(login_writes.clear)
+
+    def _login_with_counter(self, new_sign_count):
+        verification = mock.Mock(new_sign_count=new_sign_count)
+        with mock.patch('auth_app.views.verify_authentication', return_value=verification) as verify:
+            response = self._login_complete()
+        return response, verify
+
+    def test_counter_is_advanced(self):
+        """Test that a verified login's counter and last_login reach the database on flush."""
+        response, _ = self._login_with_counter(6)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.passkey.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertEqual(self.passkey.counter, 5)
+        self.assertIsNone(self.user.last_login)
+        self.assertEqual(login_writes.stats()['pending_counters'], 1)
+
+        self.assertEqual(login_writes.flush(), 2)
+        self.passkey.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertEqual(self.passkey.counter, 6)
+        self.assertIsNotNone(self.user.last_login)
+        self.assertEqual(len(login_writes), 0)
+
+    @override_settings(WRITE_BEHIND_MAX_PENDING=2)
+    def test_full_buffer_flushes_without_thread(self):
+        """Test that a full buffer is written after the login commits when no thread runs."""
+        with self.captureOnCommitCallbacks(execute=True):
+            response, _ = self._login_with_counter(6)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.passkey.refresh_from_db()
+        self.assertEqual(self.passkey.counter, 6)
+        self.assertEqual(len(login_writes), 0)
+
+    def test_buffered_counter_is_verified_against(self):
+        """Test that the next login is checked against the buffered counter."""
+        self._login_with_counter(6)
+        response, verify = self._login_with_counter(7)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(verify.call_args.args[-1], 6)
+
+    def test_concurrent_counter_update_conflicts(self):
+        """Test that a login losing the race to a buffered counter is rejected."""
+        def verify_while_another_login_wins(*args):
+            other = PasskeyCredential.objects.get(pk=self.passkey.pk)
+            login_writes.advance_counter(other, 6)
+            return mock.Mock(new_sign_count=6)
+
+        with mock.patch(
+            'auth_app.views.verify_authentication',
+            side_effect=verify_while_another_login_wins,
+        ):
+            response = self._login_complete()
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_unchanged_counter_is_not_written(self):
+        """Test that a counter reported unchanged is neither buffered nor written."""
+        skipped = login_writes.skipped
+        response, _ = self._login_with_counter(5)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(login_writes.stats()['pending_counters'], 0)
+        self.assertEqual(login_writes.skipped, skipped + 1)
+
+    def test_flush_never_lowers_counter(self):
+        """Test that a flush keeps a higher counter written in the meantime."""
+        self._login_with_counter(6)
+        PasskeyCredential.objects.filter(pk=self.passkey.pk).update(counter=9)
+        login_writes.flush()
+        self.passkey.refresh_from_db()
+        self.assertEqual(self.passkey.counter, 9)
+
+    def test_failed_flush_keeps_changes(self):
+        """Test that changes are put back when a flush fails."""
+        self._login_with_counter(6)
+        with mock.patch('auth_app.writebehind._write', side_effect=OperationalError('disk I/O error')):
+            with self.assertRaises(OperationalError):
+                login_writes.flush()
+        self.assertEqual(login_writes.stats()['pending_counters'], 1)
+        login_writes.flush()
+        self.passkey.refresh_from_db()
+        self.assertEqual(self.passkey.counter, 6)
+
+
+class PasskeyManagementTestCase(TestCase):
+    """Test cases for listing, renaming and revoking one's passkeys."""
+
+    base_url = '/api/auth/passkeys/'
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', email='test@example.com')
+        self.other = User.objects.create_user(username='otheruser', email='other@example.com')
+        self.passkeys = [
+            PasskeyCredential.objects.create(
+                user=self.user, credential_id=f'cred{i}'.encode(), public_key=b'key'
+            )
+            for i in range(7)
+        ]
+        # Two passkeys registered in the same instant
+        same_time = self.passkeys[3].created_at
+        PasskeyCredential.objects.filter(pk=self.passkeys[2].pk).update(created_at=same_time)
+        self.foreign = PasskeyCredential.objects.create(
+            user=self.other, credential_id=b'foreign', public_key=b'key'
+        )
+        self.client.force_login(self.user)
+        self.current = self.passkeys[0]
+        session = self.client.session
+        session['passkey_id'] = self.current.pk
+        session.save()
+
+    def _pages(self, page_size):
+        ids, url = [], f'{self.base_url}?page_size={page_size}'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            body = response.json()
+            self.assertLessEqual(len(body['results']), page_size)
+            ids.extend(item['id'] for item in body['results'])
+            url = body['next']
+        return ids
+
+    def test_list_pages_newest_first(self):
+        """Test that keyset pages cover every passkey once, newest first."""
+        expected = list(
+            PasskeyCredential.objects.filter(user=self.user)
+            .order_by('-created_at', '-pk')
+            .values_list('pk', flat=True)
+        )
+        self.assertEqual(self._pages(page_size=2), expected)
+        self.assertEqual(self._pages(page_size=100), expected)
+        self.assertNotIn(self.foreign.pk, expected)
+
+    def test_list_item_fields(self):
+        """Test that items carry the label and mark the session's passkey."""
+        results = self.client.get(self.base_url).json()['results']
+        current = [item for item in results if item['current']]
+        self.assertEqual([item['id'] for item in current], [self.current.pk])
+        self.assertEqual(set(results[0]), {'id', 'credential_id', 'name', 'created_at', 'current'})
+
+    def test_deep_page_costs_the_same(self):
+        """Test that a later page runs the same queries as the first."""
+        first = self.client.get(f'{self.base_url}?page_size=2').json()
+        with CaptureQueriesContext(connection) as first_queries:
+            self.client.get(f'{self.base_url}?page_size=2')
+        with CaptureQueriesContext(connection) as next_queries:
+            self.client.get(first['next'])
+        self.assertEqual(len(first_queries), len(next_queries))
+        self.assertNotIn('OFFSET', next_queries[-1]['sql'])
+
+    def test_invalid_cursor(self):
+        """Test that a malformed cursor is rejected."""
+        response = self.client.get(f'{self.base_url}?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_rename(self):
+        """Test that a passkey can be renamed."""
+        passkey = self.passkeys[1]
+        response = self.client.patch(
+            f'{self.base_url}{passkey.pk}/',
+            data=json.dumps({'name': 'Work laptop'}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['name'], 'Work laptop')
+        passkey.refresh_from_db()
+        self.assertEqual(passkey.name, 'Work laptop')
+
+        response = self.client.patch(
+            f'{self.base_url}{passkey.pk}/',
+            data=json.dumps({'name': 'x' * 65}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cannot_touch_foreign_passkey(self):
+        """Test that another user's passkey is not found."""
+        url = f'{self.base_url}{self.foreign.pk}/'
+        response = self.client.patch(
+            url, data=json.dumps({'name': 'mine'}), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertTrue(PasskeyCredential.objects.filter(pk=self.foreign.pk).exists())
+
+    def test_delete(self):
+        """Test that a passkey can be deleted."""
+        passkey = self.passkeys[1]
+        response = self.client.delete(f'{self.base_url}{passkey.pk}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(PasskeyCredential.objects.filter(pk=passkey.pk).exists())
+
+    def test_revoke_others(self):
+        """Test that all but the session's passkey are deleted in one statement."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(f'{self.base_url}revoke-others/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {'revoked': 6})
+        self.assertEqual(
+            list(PasskeyCredential.objects.filter(user=self.user)), [self.current]
+        )
+        self.assertTrue(PasskeyCredential.objects.filter(pk=self.foreign.pk).exists())
+        deletes = [query for query in queries if query['sql'].startswith('DELETE')]
+        self.assertEqual(len(deletes), 1)
+
+    def test_revoke_others_needs_passkey_session(self):
+        """Test that a session without a known passkey cannot revoke."""
+        session = self.client.session
+        del session['passkey_id']
+        session.save()
+        response = self.client.post(f'{self.base_url}revoke-others/')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(PasskeyCredential.objects.filter(user=self.user).count(), 7)
+
+    def test_requires_auth(self):
+        """Test that the endpoints need a signed-in user."""
+        self.client.logout()
+        response = self.client.get(self.base_url)
+        self.assertIn(response.status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+
+
+class PasskeyAdminTestCase(TestCase):
+    """Test cases for the passkey and user changelists."""
+
+    url = '/admin/auth_app/passkeycredential/'
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='password'
+        )
+        self.client.force_login(self.admin)
+
+    def _add_passkeys(self, start, stop):
+        for i in range(start, stop):
+            user = User.objects.create_user(username=f'user{i}', email=f'user{i}@example.com')
+            PasskeyCredential.objects.create(
+                user=user, credential_id=f'cred{i}'.encode(), public_key=b'key'
+            )
+
+    def _changelist(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [str(obj) for obj in response.context['cl'].result_list]
+
+    def test_changelist_query_count_is_constant(self):
+        """Test that rows and their users are fetched together."""
+        self._add_passkeys(0, 3)
+        with CaptureQueriesContext(connection) as few:
+            self._changelist()
+        self._add_passkeys(3, 20)
+        with CaptureQueriesContext(connection) as many:
+            self._changelist()
+        self.assertEqual(len(few), len(many))
+        self.assertFalse([q for q in many if 'COUNT(*)' in q['sql'] and 'LIMIT' not in q['sql']])
+
+    def test_search_by_username_prefix(self):
+        """Test that a search matches usernames by prefix, case-sensitively."""
+        self._add_passkeys(0, 12)
+        results = self._changelist(q='user1')
+        self.assertEqual(len(results), 3)  # user1, user10, user11
+        self.assertEqual(self._changelist(q='USER1'), [])
+
+    def test_prefix_search_uses_like_outside_sqlite(self):
+        """Test that other databases match a prefix with LIKE rather than a range."""
+        self.assertEqual(
+            auth_admin.prefix_condition('username', 'user1', 'postgresql'),
+            Q(username__startswith='user1'),
+        )
+        self.assertEqual(
+            auth_admin.prefix_condition('username', 'user1', 'sqlite'),
+            Q(username__gte='user1', username__lt='user1\U0010ffff'),
+        )
+
+    def test_search_by_credential_id_respects_filters(self):
+        """Test that a credential ID search stays within the date filter."""
+        self._add_passkeys(0, 2)
+        self.assertEqual(len(self._changelist(q='Y3JlZDE')), 1)
+        self.assertEqual(self._changelist(q='Y3JlZDE', created_at__year='1999'), [])
+
+    def test_paginator_estimates_unfiltered_count(self):
+        """Test that an unfiltered listing uses the estimate of a large table."""
+        self._add_passkeys(0, 2)
+        with mock.patch.object(auth_admin, 'estimated_count', return_value=5000000):
+            response = self.client.get(self.url)
+            self.assertEqual(response.context['cl'].result_count, 5000000)
+            response = self.client.get(self.url, {'q': 'user'})
+            self.assertEqual(response.context['cl'].result_count, 2)
+
+    def test_user_search_is_exact_on_email(self):
+        """Test that the user changelist matches a whole email address."""
+        self._add_passkeys(0, 2)
+        response = self.client.get('/admin/auth_app/user/', {'q': 'user1@example.com'})
+        self.assertEqual(
+            [user.username for user in response.context['cl'].result_list], ['user1']
+        )
+        response = self.client.get('/admin/auth_app/user/', {'q': 'example.com'})
+        self.assertEqual(list(response.context['cl'].result_list), [])
+
+
+class UserInfoSnapshotTestCase(TestCase):
+    """Test cases for the cached user snapshot and conditional user info."""
+
+    url = '/api/auth/user/'
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', email='test@example.com')
+        self.client.force_login(self.user)
+
+    def test_validators(self):
+        """Test that user info carries ETag, Last-Modified and a private cache policy."""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['email'], 'test@example.com')
+        self.assertTrue(response['ETag'].startswith('"'))
+        self.assertIn('Last-Modified', response)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('no-cache', response['Cache-Control'])
+
+    def test_revalidation_skips_user_row(self):
+        """Test that a warm snapshot answers 304 with only the session lookup."""
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cache')
+    def test_revalidation_without_queries(self):
+        """Test that with cache sessions a revalidation runs no query at all."""
+        self.client.force_login(self.user)
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_snapshot_refreshed_when_user_saved(self):
+        """Test that saving the user changes the payload and the ETag."""
+        etag = self.client.get(self.url)['ETag']
+        self.user.email = 'new@example.com'
+        self.user.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['email'], 'new@example.com')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_last_login_keeps_snapshot(self):
+        """Test that a last_login-only save keeps the cached snapshot."""
+        self.client.get(self.url)
+        self.user.save(update_fields=['last_login'])
+        self.assertIsNotNone(cache.get(snapshots._key(self.user.pk)))
+
+    def test_password_change_ends_session(self):
+        """Test that a snapshot does not outlive the session auth hash."""
+        self.client.get(self.url)
+        User.objects.filter(pk=self.user.pk).update(password='changed')
+        snapshots.invalidate(self.user.pk)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_stale_session_hash_is_rejected(self):
+        """Test that a session whose hash no longer matches the snapshot is rejected."""
+        self.client.get(self.url)
+        session = self.client.session
+        session['_auth_user_hash'] = 'stale'
+        session.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_logout_drops_snapshot(self):
+        """Test that logging out removes the snapshot."""
+        self.client.get(self.url)
+        self.client.post('/api/auth/logout/')
+        self.assertIsNone(cache.get(snapshots._key(self.user.pk)))
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+
+    @override_settings(ROOT_URLCONF='auth_app.tests')
+    async def test_async_revalidation(self):
+        """Test that the async view answers 304 from the snapshot."""
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['username'], 'testuser')
+        response = await self.async_client.get(self.url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+CERTIFIED_AAGUID = '6d44ba9b-f6ec-2e49-b930-0c8fe920cb73'
+REVOKED_AAGUID = '2fc0579f-8113-47ea-b116-bb5a8db9202a'
+
+
+class MetadataIndexTestCase(TestCase):
+    """Test cases for the FIDO metadata index and attestation checks."""
+
+    def setUp(self):
+        cache.clear()
+        self.ca = AttestationCA()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(directory))
+        self.path = os.path.join(directory, 'mds.idx')
+        write_index(self._payload(), self.path)
+        self.enterContext(self.settings(MDS_INDEX_PATH=self.path, MDS_RELOAD_INTERVAL=0))
+
+    def _payload(self, *extra):
+        root = base64.b64encode(self.ca.der).decode()
+        return {
+            'no': 1,
+            'nextUpdate': '2030-01-01',
+            'entries': [
+                {
+                    'aaguid': CERTIFIED_AAGUID,
+                    'metadataStatement': {
+                        'description': 'Certified Key', 'attestationRootCertificates': [root],
+                    },
+                    'statusReports': [{'status': 'FIDO_CERTIFIED'}],
+                },
+                {
+                    'aaguid': REVOKED_AAGUID,
+                    'metadataStatement': {
+                        'description': 'Revoked Key', 'attestationRootCertificates': [root],
+                    },
+                    'statusReports': [{'status': 'FIDO_CERTIFIED'}, {'status': 'REVOKED'}],
+                },
+                {'attestationCertificateKeyIdentifiers': ['abcd'], 'metadataStatement': {}},
+                *extra,
+            ],
+        }
+
+    def _register(self, authenticator, username='testuser'):
+        options = self.client.post(
+            '/api/auth/register/start/',
+            data=json.dumps({'username': username, 'email': f'{username}@example.com'}),
+            content_type='application/json'
+        ).json()
+        return self.client.post(
+            '/api/auth/register/complete/',
+            data=json.dumps({
+                'credential': authenticator.create(options),
+                'challenge': options['challenge'],
+            }),
+            content_type='application/json'
+        )
+
+    def test_index_lookup(self):
+        """Test that entries are found by AAGUID and key-identifier entries skipped."""
+        index = get_metadata_index()
+        self.assertEqual(len(index), 2)
+        entry = index.get(uuid.UUID(CERTIFIED_AAGUID).bytes)
+        self.assertEqual(entry.description, 'Certified Key')
+        self.assertTrue(entry.root_certificates[0].startswith(b'-----BEGIN CERTIFICATE-----'))
+        self.assertFalse(entry.compromised)
+        self.assertIsNone(index.get(bytes(16)))
+
+    @override_settings(WEBAUTHN_REQUIRE_ATTESTATION=True)
+    def test_attested_registration(self):
+        """Test that an authenticator chaining to its listed root registers."""
+        options = self.client.post(
+            '/api/auth/register/start/',
+            data=json.dumps({'username': 'probe', 'email': 'probe@example.com'}),
+            content_type='application/json'
+        ).json()
+        self.assertEqual(options['attestation'], 'direct')
+
+        authenticator = VirtualAuthenticator(aaguid=CERTIFIED_AAGUID, attestation_ca=self.ca)
+        response = self._register(authenticator)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_untrusted_chain_is_rejected(self):
+        """Test that a certificate from another CA fails verification."""
+        authenticator = VirtualAuthenticator(
+            aaguid=CERTIFIED_AAGUID, attestation_ca=AttestationCA('Other Root')
+        )
+        response = self._register(authenticator)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_revoked_authenticator_is_rejected(self):
+        """Test that an authenticator reported revoked cannot register."""
+        authenticator = VirtualAuthenticator(aaguid=REVOKED_AAGUID, attestation_ca=self.ca)
+        response = self._register(authenticator)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('REVOKED', response.json()['error'])
+
+    def test_required_attestation(self):
+        """Test that unattested authenticators are refused only when required."""
+        self.assertEqual(self._register(VirtualAuthenticator(), 'optional').status_code,
+                         status.HTTP_200_OK)
+        with self.settings(WEBAUTHN_REQUIRE_ATTESTATION=True):
+            response = self._register(VirtualAuthenticator(aaguid=CERTIFIED_AAGUID), 'required')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_hot_reload(self):
+        """Test that a replaced index file is picked up."""
+        added = '0bb43545-fd2c-4185-87dd-feb0b2916ace'
+        self.assertIsNone(get_metadata_index().get(uuid.UUID(added).bytes))
+        write_index(self._payload({
+            'aaguid': added, 'metadataStatement': {'description': 'New Key'},
+        }), self.path)
+        entry = get_metadata_index().get(uuid.UUID(added).bytes)
+        self.assertEqual(entry.description, 'New Key')
+
+    def test_load_mds_command(self):
+        """Test that a signed blob is checked and compiled."""
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import ec
+        from cryptography.hazmat.primitives.asymmetric.utils import decode_dss_signature
+
+        signing_key, signing_cert = self.ca.issue('MDS Signer')
+        header = base64.urlsafe_b64encode(json.dumps({
+            'alg': 'ES256', 'typ': 'JWT', 'x5c': [base64.b64encode(signing_cert).decode()],
+        }).encode()).rstrip(b'=')
+        payload = base64.urlsafe_b64encode(json.dumps(self._payload()).encode()).rstrip(b'=')
+        r, s = decode_dss_signature(
+            signing_key.sign(header + b'.' + payload, ec.ECDSA(hashes.SHA256()))
+        )
+        signature = base64.urlsafe_b64encode(r.to_bytes(32, 'big') + s.to_bytes(32, 'big')).rstrip(b'=')
+
+        directory = os.path.dirname(self.path)
+        blob_path = os.path.join(directory, 'blob.jwt')
+        root_path = os.path.join(directory, 'root.pem')
+        output = os.path.join(directory, 'loaded.idx')
+        with open(root_path, 'wb') as f:
+            f.write(self.ca.pem)
+        with open(blob_path, 'wb') as f:
+            f.write(header + b'.' + payload + b'.' + signature)
+
+        stdout = io.StringIO()
+        call_command('load_mds', blob_path, output=output, root_cert=root_path, stdout=stdout)
+        self.assertIn('Indexed 2 authenticators', stdout.getvalue())
+
+        with open(root_path, 'wb') as f:
+            f.write(AttestationCA('Other Root').pem)
+        with self.assertRaises(CommandError):
+            call_command('load_mds', blob_path, output=output, root_cert=root_path,
+                         stdout=io.StringIO())
+
+
+@override_settings(ASSERTION_BATCH_TOKEN='service-secret')
+class AssertionBatchTestCase(TestCase):
+    """Test cases for the batch assertion verification endpoint."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.authenticator = VirtualAuthenticator()
+        for username in ('alice', 'bob'):
+            options = self._post(
+                'register/start/', {'username': username, 'email': f'{username}@example.com'}
+            ).json()
+            self._post('register/complete/', {
+                'credential': self.authenticator.create(options),
+                'challenge': options['challenge'],
+            })
+        self.client = Client()
+
+    def _post(self, endpoint, data, **extra):
+        return self.client.post(
+            f'/api/auth/{endpoint}',
+            data=json.dumps(data),
+            content_type='application/json',
+            **extra
+        )
+
+    def _assertion(self, username):
+        options = self._post('login/start/', {'username': username}).json()
+        return {
+            'credential': self.authenticator.get(options),
+            'challenge': options['challenge'],
+        }
+
+    def _verify(self, assertions, token='service-secret'):
+        return self._post(
+            'assertions/verify/', {'assertions': assertions},
+            HTTP_AUTHORIZATION=f'Bearer {token}',
+        )
+
+    def test_batch_is_verified(self):
+        """Test that every assertion gets its own result, in order, with one lookup and one write."""
+        assertions = [self._assertion('alice'), self._assertion('bob')]
+        forged = self._assertion('alice')
+        forged['credential']['response']['signature'] = assertions[1]['credential']['response']['signature']
+        assertions.append(forged)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self._verify(assertions)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json()['results']
+        self.assertEqual([result['ok'] for result in results], [True, True, False])
+        self.assertEqual(results[0]['user']['username'], 'alice')
+        self.assertEqual(results[1]['user']['username'], 'bob')
+        self.assertIn('Verification failed', results[2]['error'])
+        selects = [q for q in queries.captured_queries if q['sql'].startswith('SELECT')]
+        updates = [q for q in queries.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(selects), 1)
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(
+            set(PasskeyCredential.objects.values_list('counter', flat=True)), {1}
+        )
+        # No session is created
+        self.assertNotIn('_auth_user_id', self.client.session)
+
+        # Challenges are single-use
+        results = self._verify(assertions[:1]).json()['results']
+        self.assertEqual(results[0], {'ok': False, 'error': 'Invalid or expired challenge'})
+
+    def test_invalid_items_fail_alone(self):
+        """Test that malformed and foreign items fail without affecting the others."""
+        alice = self._assertion('alice')
+        stolen = self._assertion('bob')
+        stolen['credential'] = alice['credential']
+        results = self._verify([
+            'nonsense', {'challenge': 'AAAA'}, stolen, self._assertion('bob'),
+        ]).json()['results']
+        self.assertEqual([result['ok'] for result in results], [False, False, False, True])
+        self.assertEqual(results[2]['error'], 'Credential not found for this user')
+
+    def test_counter_conflict(self):
+        """Test that an assertion verified against a counter that moved is rejected."""
+        assertion = self._assertion('alice')
+        PasskeyCredential.objects.filter(user__username='alice').update(counter=0)
+
+        def another_login_wins(*args):
+            PasskeyCredential.objects.filter(user__username='alice').update(counter=1)
+            return verify_authentication(*args)
+
+        with mock.patch('auth_app.batch.verify_authentication', side_effect=another_login_wins):
+            results = self._verify([assertion]).json()['results']
+        self.assertFalse(results[0]['ok'])
+        self.assertIn('Sign counter conflict', results[0]['error'])
+
+    def test_counter_advanced_by_a_later_assertion(self):
+        """Test that an unchanged counter followed by an advance stores the advance."""
+        passkey = PasskeyCredential.objects.get(user__username='alice')
+        outcomes = [
+            mock.Mock(new_sign_count=passkey.counter, user_verified=True),
+            mock.Mock(new_sign_count=passkey.counter + 5, user_verified=True),
+        ]
+        with mock.patch('auth_app.batch.verify_authentication', side_effect=outcomes):
+            results = self._verify(
+                [self._assertion('alice'), self._assertion('alice')]
+            ).json()['results']
+        self.assertEqual([result['ok'] for result in results], [True, True])
+        counter = passkey.counter
+        passkey.refresh_from_db()
+        self.assertEqual(passkey.counter, counter + 5)
+
+    def test_requires_service_token(self):
+        """Test that the endpoint refuses requests without the right bearer token."""
+        assertion = self._assertion('alice')
+        self.assertEqual(
+            self._verify([assertion], token='wrong').status_code, status.HTTP_403_FORBIDDEN
+        )
+        self.assertEqual(
+            self._post('assertions/verify/', {'assertions': [assertion]}).status_code,
+            status.HTTP_403_FORBIDDEN,
+        )
+        with override_settings(ASSERTION_BATCH_TOKEN=''):
+            self.assertEqual(
+                self._verify([assertion], token='').status_code, status.HTTP_403_FORBIDDEN
+            )
+
+    @override_settings(ASSERTION_BATCH_MAX_ITEMS=1)
+    def test_batch_size_is_limited(self):
+        """Test that empty and oversized batches are rejected."""
+        self.assertEqual(self._verify([]).status_code, status.HTTP_400_BAD_REQUEST)
+        response = self._verify([self._assertion('alice'), self._assertion('bob')])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+def ed25519_pem():
+    return Ed25519PrivateKey.generate().private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode()
+
+
+TOKEN_KEY_PEM = ed25519_pem()
+
+
+@override_settings(
+    ACCESS_TOKENS=True,
+    ACCESS_TOKEN_ISSUER='auth.example.com',
+    ACCESS_TOKEN_PRIVATE_KEY=TOKEN_KEY_PEM,
+)
+class AccessTokenTestCase(TestCase):
+    """Test cases for the signed access tokens issued at login."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.authenticator = VirtualAuthenticator()
+        options = self._post(
+            'register/start/', {'username': 'testuser', 'email': 'test@example.com'}
+        ).json()
+        self.registration = self._post('register/complete/', {
+            'credential': self.authenticator.create(options),
+            'challenge': options['challenge'],
+        }).json()
+        self.passkey = PasskeyCredential.objects.get()
+
+    def _post(self, endpoint, data=None):
+        return self.client.post(
+            f'/api/auth/{endpoint}',
+            data=json.dumps(data or {}),
+            content_type='application/json'
+        )
+
+    def _verifier(self):
+        response = self.client.get('/api/auth/jwks.json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('max-age=3600', response['Cache-Control'])
+        return TokenVerifier.from_jwks(response.json(), issuer='auth.example.com')
+
+    def test_login_returns_verifiable_token(self):
+        """Test that login returns a token the published key verifies."""
+        self.client = Client()
+        options = self._post('login/start/', {'username': 'testuser'}).json()
+        response = self._post('login/complete/', {
+            'credential': self.authenticator.get(options),
+            'challenge': options['challenge'],
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        body = response.json()
+        self.assertEqual(body['tokenType'], 'Bearer')
+        self.assertEqual(body['expiresIn'], 300)
+
+        claims = self._verifier().verify(body['accessToken'])
+        self.assertEqual(claims['sub'], str(self.passkey.user_id))
+        self.assertEqual(claims['username'], 'testuser')
+        self.assertEqual(claims['cid'], self.passkey.credential_id_b64)
+        self.assertEqual(claims['exp'] - claims['iat'], 300)
+
+    def test_registration_returns_token(self):
+        """Test that registering signs in with a token as well."""
+        claims = self._verifier().verify(self.registration['accessToken'])
+        self.assertEqual(claims['username'], 'testuser')
+
+    def test_refresh_runs_no_user_query(self):
+        """Test that refreshing issues a new token from the session and snapshot alone."""
+        self._post('token/refresh/')
+        with CaptureQueriesContext(connection) as queries:
+            response = self._post('token/refresh/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Cache-Control'], 'no-store')
+        self.assertFalse(any('auth_app_user' in q['sql'] for q in queries.captured_queries))
+        claims = self._verifier().verify(response.json()['accessToken'])
+        self.assertEqual(claims['cid'], self.passkey.credential_id_b64)
+
+    def test_refresh_requires_session(self):
+        """Test that refreshing without a signed-in session is refused."""
+        self.client = Client()
+        response = self._post('token/refresh/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_rejects_bad_tokens(self):
+        """Test that tampered, expired, foreign and unknown-key tokens are rejected."""
+        verifier = self._verifier()
+        token = self.registration['accessToken']
+        header, payload, signature = token.split('.')
+        forged = base64.urlsafe_b64encode(
+            json.dumps({'sub': '1', 'exp': 9999999999}).encode()
+        ).decode().rstrip('=')
+        with self.assertRaises(InvalidToken):
+            verifier.verify(f'{header}.{forged}.{signature}')
+        with self.assertRaises(InvalidToken):
+            verifier.verify('not-a-token')
+        with self.assertRaises(InvalidToken):
+            verifier.verify(token, now=verifier.verify(token)['exp'] + 60)
+        with self.assertRaises(InvalidToken):
+            TokenVerifier(verifier.keys, issuer='other.example.com').verify(token)
+        with override_settings(ACCESS_TOKEN_PRIVATE_KEY=ed25519_pem()):
+            rotated = tokens.issue(1, 'testuser', self.passkey.credential_id_b64)
+        with self.assertRaises(UnknownKey):
+            verifier.verify(rotated)
+
+    def test_signing_key_must_not_be_guessable(self):
+        """Test that a key is derived from SECRET_KEY only in development with a real secret."""
+        with override_settings(ACCESS_TOKEN_PRIVATE_KEY=None, DEBUG=False):
+            self.assertRaises(ImproperlyConfigured, tokens.signing_key)
+        with override_settings(
+            ACCESS_TOKEN_PRIVATE_KEY=None, DEBUG=True, SECRET_KEY='django-insecure-default'
+        ):
+            self.assertRaises(ImproperlyConfigured, tokens.signing_key)
+        with override_settings(
+            ACCESS_TOKEN_PRIVATE_KEY=None, DEBUG=True, SECRET_KEY='a-real-development-secret'
+        ):
+            self.assertIsNotNone(tokens.signing_key())
+
+    @override_settings(ACCESS_TOKENS=False)
+    def test_disabled(self):
+        """Test that no token is issued or published while tokens are off."""
+        self.client = Client()
+        options = self._post('login/start/', {'username': 'testuser'}).json()
+        response = self._post('login/complete/', {
+            'credential': self.authenticator.get(options),
+            'challenge': options['challenge'],
+        })
+        self.assertNotIn('accessToken', response.json())
+        self.assertEqual(
+            self.client.get('/api/auth/jwks.json').status_code, status.HTTP_404_NOT_FOUND
+        )
+        self.assertEqual(
+            self._post('token/refresh/').status_code, status.HTTP_404_NOT_FOUND
+        )
+
+
+@override_settings(
+    ROOT_URLCONF='auth_app.tests', ACCESS_TOKENS=True, ACCESS_TOKEN_PRIVATE_KEY=TOKEN_KEY_PEM
+)
+class AsyncAccessTokenTestCase(TestCase):
+    """Test cases for access tokens from the async views."""
+
+    def setUp(self):
+        cache.clear()
+
+    async def test_login_and_refresh(self):
+        """Test that the async views issue and refresh tokens."""
+        authenticator = VirtualAuthenticator()
+        options = (await self.async_client.post(
+            '/api/auth/register/start/',
+            data={'username': 'testuser', 'email': 'test@example.com'},
+            content_type='application/json'
+        )).json()
+        response = await self.async_client.post(
+            '/api/auth/register/complete/',
+            data={'credential': authenticator.create(options), 'challenge': options['challenge']},
+            content_type='application/json'
+        )
+        verifier = TokenVerifier.from_jwks(tokens.jwks())
+        self.assertEqual(verifier.verify(response.json()['accessToken'])['username'], 'testuser')
+
+        response = await self.async_client.post('/api/auth/token/refresh/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(verifier.verify(response.json()['accessToken'])['username'], 'testuser')
@@ -0,0 +1,106 @@
+"""Offline verification of the access tokens issued at login.
+
+This module depends on nothing but the standard library and
+``cryptography``, so other services can copy it as is.  Load the published
+keys once (``GET /api/auth/jwks.json``) and every token is then checked in
+memory, with no call back to the auth service or its database::
+
+    verifier = TokenVerifier.from_url("https://auth.example.com/api/auth/jwks.json",
+                                      issuer="auth.example.com")
+    claims = verifier.verify(token)  # raises InvalidToken
+    claims["sub"], claims["username"], claims["cid"]
+
+Tokens are compact JWS (JWT) signed with Ed25519 (``"alg": "EdDSA"``).
+Reload the keys when a token names an unknown ``kid``, i.e. after the auth
+service rotated its key.
+"""
+
+import base64
+import binascii
+import json
+import time
+import urllib.request
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PublicKey
+
+
+class InvalidToken(Exception):
+    """The token is malformed, forged, expired or from another issuer."""
+
+
+class UnknownKey(InvalidToken):
+    """The token was signed with a key that is not loaded."""
+
+
+def b64decode(data):
+    """Decode unpadded base64url, as used by JWS and JWK."""
+    if isinstance(data, str):
+        data = data.encode("ascii")
+    return base64.urlsafe_b64decode(data + b"=" * (-len(data) % 4))
+
+
+class TokenVerifier:
+    """Checks access tokens against a set of Ed25519 public keys."""
+
+    def __init__(self, keys, issuer=None, leeway=30):
+        # {kid: Ed25519PublicKey}
+        self.keys = dict(keys)
+        self.issuer = issuer
+        # Seconds of clock skew tolerated between the services
+        self.leeway = leeway
+
+    @classmethod
+    def from_jwks(cls, jwks, **kwargs):
+        """Build a verifier from a JWK Set (a dict, or its JSON text)."""
+        if isinstance(jwks, (str, bytes)):
+            jwks = json.loads(jwks)
+        keys = {
+            key["kid"]: Ed25519PublicKey.from_public_bytes(b64decode(key["x"]))
+            for key in jwks.get("keys", ())
+            if key.get("kty") == "OKP" and key.get("crv") == "Ed25519"
+        }
+        return cls(keys, **kwargs)
+
+    @classmethod
+    def from_url(cls, url, timeout=5, **kwargs):
+        """Fetch the published JWK Set from ``url`` and build a verifier."""
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return cls.from_jwks(response.read(), **kwargs)
+
+    def verify(self, token, now=None):
+        """Return the claims of a valid ``token``; raises :class:`InvalidToken`."""
+        if isinstance(token, str):
+            token = token.encode("ascii", "replace")
+        try:
+            header_b64, payload_b64, signature_b64 = token.split(b".")
+            header = json.loads(b64decode(header_b64))
+            signature = b64decode(signature_b64)
+        except (ValueError, binascii.Error) as e:
+            raise InvalidToken("Malformed token") from e
+        if not isinstance(header, dict) or header.get("alg") != "EdDSA":
+            raise InvalidToken("Unsupported token algorithm")
+
+        kid = header.get("kid")
+        key = self.keys.get(kid) if isinstance(kid, str) else None
+        if key is None:
+            raise UnknownKey(f"Unknown signing key {kid!r}")
+        try:
+            key.verify(signature, header_b64 + b"." + payload_b64)
+        except InvalidSignature as e:
+            raise InvalidToken("Invalid token signature") from e
+
+        try:
+            claims = json.loads(b64decode(payload_b64))
+        except (ValueError, binascii.Error) as e:
+            raise InvalidToken("Malformed token") from e
+        if not isinstance(claims, dict):
+            raise InvalidToken("Malformed token")
+        now = time.time() if now is None else now
+        if not isinstance(claims.get("exp"), (int, float)) or claims["exp"] + self.leeway <= now:
+            raise InvalidToken("Token has expired")
+        if claims.get("iat", 0) - self.leeway > now:
+            raise InvalidToken("Token was issued in the future")
+        if self.issuer is not None and claims.get("iss") != self.issuer:
+            raise InvalidToken("Token is from another issuer")
+        return claims
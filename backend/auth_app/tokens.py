@@ -0,0 +1,133 @@
+"""Short-lived signed access tokens for downstream services.
+
+With ``settings.ACCESS_TOKENS`` enabled, ``register_complete`` and
+``login_complete`` also return an ``accessToken``: a compact JWT signed with
+Ed25519 carrying the user's id (``sub``), ``username`` and the credential ID
+the user signed in with (``cid``), valid for ``settings.ACCESS_TOKEN_TTL``
+seconds.  Services check it locally with :mod:`auth_app.token_verifier` and
+the public key published by :func:`jwks`, so authenticating an API request
+costs them no call to this service and no database query.
+
+``token_refresh`` issues a new token for the signed-in session.  It is
+authenticated from the cached user snapshot (see :mod:`auth_app.snapshots`),
+so with a cache-backed ``SESSION_MODE`` it runs no query either.  Tokens are
+not revocable: they stay valid until they expire, also after a logout.
+
+The signing key is ``settings.ACCESS_TOKEN_PRIVATE_KEY`` (a PEM Ed25519
+private key).  Only under ``DEBUG``, and only with a ``SECRET_KEY`` other
+than the insecure default, may it be left unset; a key is then derived from
+``SECRET_KEY``.  Anything else raises ``ImproperlyConfigured`` at startup.
+"""
+
+import base64
+import functools
+import hashlib
+import time
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.crypto import salted_hmac
+
+from .renderers import dumps
+
+# Session key holding the base64url credential ID for refreshed tokens
+CREDENTIAL_SESSION_KEY = "credential_id"
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+class _SigningKey:
+    """An Ed25519 private key with its key id and encoded JWS header."""
+
+    def __init__(self, private_key):
+        self.private_key = private_key
+        self.public_bytes = private_key.public_key().public_bytes(
+            serialization.Encoding.Raw, serialization.PublicFormat.Raw
+        )
+        self.kid = _b64encode(hashlib.sha256(self.public_bytes).digest()[:12]).decode()
+        self.header = _b64encode(dumps({"alg": "EdDSA", "typ": "JWT", "kid": self.kid}))
+
+
+@functools.lru_cache(maxsize=1)
+def _load_key(private_key_pem, secret_key, debug):
+    if private_key_pem:
+        private_key = serialization.load_pem_private_key(
+            private_key_pem.encode(), password=None
+        )
+        if not isinstance(private_key, Ed25519PrivateKey):
+            raise ImproperlyConfigured("ACCESS_TOKEN_PRIVATE_KEY must be an Ed25519 key")
+    else:
+        # Anyone could sign tokens with a key derived from a public secret
+        if not debug:
+            raise ImproperlyConfigured(
+                "Set ACCESS_TOKEN_PRIVATE_KEY to issue access tokens with DEBUG off"
+            )
+        if secret_key.startswith("django-insecure-"):
+            raise ImproperlyConfigured(
+                "ACCESS_TOKENS needs ACCESS_TOKEN_PRIVATE_KEY or a real SECRET_KEY"
+            )
+        seed = salted_hmac(
+            "auth_app.tokens", "signing-key", secret=secret_key, algorithm="sha256"
+        ).digest()
+        private_key = Ed25519PrivateKey.from_private_bytes(seed)
+    return _SigningKey(private_key)
+
+
+def signing_key():
+    """Return the current :class:`_SigningKey`, loaded once per setting value."""
+    return _load_key(settings.ACCESS_TOKEN_PRIVATE_KEY, settings.SECRET_KEY, settings.DEBUG)
+
+
+def issue(user_id, username, credential_id_b64):
+    """Return a signed access token for a user and the credential they used."""
+    key = signing_key()
+    now = int(time.time())
+    payload = _b64encode(dumps({
+        "iss": settings.ACCESS_TOKEN_ISSUER,
+        "sub": str(user_id),
+        "username": username,
+        "cid": credential_id_b64,
+        "iat": now,
+        "exp": now + settings.ACCESS_TOKEN_TTL,
+    }))
+    signed = key.header + b"." + payload
+    return (signed + b"." + _b64encode(key.private_key.sign(signed))).decode()
+
+
+def token_fields(user_id, username, credential_id_b64):
+    return {
+        "accessToken": issue(user_id, username, credential_id_b64),
+        "tokenType": "Bearer",
+        "expiresIn": settings.ACCESS_TOKEN_TTL,
+    }
+
+
+def login_token(request, user, passkey):
+    """Response fields with an access token for a login, if tokens are enabled.
+
+    Also remembers the credential in the session for ``token_refresh``.
+    """
+    if not settings.ACCESS_TOKENS:
+        return {}
+    credential_id = passkey.credential_id_b64
+    request.session[CREDENTIAL_SESSION_KEY] = credential_id
+    return token_fields(user.pk, user.username, credential_id)
+
+
+def jwks():
+    """The JWK Set publishing the token verification key."""
+    key = signing_key()
+    return {
+        "keys": [{
+            "kty": "OKP",
+            "crv": "Ed25519",
+            "x": _b64encode(key.public_bytes).decode(),
+            "kid": key.kid,
+            "alg": "EdDSA",
+            "use": "sig",
+        }]
+    }
@@ -1,12 +1,32 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+
+def ceremony_urlpatterns(ceremony_views):
+    return [
+        path("auth/register/start/", ceremony_views.register_start, name="register_start"),
+        path("auth/register/complete/", ceremony_views.register_complete, name="register_complete"),
+        path("auth/login/start/", ceremony_views.login_start, name="login_start"),
+        path("auth/login/complete/", ceremony_views.login_complete, name="login_complete"),
+        path("auth/user/", ceremony_views.user_info, name="user_info"),
+        path("auth/token/refresh/", ceremony_views.token_refresh, name="token_refresh"),
+    ]
+
 
 urlpatterns = [
     path("auth/csrf-token/", views.csrf_token, name="csrf_token"),
-    path("auth/register/start/", views.register_start, name="register_start"),
-    path("auth/register/complete/", views.register_complete, name="register_complete"),
-    path("auth/login/start/", views.login_start, name="login_start"),
-    path("auth/login/complete/", views.login_complete, name="login_complete"),
-    path("auth/user/", views.user_info, name="user_info"),
+    *ceremony_urlpatterns(async_views if settings.ASYNC_VIEWS else views),
     path("auth/logout/", views.logout, name="logout"),
+    path("auth/jwks.json", views.jwks, name="jwks"),
+    path(
+        "auth/assertions/verify/", views.verify_assertions, name="verify_assertions"
+    ),
+    path("auth/passkeys/", views.passkey_list, name="passkey_list"),
+    path(
+        "auth/passkeys/revoke-others/",
+        views.revoke_other_passkeys,
+        name="revoke_other_passkeys",
+    ),
+    path("auth/passkeys/<int:pk>/", views.passkey_detail, name="passkey_detail"),
 ]
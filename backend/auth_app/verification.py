@@ -0,0 +1,265 @@
+"""Bounded executor for WebAuthn signature and attestation verification.
+
+COSE parsing, CBOR decoding and signature checks are pure CPU work that holds
+the GIL.  With ``settings.VERIFICATION_EXECUTOR = "process"`` they run in a
+process pool sized to the machine, so verification scales across cores
+instead of queueing behind one interpreter.  ``"inline"`` runs them on the
+calling thread, which is what tests and the dev server use.
+
+The number of verifications in flight is capped: once
+``VERIFICATION_MAX_PENDING`` are queued (by default four per pool process;
+inline verification is only bounded by the server's threads), further
+requests are rejected with :class:`VerifierBusy` so the views can answer 503
+instead of piling up.  A verification that times out keeps its slot until it
+really finishes, since a running call cannot be cancelled.
+"""
+
+import asyncio
+import atexit
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+
+class VerifierBusy(Exception):
+    """Raised when the verification queue is full or a verification timed out."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class VerificationSlot:
+    """Queue slots taken with :meth:`VerificationExecutor.reserve`.
+
+    Used as a context manager the slots are released on exit, unless a
+    timed out verification still holds them (see :meth:`hold_until`).
+    Releasing twice is harmless.
+    """
+
+    def __init__(self, executor, count):
+        self.executor = executor
+        self.count = count
+        self.started = time.perf_counter()
+        self.held = False
+        self.released = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if not self.held:
+            self.release()
+
+    def release(self):
+        self.executor._release(self)
+
+    def hold_until(self, *futures):
+        """Keep the slots until all ``futures`` are done.
+
+        A running verification cannot be cancelled, so after a timeout its
+        slots stay taken until it actually finishes.
+        """
+        self.held = True
+        remaining = [len(futures)]
+
+        def done(future):
+            with self.executor._lock:
+                remaining[0] -= 1
+                last = not remaining[0]
+            if last:
+                self.release()
+
+        for future in futures:
+            future.add_done_callback(done)
+
+
+class VerificationExecutor:
+    """Run verification callables with a bounded queue, a timeout and metrics."""
+
+    def __init__(self, workers=0, max_pending=None, timeout=5.0, retry_after=1):
+        self.workers = workers
+        # Inline verification is bounded by the server's own threads
+        self.max_pending = max_pending or (workers * 4 if workers else None)
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._pool = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    @property
+    def saturated(self):
+        return self.max_pending is not None and self.pending >= self.max_pending
+
+    def reserve(self, count=1):
+        """Take ``count`` queue slots (at most the whole queue) or raise
+        :class:`VerifierBusy`.
+
+        Views reserve before consuming the challenge, so a busy answer leaves
+        the ceremony intact for the client to retry.
+        """
+        if self.max_pending is not None:
+            count = min(count, self.max_pending)
+        with self._lock:
+            if self.max_pending is not None and self.pending + count > self.max_pending:
+                self.rejected += 1
+                raise VerifierBusy("Verification queue is full", self.retry_after)
+            self.pending += count
+        return VerificationSlot(self, count)
+
+    def run(self, func, *args, slot=None):
+        """Call ``func(*args)`` on the executor and wait for its result.
+
+        Uses (and releases) ``slot`` if given, otherwise reserves one.
+        """
+        with self._start(slot) as slot:
+            if not self.workers:
+                return func(*args)
+            future = self._get_pool().submit(func, *args)
+            try:
+                return future.result(timeout=self.timeout)
+            except TimeoutError:
+                future.cancel()
+                slot.hold_until(future)
+                self._timed_out()
+
+    def run_many(self, func, calls, slot=None):
+        """Call ``func(*args)`` for every ``args`` in ``calls``, side by side.
+
+        Returns one entry per call: its result, or the exception it raised.
+        The batch takes one queue slot per call (at most the whole queue) and
+        must finish within one timeout.
+        """
+        with self._start(slot, len(calls)) as slot:
+            if not self.workers:
+                return [_outcome(func, args) for args in calls]
+            pool = self._get_pool()
+            futures = [pool.submit(func, *args) for args in calls]
+            deadline = time.monotonic() + self.timeout
+            results = []
+            for future in futures:
+                try:
+                    results.append(
+                        future.result(timeout=max(deadline - time.monotonic(), 0))
+                    )
+                except TimeoutError:
+                    for pending in futures:
+                        pending.cancel()
+                    slot.hold_until(*futures)
+                    self._timed_out()
+                except Exception as e:
+                    results.append(e)
+            return results
+
+    async def arun(self, func, *args, slot=None):
+        """Async variant of :meth:`run` that never blocks the event loop."""
+        with self._start(slot) as slot:
+            if not self.workers:
+                # A thread cannot be stopped: shield it from the timeout so
+                # the task tracks the call until it really returns
+                work = asyncio.ensure_future(
+                    sync_to_async(func, thread_sensitive=False)(*args)
+                )
+                call = asyncio.shield(work)
+            else:
+                work = self._get_pool().submit(func, *args)
+                call = asyncio.wrap_future(work)
+            try:
+                return await asyncio.wait_for(call, timeout=self.timeout)
+            except asyncio.TimeoutError:
+                slot.hold_until(work)
+                self._timed_out()
+
+    def stats(self):
+        with self._lock:
+            completed = self.completed
+            return {
+                "workers": self.workers,
+                "pending": self.pending,
+                "max_pending": self.max_pending,
+                "completed": completed,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "latency_avg_ms": (
+                    self.latency_total / completed * 1000 if completed else 0.0
+                ),
+                "latency_max_ms": self.latency_max * 1000,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _start(self, slot, count=1):
+        if slot is None:
+            slot = self.reserve(count)
+        # Latency covers the verification, not the time since reserve()
+        slot.started = time.perf_counter()
+        return slot
+
+    def _release(self, slot):
+        elapsed = time.perf_counter() - slot.started
+        with self._lock:
+            if slot.released:
+                return
+            slot.released = True
+            self.pending -= slot.count
+            self.completed += slot.count
+            self.latency_total += elapsed * slot.count
+            self.latency_max = max(self.latency_max, elapsed)
+
+    def _timed_out(self):
+        with self._lock:
+            self.timeouts += 1
+        raise VerifierBusy("Verification timed out", self.retry_after)
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # Spawned workers do not inherit the server's threads or locks.
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._pool
+
+
+def _outcome(func, args):
+    try:
+        return func(*args)
+    except Exception as e:
+        return e
+
+
+_verifier = None
+_verifier_lock = threading.Lock()
+
+
+def get_verifier():
+    """Return the process-wide executor configured from settings."""
+    global _verifier
+    if _verifier is None:
+        with _verifier_lock:
+            if _verifier is None:
+                workers = 0
+                if settings.VERIFICATION_EXECUTOR == "process":
+                    workers = settings.VERIFICATION_WORKERS or os.cpu_count() or 1
+                _verifier = VerificationExecutor(
+                    workers=workers,
+                    max_pending=settings.VERIFICATION_MAX_PENDING,
+                    timeout=settings.VERIFICATION_TIMEOUT,
+                )
+                atexit.register(_verifier.shutdown)
+    return _verifier
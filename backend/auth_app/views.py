@@ -1,32 +1,56 @@
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
-from django.contrib.auth import get_user_model, login
 from django.conf import settings
-from webauthn import (
-    generate_registration_options,
-    verify_registration_response,
-    generate_authentication_options,
-    verify_authentication_response,
+from django.contrib.auth import get_user_model, login
+from django.db.models import Q
+from webauthn.helpers import base64url_to_bytes
+
+from . import batch, reservations, tokens
+from .ceremonies import (
+    PASSKEY_SESSION_KEY,
+    authentication_options,
+    decode_credential_id,
+    decode_user_handle,
+    registration_options,
+    user_payload,
+    verify_authentication,
+    verify_registration,
 )
-from webauthn.helpers import (
-    bytes_to_base64url,
-    base64url_to_bytes,
-    parse_registration_credential_json,
-    parse_authentication_credential_json,
+from .challenges import (
+    AUTHENTICATION,
+    REGISTRATION,
+    PendingCeremony,
+    begin_ceremony,
+    finish_ceremony,
 )
-from webauthn.helpers.structs import (
-    UserVerificationRequirement,
+from .db import run_with_retry
+from .descriptors import login_descriptors
+from .instrumentation import (
+    BUSY,
+    INVALID_CHALLENGE,
+    VERIFICATION_FAILED,
+    phase,
+    set_outcome,
 )
-import secrets
-
 from .models import PasskeyCredential
+from .pagination import KeysetPagination
+from .serializers import PasskeyCredentialSerializer
+from .snapshots import SnapshotSessionAuthentication, add_validators, conditional_response
+from .verification import VerifierBusy, get_verifier
+from .writebehind import advance_counter, current_counter
 
 User = get_user_model()
 
-# In-memory storage for challenges (use Redis or database in production)
-challenge_store = {}
+
+def _busy_response(retry_after, message="Verification queue is full"):
+    set_outcome(BUSY)
+    return Response(
+        {"error": message},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": str(retry_after)},
+    )
 
 
 @api_view(["POST"])
@@ -42,68 +66,35 @@ def register_start(request):
             status=status.HTTP_400_BAD_REQUEST,
         )
 
-    # Check if user already exists
-    if User.objects.filter(username=username).exists():
-        return Response(
-            {"error": "Username already exists"}, status=status.HTTP_400_BAD_REQUEST
+    # Check if user already exists (one query for both unique fields)
+    with phase("lookup"):
+        taken = list(
+            User.objects.filter(Q(username=username) | Q(email=email)).values_list(
+                "username", flat=True
+            )[:2]
         )
-
-    if User.objects.filter(email=email).exists():
+    if taken:
+        field = "Username" if username in taken else "Email"
         return Response(
-            {"error": "Email already exists"}, status=status.HTTP_400_BAD_REQUEST
+            {"error": f"{field} already exists"}, status=status.HTTP_400_BAD_REQUEST
         )
 
-    # Create user (but don't save yet - will save after passkey verification)
-    user_id = secrets.token_bytes(16)
+    with phase("options"):
+        challenge, user_id, options_dict = registration_options(username)
 
-    # Generate registration options
-    options = generate_registration_options(
-        rp_id=settings.RP_ID,
-        rp_name=settings.RP_NAME,
-        user_id=user_id,
-        user_name=username,
-        user_display_name=username,
-    )
+    # Hold the username and email until the challenge expires
+    with phase("reserve"):
+        conflict = reservations.reserve(username, email, challenge)
+    if conflict:
+        return Response(
+            {"error": f"{conflict.capitalize()} is already being registered"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
 
     # Store challenge and user data
-    challenge = options.challenge
-    challenge_store[challenge] = {
-        "username": username,
-        "email": email,
-        "user_id": user_id,
-    }
-
-    # Convert options to dict for JSON response
-    options_dict = {
-        "challenge": bytes_to_base64url(options.challenge),
-        "rp": {
-            "id": options.rp.id,
-            "name": options.rp.name,
-        },
-        "user": {
-            "id": bytes_to_base64url(options.user.id),
-            "name": options.user.name,
-            "displayName": options.user.display_name,
-        },
-        "pubKeyCredParams": [
-            {"alg": alg.alg.value, "type": alg.type}
-            for alg in options.pub_key_cred_params
-        ],
-        "authenticatorSelection": {
-            "authenticatorAttachment": options.authenticator_selection.authenticator_attachment.value
-            if options.authenticator_selection
-            and options.authenticator_selection.authenticator_attachment
-            else None,
-            "userVerification": options.authenticator_selection.user_verification.value
-            if options.authenticator_selection
-            else UserVerificationRequirement.PREFERRED.value,
-            "requireResidentKey": options.authenticator_selection.require_resident_key
-            if options.authenticator_selection
-            else False,
-        },
-        "timeout": options.timeout,
-        "attestation": options.attestation.value,
-    }
+    ceremony = PendingCeremony(username=username, email=email, user_id=user_id)
+    with phase("challenge"):
+        options_dict.update(begin_ceremony(REGISTRATION, challenge, ceremony))
 
     return Response(options_dict)
 
@@ -121,66 +112,94 @@ def register_complete(request):
             status=status.HTTP_400_BAD_REQUEST,
         )
 
-    # Retrieve stored challenge data
+    # Take a verification slot before the challenge is consumed, so a busy
+    # answer leaves the ceremony intact for the client to retry
+    verifier = get_verifier()
     try:
-        challenge = base64url_to_bytes(challenge_b64)
-        stored_data = challenge_store.pop(challenge, None)
+        slot = verifier.reserve()
+    except VerifierBusy as e:
+        return _busy_response(e.retry_after, str(e))
 
-        if not stored_data:
+    with slot:
+        # Retrieve stored challenge data
+        try:
+            challenge = base64url_to_bytes(challenge_b64)
+            with phase("challenge"):
+                stored_data = finish_ceremony(
+                    REGISTRATION, challenge, request.data.get("challengeToken")
+                )
+
+            if not stored_data:
+                set_outcome(INVALID_CHALLENGE)
+                return Response(
+                    {"error": "Invalid or expired challenge"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+        except Exception:
+            set_outcome(INVALID_CHALLENGE)
             return Response(
-                {"error": "Invalid or expired challenge"},
-                status=status.HTTP_400_BAD_REQUEST,
+                {"error": "Invalid challenge format"}, status=status.HTTP_400_BAD_REQUEST
             )
-    except Exception:
-        return Response(
-            {"error": "Invalid challenge format"}, status=status.HTTP_400_BAD_REQUEST
-        )
 
-    try:
-        # Parse credential using the new webauthn 2.x API
-        credential = parse_registration_credential_json(credential_json)
-
-        # Verify registration
-        verification = verify_registration_response(
-            credential=credential,
-            expected_challenge=challenge,
-            expected_rp_id=settings.RP_ID,
-            expected_origin="http://localhost:3000",
-        )
+        # Another signup took the username or email; fail before verifying
+        with phase("reserve"):
+            held = reservations.holds(stored_data.username, stored_data.email, challenge)
+        if not held:
+            return Response(
+                {"error": "Username or email is held by another registration"},
+                status=status.HTTP_409_CONFLICT,
+            )
 
-        # Create user
-        user = User.objects.create_user(
-            username=stored_data["username"],
-            email=stored_data["email"],
-        )
+        try:
+            with phase("verification"):
+                verification = verifier.run(
+                    verify_registration, credential_json, challenge, slot=slot
+                )
 
-        # Store passkey credential
-        PasskeyCredential.objects.create(
-            user=user,
-            credential_id=bytes_to_base64url(verification.credential_id),
-            public_key=bytes_to_base64url(verification.credential_public_key),
-            counter=verification.sign_count,
-        )
+            def create_and_login():
+                with phase("create"):
+                    # Create user
+                    user = User.objects.create_user(
+                        username=stored_data.username,
+                        email=stored_data.email,
+                        user_handle=stored_data.user_id,
+                    )
 
-        # Log user in
-        login(request, user)
+                    # Store passkey credential
+                    passkey = PasskeyCredential.objects.create(
+                        user=user,
+                        credential_id=verification.credential_id,
+                        public_key=verification.credential_public_key,
+                        counter=verification.sign_count,
+                    )
 
-        return Response(
-            {
-                "message": "Registration successful",
-                "user": {
-                    "id": user.id,
-                    "username": user.username,
-                    "email": user.email,
-                },
-            }
-        )
+                # Log user in
+                with phase("login"):
+                    login(request, user)
+                    request.session[PASSKEY_SESSION_KEY] = passkey.pk
+                return user, passkey
 
-    except Exception as e:
-        return Response(
-            {"error": f"Verification failed: {str(e)}"},
-            status=status.HTTP_400_BAD_REQUEST,
-        )
+            # One transaction, retried if it loses a write-lock race
+            user, passkey = run_with_retry(create_and_login)
+
+            return Response(
+                {
+                    "message": "Registration successful",
+                    "user": user_payload(user),
+                    **tokens.login_token(request, user, passkey),
+                }
+            )
+
+        except VerifierBusy as e:
+            return _busy_response(e.retry_after, str(e))
+        except Exception as e:
+            set_outcome(VERIFICATION_FAILED)
+            return Response(
+                {"error": f"Verification failed: {str(e)}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        finally:
+            reservations.release(stored_data.username, stored_data.email, challenge)
 
 
 @api_view(["POST"])
@@ -189,60 +208,42 @@ def login_start(request):
     """Start passkey authentication process."""
     username = request.data.get("username")
 
+    if not username and settings.WEBAUTHN_DISCOVERABLE_LOGIN:
+        # Username-less login: the authenticator picks a discoverable
+        # credential and reports its user handle, so no lookup is needed here
+        with phase("options"):
+            challenge, options_dict = authentication_options([])
+        with phase("challenge"):
+            options_dict.update(
+                begin_ceremony(AUTHENTICATION, challenge, PendingCeremony())
+            )
+        return Response(options_dict)
+
     if not username:
         return Response(
             {"error": "Username is required"}, status=status.HTTP_400_BAD_REQUEST
         )
 
-    try:
-        user = User.objects.get(username=username)
-    except User.DoesNotExist:
+    # Get the user's passkeys (cached; at most one query)
+    with phase("descriptors"):
+        descriptors = login_descriptors(username)
+    if descriptors is None:
         return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
 
-    # Get user's passkeys
-    passkeys = PasskeyCredential.objects.filter(user=user)
-    if not passkeys.exists():
+    user_id, credential_ids = descriptors
+    if not credential_ids:
         return Response(
             {"error": "No passkeys registered for this user"},
             status=status.HTTP_400_BAD_REQUEST,
         )
 
-    # Prepare allowed credentials
-    allowed_credentials = [
-        {
-            "id": passkey.credential_id,
-            "type": "public-key",
-        }
-        for passkey in passkeys
-    ]
-
-    # Generate authentication options
-    options = generate_authentication_options(
-        rp_id=settings.RP_ID,
-        allow_credentials=[
-            {
-                "id": base64url_to_bytes(passkey.credential_id),
-                "type": "public-key",
-            }
-            for passkey in passkeys
-        ],
-        user_verification=UserVerificationRequirement.PREFERRED,
-    )
+    with phase("options"):
+        challenge, options_dict = authentication_options(credential_ids)
 
     # Store challenge with user ID
-    challenge = options.challenge
-    challenge_store[challenge] = {
-        "user_id": user.id,
-        "username": user.username,
-    }
-
-    options_dict = {
-        "challenge": bytes_to_base64url(options.challenge),
-        "allowCredentials": allowed_credentials,
-        "timeout": options.timeout,
-        "userVerification": options.user_verification.value,
-        "rpId": options.rp_id,
-    }
+    ceremony = PendingCeremony(username=username, user_id=user_id)
+    with phase("challenge"):
+        options_dict.update(begin_ceremony(AUTHENTICATION, challenge, ceremony))
 
     return Response(options_dict)
 
@@ -260,104 +261,259 @@ def login_complete(request):
             status=status.HTTP_400_BAD_REQUEST,
         )
 
+    # Take a verification slot before the challenge is consumed, so a busy
+    # answer leaves the ceremony intact for the client to retry
+    verifier = get_verifier()
     try:
-        challenge = base64url_to_bytes(challenge_b64)
-        stored_data = challenge_store.pop(challenge, None)
+        slot = verifier.reserve()
+    except VerifierBusy as e:
+        return _busy_response(e.retry_after, str(e))
 
-        if not stored_data:
-            return Response(
-                {"error": "Invalid or expired challenge"},
-                status=status.HTTP_400_BAD_REQUEST,
-            )
+    with slot:
+        try:
+            challenge = base64url_to_bytes(challenge_b64)
+            with phase("challenge"):
+                stored_data = finish_ceremony(
+                    AUTHENTICATION, challenge, request.data.get("challengeToken")
+                )
 
-        user = User.objects.get(id=stored_data["user_id"])
+            if not stored_data:
+                set_outcome(INVALID_CHALLENGE)
+                return Response(
+                    {"error": "Invalid or expired challenge"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
 
-        # Get credential ID from request (prefer rawId, fallback to id)
-        credential_id = credential_json.get("rawId") or credential_json.get("id")
-        if not credential_id:
-            return Response(
-                {"error": "Credential ID not found"}, status=status.HTTP_400_BAD_REQUEST
-            )
+            credential_id = decode_credential_id(credential_json)
+            if not credential_id:
+                return Response(
+                    {"error": "Credential ID not found"}, status=status.HTTP_400_BAD_REQUEST
+                )
 
-        try:
-            passkey = PasskeyCredential.objects.get(
-                user=user, credential_id=credential_id
-            )
-        except PasskeyCredential.DoesNotExist:
-            # Try the other field if first lookup failed
-            alternative_id = (
-                credential_json.get("id")
-                if credential_id == credential_json.get("rawId")
-                else credential_json.get("rawId")
-            )
-            if alternative_id and alternative_id != credential_id:
-                try:
-                    passkey = PasskeyCredential.objects.get(
-                        user=user, credential_id=alternative_id
-                    )
-                    credential_id = alternative_id
-                except PasskeyCredential.DoesNotExist:
+            # Scope the lookup to the user who started the login or, for a
+            # username-less login, to the user handle the authenticator returned
+            if stored_data.user_id is not None:
+                owner = {"user_id": stored_data.user_id}
+            else:
+                user_handle = decode_user_handle(credential_json)
+                if not user_handle:
                     return Response(
-                        {"error": "Credential not found for this user"},
-                        status=status.HTTP_404_NOT_FOUND,
+                        {"error": "User handle not found"},
+                        status=status.HTTP_400_BAD_REQUEST,
                     )
-            else:
+                owner = {"user__user_handle": user_handle}
+
+            # One indexed probe fetches the credential and its user together
+            try:
+                with phase("lookup"):
+                    passkey = (
+                        PasskeyCredential.objects.select_related("user")
+                        .for_credential_id(credential_id)
+                        .get(**owner)
+                    )
+            except PasskeyCredential.DoesNotExist:
                 return Response(
                     {"error": "Credential not found for this user"},
                     status=status.HTTP_404_NOT_FOUND,
                 )
+            user = passkey.user
+            # Include a counter change that is still buffered (LOGIN_WRITE_BEHIND)
+            passkey.counter = current_counter(passkey)
+
+            with phase("verification"):
+                verification = verifier.run(
+                    verify_authentication,
+                    credential_json,
+                    challenge,
+                    bytes(passkey.public_key),
+                    passkey.counter,
+                    slot=slot,
+                )
 
-        # Parse credential using the new webauthn 2.x API
-        credential = parse_authentication_credential_json(credential_json)
-
-        # Verify authentication
-        verification = verify_authentication_response(
-            credential=credential,
-            expected_challenge=challenge,
-            expected_rp_id=settings.RP_ID,
-            expected_origin="http://localhost:3000",
-            credential_public_key=base64url_to_bytes(passkey.public_key),
-            credential_current_sign_count=passkey.counter,
-        )
+            verified_counter = passkey.counter
+
+            def advance_and_login():
+                # A retry starts again from the counter that was verified
+                passkey.counter = verified_counter
+                # Update counter
+                with phase("counter"):
+                    if not advance_counter(passkey, verification.new_sign_count):
+                        return False
+
+                # Log user in
+                with phase("login"):
+                    login(request, user)
+                    request.session[PASSKEY_SESSION_KEY] = passkey.pk
+                return True
+
+            # One transaction, retried if it loses a write-lock race
+            if not run_with_retry(advance_and_login):
+                return Response(
+                    {"error": "Sign counter conflict: the credential may be cloned"},
+                    status=status.HTTP_409_CONFLICT,
+                )
 
-        # Update counter
-        passkey.counter = verification.new_sign_count
-        passkey.save()
+            return Response(
+                {
+                    "message": "Login successful",
+                    "user": user_payload(user),
+                    **tokens.login_token(request, user, passkey),
+                }
+            )
+
+        except VerifierBusy as e:
+            return _busy_response(e.retry_after, str(e))
+        except Exception as e:
+            set_outcome(VERIFICATION_FAILED)
+            return Response(
+                {"error": f"Verification failed: {str(e)}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
 
-        # Log user in
-        login(request, user)
 
+@api_view(["GET"])
+@authentication_classes([SnapshotSessionAuthentication])
+@permission_classes([IsAuthenticated])
+def user_info(request):
+    """Get current authenticated user info."""
+    # request.user is a cached UserSnapshot; revalidations cost no query
+    snapshot = request.user
+    response = conditional_response(request, snapshot)
+    if response is None:
+        response = add_validators(Response(snapshot.payload), snapshot)
+    return response
+
+
+@api_view(["POST"])
+@authentication_classes([SnapshotSessionAuthentication])
+@permission_classes([IsAuthenticated])
+def token_refresh(request):
+    """Issue a new access token for the signed-in session."""
+    if not settings.ACCESS_TOKENS:
+        return Response(
+            {"error": "Access tokens are disabled"}, status=status.HTTP_404_NOT_FOUND
+        )
+    # request.user is a cached UserSnapshot, as in user_info
+    credential_id = request.session.get(tokens.CREDENTIAL_SESSION_KEY)
+    if credential_id is None:
         return Response(
-            {
-                "message": "Login successful",
-                "user": {
-                    "id": user.id,
-                    "username": user.username,
-                    "email": user.email,
-                },
-            }
+            {"error": "Sign in with a passkey again to get an access token"},
+            status=status.HTTP_409_CONFLICT,
         )
+    return Response(
+        tokens.token_fields(request.user.pk, request.user.username, credential_id),
+        headers={"Cache-Control": "no-store"},
+    )
 
-    except User.DoesNotExist:
-        return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
-    except Exception as e:
+
+@api_view(["GET"])
+@permission_classes([AllowAny])
+def jwks(request):
+    """Publish the key that verifies access tokens."""
+    if not settings.ACCESS_TOKENS:
+        return Response(
+            {"error": "Access tokens are disabled"}, status=status.HTTP_404_NOT_FOUND
+        )
+    return Response(tokens.jwks(), headers={"Cache-Control": "public, max-age=3600"})
+
+
+@api_view(["POST"])
+@authentication_classes([])
+@permission_classes([batch.ServiceTokenPermission])
+def verify_assertions(request):
+    """Verify a batch of login assertions for a trusted service, without logging in."""
+    items = request.data.get("assertions")
+    if not isinstance(items, list) or not items:
         return Response(
-            {"error": f"Verification failed: {str(e)}"},
+            {"error": "A list of assertions is required"},
             status=status.HTTP_400_BAD_REQUEST,
         )
+    if len(items) > settings.ASSERTION_BATCH_MAX_ITEMS:
+        return Response(
+            {"error": f"At most {settings.ASSERTION_BATCH_MAX_ITEMS} assertions per request"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    # Reserve before any challenge is consumed, as the complete endpoints do
+    verifier = get_verifier()
+    try:
+        slot = verifier.reserve(len(items))
+        with slot:
+            results = batch.verify_assertions(items, verifier, slot)
+    except VerifierBusy as e:
+        return _busy_response(e.retry_after, str(e))
+    return Response({"results": results})
+
+
+# Columns shown by the passkey management endpoints; never the public key
+PASSKEY_LIST_FIELDS = ("id", "credential_id", "name", "created_at")
+
+
+def _passkey_context(request):
+    return {"current_passkey_id": request.session.get(PASSKEY_SESSION_KEY)}
 
 
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
-def user_info(request):
-    """Get current authenticated user info."""
-    return Response(
-        {
-            "id": request.user.id,
-            "username": request.user.username,
-            "email": request.user.email,
-        }
+def passkey_list(request):
+    """List the user's passkeys, newest first, a keyset page at a time."""
+    paginator = KeysetPagination()
+    page = paginator.paginate_queryset(
+        PasskeyCredential.objects.filter(user=request.user).only(*PASSKEY_LIST_FIELDS),
+        request,
+    )
+    serializer = PasskeyCredentialSerializer(
+        page, many=True, context=_passkey_context(request)
+    )
+    return paginator.get_paginated_response(serializer.data)
+
+
+@api_view(["PATCH", "DELETE"])
+@permission_classes([IsAuthenticated])
+def passkey_detail(request, pk):
+    """Rename or delete one of the user's passkeys."""
+    passkeys = PasskeyCredential.objects.filter(pk=pk, user=request.user)
+
+    if request.method == "DELETE":
+        if not passkeys.delete_with_owner():
+            return Response(
+                {"error": "Passkey not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    passkey = passkeys.only(*PASSKEY_LIST_FIELDS).first()
+    if passkey is None:
+        return Response({"error": "Passkey not found"}, status=status.HTTP_404_NOT_FOUND)
+    serializer = PasskeyCredentialSerializer(
+        passkey,
+        data=request.data,
+        partial=True,
+        context=_passkey_context(request),
+    )
+    serializer.is_valid(raise_exception=True)
+    # Only the label can change: write that column alone, without the save
+    # signals that drop the cached key and descriptors
+    passkey.name = serializer.validated_data.get("name", passkey.name)
+    passkeys.update(name=passkey.name)
+    return Response(serializer.data)
+
+
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def revoke_other_passkeys(request):
+    """Delete every passkey of the user except the one this session used."""
+    current = request.session.get(PASSKEY_SESSION_KEY)
+    if current is None:
+        return Response(
+            {"error": "Sign in with a passkey again to revoke the others"},
+            status=status.HTTP_409_CONFLICT,
+        )
+    revoked = (
+        PasskeyCredential.objects.filter(user=request.user)
+        .exclude(pk=current)
+        .delete_with_owner()
     )
+    return Response({"revoked": revoked})
 
 
 @api_view(["GET"])
@@ -0,0 +1,221 @@
+"""Write-behind buffering of the per-login sign counter and ``last_login`` writes.
+
+Without it a login writes the passkey row (new sign counter) and, through
+Django's ``update_last_login`` receiver, the user row.  With
+``settings.LOGIN_WRITE_BEHIND`` enabled both changes are kept in
+:data:`login_writes` instead, and a background thread writes them with one
+``bulk_update`` per model every ``settings.WRITE_BEHIND_FLUSH_INTERVAL``
+seconds, or sooner once ``settings.WRITE_BEHIND_MAX_PENDING`` changes are
+waiting.  With an interval of 0 no thread runs and the login that fills
+the buffer to that size flushes it once its transaction commits.  The
+buffer is flushed once more when the process exits.
+
+Counters that did not change (platform authenticators mostly report 0) are
+never written, in either mode.
+
+Pending counters stay authoritative for this process: :func:`current_counter`
+overlays them on the value read from the database before verification, and
+:func:`advance_counter` rejects a login verified against a counter that
+another login already moved.  Flushed counters only ever go up
+(``GREATEST(counter, new)``).  Logins of one credential racing in different
+processes within a flush interval are not detected as a conflict.
+"""
+
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import update_last_login
+from django.db import connection, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .db import run_with_retry
+from .models import PasskeyCredential
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    """Pending sign counters and ``last_login`` values, flushed in bulk."""
+
+    def __init__(self):
+        self._counters = {}
+        self._last_logins = {}
+        self._lock = threading.Lock()
+        # Serializes flushes, so a counter is never written out of order
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.skipped = 0
+        self.flushes = 0
+        self.flushed = 0
+        self.errors = 0
+        # Whatever is still buffered when the process exits
+        atexit.register(self._flush_logged)
+
+    def __len__(self):
+        return len(self._counters) + len(self._last_logins)
+
+    def counter(self, passkey):
+        """Return ``passkey``'s counter, including a change not yet written."""
+        pending = self._counters.get(passkey.pk)
+        return passkey.counter if pending is None else max(pending[0], passkey.counter)
+
+    def advance_counter(self, passkey, new_counter):
+        """Buffer ``new_counter`` unless another login moved the counter first."""
+        with self._lock:
+            pending = self._counters.get(passkey.pk)
+            # The same instance again means the login's transaction was retried
+            if pending and pending[1] is not passkey and pending[0] != passkey.counter:
+                return False
+            self._counters[passkey.pk] = (new_counter, passkey)
+        passkey.counter = new_counter
+        self._written()
+        return True
+
+    def record_login(self, user):
+        user.last_login = timezone.now()
+        with self._lock:
+            self._last_logins[user.pk] = user.last_login
+        self._written()
+
+    def _written(self):
+        self.start()
+        if len(self) >= settings.WRITE_BEHIND_MAX_PENDING:
+            if self._thread is not None:
+                self._wake.set()
+            else:
+                # No flush thread: write once the login's transaction commits
+                transaction.on_commit(self._flush_logged)
+
+    def start(self):
+        """Start the flush thread, unless it runs already or is disabled."""
+        if self._thread is not None or settings.WRITE_BEHIND_FLUSH_INTERVAL <= 0:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="login-write-behind", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(settings.WRITE_BEHIND_FLUSH_INTERVAL)
+            self._wake.clear()
+            try:
+                self._flush_logged()
+            finally:
+                connection.close()
+
+    def _flush_logged(self):
+        try:
+            self.flush()
+        except Exception:
+            # Changes were put back; the next flush tries again
+            logger.exception("Flushing buffered login writes failed")
+
+    def flush(self):
+        """Write every pending change; returns the number of rows updated."""
+        with self._flush_lock:
+            with self._lock:
+                counters, self._counters = self._counters, {}
+                last_logins, self._last_logins = self._last_logins, {}
+            if not counters and not last_logins:
+                return 0
+            try:
+                run_with_retry(_write, counters, last_logins)
+            except Exception:
+                self.errors += 1
+                # Put the changes back, behind any newer ones buffered since
+                with self._lock:
+                    for pk, pending in counters.items():
+                        self._counters.setdefault(pk, pending)
+                    for pk, value in last_logins.items():
+                        self._last_logins.setdefault(pk, value)
+                raise
+            self.flushes += 1
+            self.flushed += len(counters) + len(last_logins)
+            return len(counters) + len(last_logins)
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._last_logins.clear()
+
+    def stats(self):
+        return {
+            "pending_counters": len(self._counters),
+            "pending_last_logins": len(self._last_logins),
+            "skipped": self.skipped,
+            "flushes": self.flushes,
+            "flushed": self.flushed,
+            "errors": self.errors,
+        }
+
+
+def _write(counters, last_logins):
+    batch_size = settings.WRITE_BEHIND_MAX_PENDING
+    PasskeyCredential.objects.bulk_update(
+        [
+            PasskeyCredential(pk=pk, counter=Greatest(F("counter"), Value(value)))
+            for pk, (value, _) in counters.items()
+        ],
+        ["counter"],
+        batch_size=batch_size,
+    )
+    User = get_user_model()
+    User.objects.bulk_update(
+        [User(pk=pk, last_login=value) for pk, value in last_logins.items()],
+        ["last_login"],
+        batch_size=batch_size,
+    )
+
+
+login_writes = WriteBehindBuffer()
+
+
+def current_counter(passkey):
+    """Return the counter a login of ``passkey`` must be verified against."""
+    return login_writes.counter(passkey)
+
+
+def advance_counter(passkey, new_counter):
+    """Store or buffer ``new_counter``; ``False`` if the counter moved first."""
+    if new_counter == passkey.counter:
+        login_writes.skipped += 1
+        return True
+    if settings.LOGIN_WRITE_BEHIND:
+        return login_writes.advance_counter(passkey, new_counter)
+    return PasskeyCredential.objects.advance_counter(passkey, new_counter)
+
+
+def advance_counters(changes):
+    """:func:`advance_counter` for a ``{passkey: new_counter}`` mapping.
+
+    Returns the passkeys whose counter moved first.
+    """
+    changed = {}
+    for passkey, new_counter in changes.items():
+        if new_counter == passkey.counter:
+            login_writes.skipped += 1
+        else:
+            changed[passkey] = new_counter
+    if settings.LOGIN_WRITE_BEHIND:
+        return [
+            passkey for passkey, new_counter in changed.items()
+            if not login_writes.advance_counter(passkey, new_counter)
+        ]
+    return PasskeyCredential.objects.advance_counters(changed)
+
+
+def record_last_login(sender, user, **kwargs):
+    """``user_logged_in`` receiver replacing Django's ``update_last_login``."""
+    if settings.LOGIN_WRITE_BEHIND:
+        login_writes.record_login(user)
+    else:
+        update_last_login(sender, user, **kwargs)
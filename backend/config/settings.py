@@ -13,12 +13,16 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
 
 # SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = "django-insecure-change-this-in-production-1234567890"
+SECRET_KEY = os.environ.get(
+    "DJANGO_SECRET_KEY", "django-insecure-change-this-in-production-1234567890"
+)
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+# Set DJANGO_DEBUG=0 in production: with DEBUG on, every query is also kept
+# in connection.queries.
+DEBUG = os.environ.get("DJANGO_DEBUG", "1") == "1"
 
-ALLOWED_HOSTS = ["localhost", "127.0.0.1"]
+ALLOWED_HOSTS = os.environ.get("DJANGO_ALLOWED_HOSTS", "localhost,127.0.0.1").split(",")
 
 
 # Application definition
@@ -36,6 +40,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "auth_app.instrumentation.ServerTimingMiddleware",
+    "auth_app.ratelimit.RateLimitMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
@@ -70,12 +76,63 @@ WSGI_APPLICATION = "config.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+# DJANGO_DATABASE selects "sqlite" (default) or "postgresql".
+#
+# SQLite is tuned for concurrent logins: WAL lets reads run alongside the
+# single writer, IMMEDIATE transactions take the write lock up front so
+# busy_timeout applies instead of failing on a lock upgrade, and the caches
+# keep hot pages in memory. Connections are reused for CONN_MAX_AGE seconds
+# (default off under DEBUG, where runserver uses a thread per request).
+#
+# PostgreSQL is configured from the POSTGRES_* variables and uses psycopg's
+# connection pool (pip install -r requirements-postgres.txt); the pool
+# replaces persistent connections, so CONN_MAX_AGE stays 0.
+DATABASE_BACKEND = os.environ.get("DJANGO_DATABASE", "sqlite")
+
+if DATABASE_BACKEND == "postgresql":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get("POSTGRES_DB", "pasky"),
+            "USER": os.environ.get("POSTGRES_USER", "postgres"),
+            "PASSWORD": os.environ.get("POSTGRES_PASSWORD", ""),
+            "HOST": os.environ.get("POSTGRES_HOST", "localhost"),
+            "PORT": os.environ.get("POSTGRES_PORT", "5432"),
+            "OPTIONS": {
+                "pool": {
+                    "min_size": int(os.environ.get("POSTGRES_POOL_MIN_SIZE", "2")),
+                    "max_size": int(os.environ.get("POSTGRES_POOL_MAX_SIZE", "20")),
+                    # Seconds a request waits for a free connection
+                    "timeout": float(os.environ.get("POSTGRES_POOL_TIMEOUT", "10")),
+                },
+            },
+        }
     }
-}
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.environ.get("SQLITE_PATH", BASE_DIR / "db.sqlite3"),
+            "CONN_MAX_AGE": int(
+                os.environ.get("DJANGO_CONN_MAX_AGE", "0" if DEBUG else "600")
+            ),
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {
+                "transaction_mode": "IMMEDIATE",
+                "init_command": (
+                    "PRAGMA journal_mode=WAL;"
+                    "PRAGMA synchronous=NORMAL;"
+                    "PRAGMA busy_timeout=5000;"
+                    "PRAGMA cache_size=-20000;"
+                    "PRAGMA mmap_size=134217728;"
+                    "PRAGMA temp_store=MEMORY;"
+                ),
+            },
+        }
+    }
+    # Covering indexes (Index.include) are PostgreSQL-only; SQLite builds
+    # them as plain indexes, which is all it needs
+    SILENCED_SYSTEM_CHECKS = ["models.W040"]
 
 
 # Password validation
@@ -130,6 +187,16 @@ REST_FRAMEWORK = {
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",
     ],
+    # orjson-backed when installed, stdlib json otherwise
+    "DEFAULT_RENDERER_CLASSES": [
+        "auth_app.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "auth_app.renderers.FastJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
 }
 
 # CORS settings
@@ -152,3 +219,140 @@ CSRF_COOKIE_SAMESITE = "Lax"
 # WebAuthn settings
 RP_ID = "localhost"
 RP_NAME = "Pasky Auth App"
+
+# Ceremony timeout in milliseconds; pending challenges expire with it
+WEBAUTHN_TIMEOUT = 60000
+
+# Upper bound on pending challenges kept in memory per process
+CHALLENGE_STORE_MAX_ENTRIES = 10000
+
+# Where pending challenges live between the start and complete steps:
+# "memory" keeps them in this process, "token" returns an encrypted
+# challengeToken to the client so any worker can finish the ceremony.
+CHALLENGE_MODE = "memory"
+
+# Cache alias used to keep token-mode challenges single-use; point it at a
+# shared backend (Redis, Memcached) when running more than one worker
+CHALLENGE_REPLAY_CACHE = "default"
+
+# Serve the ceremony endpoints with the native async views (run under ASGI,
+# e.g. `uvicorn config.asgi:application`)
+ASYNC_VIEWS = False
+
+# Signature/attestation verification: "inline" runs on the request thread,
+# "process" uses a pool of VERIFICATION_WORKERS processes (0 = one per core)
+VERIFICATION_EXECUTOR = "inline"
+VERIFICATION_WORKERS = 0
+# Verifications allowed in flight before requests get 503 + Retry-After
+# (None = four per pool process; unbounded with the inline executor)
+VERIFICATION_MAX_PENDING = None
+# Seconds to wait for a pooled verification before giving up
+VERIFICATION_TIMEOUT = 5.0
+
+# Cache alias and TTL (seconds) for the per-username allowCredentials list
+# used by login_start; use a shared cache when running several workers
+CREDENTIAL_DESCRIPTOR_CACHE = "default"
+CREDENTIAL_DESCRIPTOR_TTL = 300
+
+# Allow login_start without a username: registration asks for discoverable
+# credentials and login_complete resolves the user from the user handle
+WEBAUTHN_DISCOVERABLE_LOGIN = False
+
+# Cache alias holding username/email reservations of pending registrations;
+# must be shared between workers for the reservation to hold across them.
+# A reservation missing from the cache does not block register_complete;
+# the unique constraints on username and email then settle a race.
+RESERVATION_CACHE = "default"
+
+# Time request phases and count queries per request, exported on /metrics;
+# SERVER_TIMING_HEADER also sends the phases to clients as Server-Timing
+REQUEST_INSTRUMENTATION = False
+SERVER_TIMING_HEADER = True
+# Bearer token a metrics scraper presents to /metrics; staff users signed
+# in to the admin may read it too, everyone else gets 403
+METRICS_TOKEN = os.environ.get("DJANGO_METRICS_TOKEN", "")
+
+# Where login sessions live: "db" (one row per session), "cached_db" (db
+# row, reads served from the cache), "cache" (no db writes; sessions are lost
+# when the cache is) or "signed_cookies" (no server-side storage; logout
+# cannot revoke a copied cookie). The cache modes use SESSION_CACHE_ALIAS,
+# which must be shared between workers. Expired db rows are removed with
+# `manage.py purge_sessions`.
+SESSION_MODE = "db"
+SESSION_ENGINE = {
+    "db": "django.contrib.sessions.backends.db",
+    "cached_db": "django.contrib.sessions.backends.cached_db",
+    "cache": "django.contrib.sessions.backends.cache",
+    "signed_cookies": "django.contrib.sessions.backends.signed_cookies",
+}[SESSION_MODE]
+SESSION_CACHE_ALIAS = "default"
+
+# Write transactions of register_complete and login_complete that fail with
+# "database is locked" are retried this many times, backing off from
+# DB_LOCK_RETRY_BACKOFF seconds (doubling, with jitter)
+DB_LOCK_RETRIES = 3
+DB_LOCK_RETRY_BACKOFF = 0.05
+
+# Per-process token-bucket limits, checked before the view runs. Keys are
+# the endpoint's URL name, then "ip", "username" or "challenge" (JSON body
+# fields); "<n>/<second|minute|hour|day>" allows bursts of n. At most
+# RATE_LIMIT_MAX_KEYS buckets are kept (least recently used are dropped).
+# Behind a reverse proxy, set RATE_LIMIT_TRUSTED_PROXIES to the number of
+# proxies appending to X-Forwarded-For; otherwise REMOTE_ADDR is used.
+# Off by default under DEBUG; DJANGO_RATE_LIMITING=1/0 overrides.
+RATE_LIMITING = os.environ.get("DJANGO_RATE_LIMITING", "0" if DEBUG else "1") == "1"
+RATE_LIMITS = {
+    "register_start": {"ip": "30/minute", "username": "10/minute"},
+    "register_complete": {"ip": "30/minute", "challenge": "3/minute"},
+    "login_start": {"ip": "60/minute", "username": "20/minute"},
+    "login_complete": {"ip": "60/minute", "challenge": "3/minute"},
+}
+RATE_LIMIT_MAX_KEYS = 100000
+RATE_LIMIT_TRUSTED_PROXIES = 0
+
+# Buffer sign counter and last_login writes of logins in memory and write
+# them in bulk every WRITE_BEHIND_FLUSH_INTERVAL seconds, or once
+# WRITE_BEHIND_MAX_PENDING changes are waiting (with an interval of 0 there
+# is no flush thread and the login reaching that many flushes the buffer).
+# Buffered changes are lost if the process is killed, and a cloned
+# credential used in two processes within one interval goes undetected.
+LOGIN_WRITE_BEHIND = False
+WRITE_BEHIND_FLUSH_INTERVAL = 1.0
+WRITE_BEHIND_MAX_PENDING = 500
+
+# Cache alias and TTL (seconds) of the per-user snapshot that authenticates
+# user_info without loading the User row; use a shared cache when running
+# several workers, or a change made through one worker shows up in the others
+# only after the TTL
+USER_SNAPSHOT_CACHE = "default"
+USER_SNAPSHOT_TTL = 300
+
+# Compiled FIDO metadata index (built with `manage.py load_mds`). When set,
+# registration attestations are checked against the roots listed for the
+# authenticator's AAGUID and compromised authenticators are refused; the
+# file is re-read within MDS_RELOAD_INTERVAL seconds of being replaced.
+# WEBAUTHN_REQUIRE_ATTESTATION asks for direct attestation and refuses
+# authenticators that are not in the index or send no certificate chain.
+MDS_INDEX_PATH = os.environ.get("MDS_INDEX_PATH") or None
+MDS_RELOAD_INTERVAL = 30
+WEBAUTHN_REQUIRE_ATTESTATION = False
+
+# Bearer token that services (e.g. an API gateway) present to
+# POST /api/auth/assertions/verify/, which checks up to
+# ASSERTION_BATCH_MAX_ITEMS login assertions per request without creating
+# sessions; the endpoint refuses every request while the token is empty
+ASSERTION_BATCH_TOKEN = os.environ.get("DJANGO_ASSERTION_BATCH_TOKEN", "")
+ASSERTION_BATCH_MAX_ITEMS = 100
+
+# Return a short-lived Ed25519-signed access token (a JWT with the user id,
+# username and credential ID) from register_complete and login_complete;
+# POST /api/auth/token/refresh/ issues a new one for the session. Services
+# verify tokens offline with auth_app/token_verifier.py and the key published
+# at /api/auth/jwks.json. Tokens cannot be revoked before they expire, not
+# even by logging out. The signing key is DJANGO_ACCESS_TOKEN_PRIVATE_KEY (an
+# Ed25519 private key in PEM), required with DEBUG off; in development it may
+# be derived from DJANGO_SECRET_KEY, but never from the insecure default.
+ACCESS_TOKENS = False
+ACCESS_TOKEN_TTL = 300
+ACCESS_TOKEN_ISSUER = RP_ID
+ACCESS_TOKEN_PRIVATE_KEY = os.environ.get("DJANGO_ACCESS_TOKEN_PRIVATE_KEY") or None
@@ -4,8 +4,11 @@ URL configuration for config project.
 from django.contrib import admin
 from django.urls import path, include
 
+from auth_app.instrumentation import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('auth_app.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
 
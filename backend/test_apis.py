@@ -135,7 +135,7 @@ def main():
         print("\n⚠️  To test COMPLETE endpoints:")
         print("   1. Use the React frontend at http://localhost:3000")
         print("   2. Or use a browser with WebAuthn support")
-        print("   3. Or implement full WebAuthn credential creation in Python")
+        print("   3. Or run: python manage.py loadtest --url http://localhost:8000/api/auth/")
         print("="*60 + "\n")
         
     except requests.exceptions.ConnectionError:
@@ -33,7 +33,11 @@ const Login: React.FC = () => {
 
       // Step 3: Send credential to server
       const credentialJSON = credentialToJSON(credential);
-      const result = await authApi.registerComplete(credentialJSON, options.challenge);
+      const result = await authApi.registerComplete(
+        credentialJSON,
+        options.challenge,
+        options.challengeToken
+      );
 
       // Step 4: Update auth state and redirect
       await checkAuth();
@@ -65,7 +69,11 @@ const Login: React.FC = () => {
 
       // Step 3: Send credential to server
       const credentialJSON = credentialToJSON(credential);
-      const result = await authApi.loginComplete(credentialJSON, options.challenge);
+      const result = await authApi.loginComplete(
+        credentialJSON,
+        options.challenge,
+        options.challengeToken
+      );
 
       // Step 4: Update auth state and redirect
       await checkAuth();
@@ -80,6 +80,7 @@ export interface RegisterStartResponse {
   };
   timeout: number;
   attestation: string;
+  challengeToken?: string;
 }
 
 export interface LoginStartResponse {
@@ -91,6 +92,7 @@ export interface LoginStartResponse {
   timeout: number;
   userVerification: string;
   rpId: string;
+  challengeToken?: string;
 }
 
 export interface AuthResponse {
@@ -120,11 +122,13 @@ export const authApi = {
 
   registerComplete: async (
     credential: any,
-    challenge: string
+    challenge: string,
+    challengeToken?: string
   ): Promise<AuthResponse> => {
     const response = await api.post<AuthResponse>("/auth/register/complete/", {
       credential,
       challenge,
+      challengeToken,
     });
     return response.data;
   },
@@ -138,11 +142,13 @@ export const authApi = {
 
   loginComplete: async (
     credential: any,
-    challenge: string
+    challenge: string,
+    challengeToken?: string
   ): Promise<AuthResponse> => {
     const response = await api.post<AuthResponse>("/auth/login/complete/", {
       credential,
       challenge,
+      challengeToken,
     });
     return response.data;
   },